@@ -0,0 +1,160 @@
+"""
+Streaming limit alarms for telemetry records.
+
+Each limited field is checked on every record. An alarm is raised once the value has been
+beyond a limit for `debounce` consecutive records, by default on the first record beyond it,
+so an alarm goes out within one packet interval. It is only cleared once the value has been
+back inside the limit by at least the hysteresis margin for `clear_debounce` consecutive
+records, so a noisy channel sitting on a limit does not flap. A `debounce` above 1 filters
+single-packet glitches, at the cost of raising alarms that many packets later.
+"""
+
+import math
+from dataclasses import asdict, dataclass
+from typing import Literal, Mapping
+
+# Hysteresis margin as a fraction of the limit span (or of the limit itself, if one sided)
+DEFAULT_HYSTERESIS = 0.02
+DEFAULT_DEBOUNCE = 1
+DEFAULT_CLEAR_DEBOUNCE = 3
+
+AlarmState = Literal["ok", "low", "high"]
+
+
+@dataclass
+class AlarmEvent:
+    """Class representing a change of alarm state of a record field
+
+    Attributes:
+        field(str): name of the record field
+        state(Literal["ok", "low", "high"]): the new state, "ok" when the alarm clears
+        value(float): the value of the field that caused the change
+        limit(float | None): the limit that was crossed, None when the alarm clears
+        time(float): time of the record in ms since epoch
+    """
+
+    field: str
+    state: AlarmState
+    value: float
+    limit: float | None
+    time: float
+
+    def to_dict(self) -> dict:
+        """Convert the event to a plain dictionary."""
+        return asdict(self)
+
+
+class _FieldAlarm:
+    """Debounced, hysteretic alarm state of a single field."""
+
+    __slots__ = ("field", "low", "high", "margin", "state", "pending", "count")
+
+    def __init__(
+        self, field: str, low: float | None, high: float | None, hysteresis: float
+    ):
+        self.field = field
+        self.low = low
+        self.high = high
+        if low is not None and high is not None:
+            span = high - low
+        else:
+            span = abs(low if low is not None else high) or 1.0
+        self.margin = span * hysteresis
+        self.state: AlarmState = "ok"
+        self.pending: AlarmState = "ok"
+        self.count = 0
+
+    def target(self, value: float) -> AlarmState:
+        """The state the value calls for, given the current state."""
+        high, low = self.high, self.low
+        if high is not None and (
+            value > high or (self.state == "high" and value > high - self.margin)
+        ):
+            return "high"
+        if low is not None and (
+            value < low or (self.state == "low" and value < low + self.margin)
+        ):
+            return "low"
+        return "ok"
+
+
+class AlarmEngine:
+    """
+    Evaluates the alarm limits of a car against every record.
+
+    Args:
+        limits(dict[str, tuple[float | None, float | None]]): (min, max) limits keyed by
+            record field name, see ConfigurationGenerator.get_limits
+        hysteresis(float): margin a value must move back inside a limit to clear an alarm,
+            as a fraction of the limit span
+        debounce(int): consecutive records beyond a limit needed to raise an alarm
+        clear_debounce(int): consecutive records back inside a limit needed to clear an alarm
+
+    Raises:
+        ValueError: If a limit is inverted or a debounce is not positive.
+    """
+
+    def __init__(
+        self,
+        limits: dict[str, tuple[float | None, float | None]],
+        hysteresis: float = DEFAULT_HYSTERESIS,
+        debounce: int = DEFAULT_DEBOUNCE,
+        clear_debounce: int = DEFAULT_CLEAR_DEBOUNCE,
+    ):
+        if min(debounce, clear_debounce) < 1:
+            raise ValueError(
+                f"Alarm debounce must be at least 1, got {debounce} and {clear_debounce}"
+            )
+        for name, (low, high) in limits.items():
+            if low is not None and high is not None and low > high:
+                raise ValueError(f"Alarm limits of {name} are inverted: {low} > {high}")
+        self._debounce = debounce
+        self._clear_debounce = clear_debounce
+        self._alarms = tuple(
+            _FieldAlarm(name, low, high, hysteresis)
+            for name, (low, high) in limits.items()
+            if low is not None or high is not None
+        )
+
+    @property
+    def active(self) -> dict[str, AlarmState]:
+        """The fields currently in alarm and their state."""
+        return {
+            alarm.field: alarm.state for alarm in self._alarms if alarm.state != "ok"
+        }
+
+    def check(self, record: Mapping) -> list[AlarmEvent]:
+        """
+        Update the alarm states with a record.
+
+        Fields missing from the record and non-finite values are ignored.
+
+        Args:
+            record(Mapping): a data record with a "time" field
+
+        Returns:
+            list[AlarmEvent]: the alarms raised or cleared by this record, usually empty
+        """
+        events = []
+        for alarm in self._alarms:
+            value = record.get(alarm.field)
+            if value is None or not math.isfinite(value):
+                continue
+            target = alarm.target(value)
+            if target == alarm.state:
+                alarm.count = 0
+                continue
+            if target == alarm.pending and alarm.count:
+                alarm.count += 1
+            else:
+                alarm.pending = target
+                alarm.count = 1
+            needed = self._clear_debounce if target == "ok" else self._debounce
+            if alarm.count >= needed:
+                alarm.state = target
+                alarm.count = 0
+                limit = {"high": alarm.high, "low": alarm.low, "ok": None}[target]
+                events.append(
+                    AlarmEvent(alarm.field, target, value, limit, record["time"])
+                )
+        return events
@@ -0,0 +1,212 @@
+"""
+Background writing for slow sinks.
+
+SD card writes on the Pi can stall for hundreds of milliseconds. A BackgroundWriter moves
+a sink's writes onto a dedicated thread behind a bounded queue, so a stalled write delays
+only the writer thread and never the serial reads or the display.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Literal, Mapping
+
+from data_transmitter import DataTransmitter, TransmitterError
+
+OverflowPolicy = Literal["block", "drop_oldest", "drop_newest"]
+OVERFLOW_POLICIES = ("block", "drop_oldest", "drop_newest")
+
+
+class BackgroundWriter(DataTransmitter):
+    """
+    Wraps a transmitter so its records are written by a dedicated thread.
+
+    The wrapped sink is only used from the writer thread. Its flush_if_due is called by
+    the thread whenever the queue is idle and at least every flush_interval seconds, and
+    its close once the queue has drained after close is called.
+
+    Args:
+        sink(DataTransmitter): the transmitter doing the actual writes, e.g. a LocalTransmitter
+        max_queue(int): the most records waiting to be written
+        overflow(str): what to do with a new record when the queue is full. "block" waits
+            for room, "drop_oldest" discards the oldest waiting record and "drop_newest"
+            discards the new record. Discarded records are counted in the stats.
+        flush_interval(float): longest time in seconds between flush_if_due calls
+
+    Raises:
+        ValueError: If the queue size or overflow policy is invalid.
+    """
+
+    def __init__(
+        self,
+        sink: DataTransmitter,
+        max_queue: int = 10000,
+        overflow: OverflowPolicy = "drop_oldest",
+        flush_interval: float = 1.0,
+    ):
+        if max_queue < 1:
+            raise ValueError(f"Queue size must be at least 1, got {max_queue}")
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Invalid overflow policy: {overflow}")
+        self._sink = sink
+        self._max_queue = max_queue
+        self._overflow = overflow
+        self._flush_interval = flush_interval
+
+        self._queue: deque[Mapping] = deque()
+        self._condition = threading.Condition()
+        self._closing = False
+        self._error: Exception | None = None
+        self._close_error: Exception | None = None
+
+        self._max_depth = 0
+        self._dropped = 0
+        self._written = 0
+        self._errors = 0
+        self._last_write_ms = 0.0
+        self._max_write_ms = 0.0
+        self._total_write_ms = 0.0
+        self._writes = 0
+
+        self._thread = threading.Thread(
+            target=self._run, name="background-writer", daemon=True
+        )
+        self._thread.start()
+
+    def handle_record(self, data: Mapping):
+        """
+        Queue the data record for the writer thread.
+
+        Args:
+            data(Mapping): the data record to be written
+
+        Raises:
+            TransmitterError: If the writer is closed, or the writer thread failed to write
+                a previous record. Each failure is reported once.
+        """
+        with self._condition:
+            if self._closing:
+                raise TransmitterError("Background writer is closed")
+            error, self._error = self._error, None
+            if len(self._queue) >= self._max_queue:
+                if self._overflow == "drop_newest":
+                    self._dropped += 1
+                    data = None
+                elif self._overflow == "drop_oldest":
+                    self._queue.popleft()
+                    self._dropped += 1
+                else:
+                    self._condition.wait_for(
+                        lambda: len(self._queue) < self._max_queue or self._closing
+                    )
+                    if self._closing:
+                        raise TransmitterError("Background writer is closed")
+            if data is not None:
+                self._queue.append(data)
+                self._max_depth = max(self._max_depth, len(self._queue))
+                self._condition.notify_all()
+        if error is not None:
+            raise TransmitterError(f"Background write failed: {error}") from error
+
+    def flush_if_due(self):
+        """Flushing is handled by the writer thread, so this does nothing."""
+
+    def stats(self) -> dict[str, float]:
+        """
+        Queue and write metrics of the writer.
+
+        Returns:
+            dict[str, float]: the current queue depth, the deepest the queue has been, the
+                records written, dropped and failed, and the last and mean time in ms the
+                sink took per record, and the longest time any write or flush took.
+        """
+        with self._condition:
+            return {
+                "queue_depth": len(self._queue),
+                "max_queue_depth": self._max_depth,
+                "written": self._written,
+                "dropped": self._dropped,
+                "errors": self._errors,
+                "last_write_ms": self._last_write_ms,
+                "max_write_ms": self._max_write_ms,
+                "mean_write_ms": self._total_write_ms / self._writes
+                if self._writes
+                else 0.0,
+            }
+
+    def close(self, timeout: float | None = 10.0):
+        """
+        Write the queued records, then stop the writer thread, which closes the sink.
+
+        If the thread is still writing after the timeout, e.g. stalled on the SD card, the
+        sink is left to the thread and closed once the queue has drained.
+
+        Args:
+            timeout(float | None): longest time in seconds to wait for the queue to drain
+
+        Raises:
+            TransmitterError: If the sink fails to close.
+        """
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            print(
+                f"Background writer still writing after {timeout} s, "
+                "the sink is closed once the queue has drained"
+            )
+            return
+        if self._close_error is not None:
+            raise self._close_error
+
+    def _run(self):
+        """Writer thread, drains the queue into the sink until closed."""
+        while True:
+            with self._condition:
+                if not self._queue and not self._closing:
+                    self._condition.wait(self._flush_interval)
+                batch = list(self._queue)
+                self._queue.clear()
+                closing = self._closing
+                # Wake producers blocked on a full queue
+                self._condition.notify_all()
+
+            for record in batch:
+                self._write(self._sink.handle_record, record)
+            self._write(self._sink.flush_if_due)
+            if closing and not batch:
+                self._close_sink()
+                return
+
+    def _close_sink(self):
+        """Close the sink from the writer thread, keeping any failure for close."""
+        close = getattr(self._sink, "close", None)
+        if close is None:
+            return
+        try:
+            close()
+        except Exception as exc:  # raised by close in the caller's thread
+            self._close_error = exc
+
+    def _write(self, write, *args):
+        """Call a sink method, timing it and keeping any failure for the producer."""
+        start = time.perf_counter()
+        try:
+            write(*args)
+            failed = None
+        except Exception as exc:  # reported to the producer on its next record
+            failed = exc
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._condition:
+            # Periodic flushes only count towards the longest write
+            self._max_write_ms = max(self._max_write_ms, elapsed_ms)
+            if args:
+                self._last_write_ms = elapsed_ms
+                self._total_write_ms += elapsed_ms
+                self._writes += 1
+            if failed is not None:
+                self._errors += 1
+                self._error = failed
+            elif args:
+                self._written += 1
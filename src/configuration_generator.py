@@ -1,7 +1,9 @@
+import hashlib
 import json
-from dataclasses import dataclass
+import struct
+from dataclasses import dataclass, field
 from os import getenv
-from typing import List, Literal
+from typing import Callable, List, Literal
 
 
 @dataclass
@@ -75,6 +77,187 @@ class Metadata:
         )
 
 
+# struct format characters allowed in a packet layout
+PACKET_FIELD_TYPES = "bBhHiIfd"
+
+
+@dataclass
+class PacketField:
+    """Class representing a single value in the data packet sent by the Arduino
+
+    A field is either hardcoded, with a fixed output name, or configurable, feeding the
+    sensor configured for its channel.
+
+    Attributes:
+        type(str): struct format character of the value on the wire, one of "bBhHiIfd"
+        name(str | None): output name of a hardcoded field
+        channel(str | None): sensor channel of a configurable field, e.g. "channelA0"
+        scale(float): multiplier applied to a hardcoded field
+        round(int | None): number of decimals a hardcoded field is rounded to
+    """
+
+    type: str
+    name: str | None = None
+    channel: str | None = None
+    scale: float = 1.0
+    round: int | None = None
+
+    def __post_init__(self):
+        # Field Validation
+        if self.type not in PACKET_FIELD_TYPES or len(self.type) != 1:
+            raise ValueError(f"Invalid packet field type: {self.type}")
+        if (self.name is None) == (self.channel is None):
+            raise ValueError(
+                "Packet field must have exactly one of a name or a channel"
+            )
+
+    @property
+    def key(self) -> str:
+        """The name or channel identifying this field"""
+        return self.name if self.name is not None else self.channel
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PacketField":
+        """Create a PacketField instance from a dictionary"""
+        return cls(
+            type=data.get("type"),
+            name=data.get("name", None),
+            channel=data.get("channel", None),
+            scale=data.get("scale", 1.0),
+            round=data.get("round", None),
+        )
+
+
+@dataclass
+class PacketLayout:
+    """Class representing the layout of the data packet sent by the Arduino
+
+    Attributes:
+        fields(list[PacketField]): the packet values in wire order, little-endian and unpadded
+    """
+
+    fields: list[PacketField]
+
+    def __post_init__(self):
+        # Field Validation
+        keys = [packet_field.key for packet_field in self.fields]
+        if len(set(keys)) != len(keys):
+            raise ValueError("Packet layout has duplicate fields")
+        if "speed" not in keys:
+            raise ValueError("Packet layout must include a speed field")
+
+    @property
+    def format(self) -> str:
+        """The struct format string of the packet"""
+        return "<" + "".join(packet_field.type for packet_field in self.fields)
+
+    @property
+    def size(self) -> int:
+        """The size of the packet in bytes"""
+        return struct.calcsize(self.format)
+
+    def pack(self, values: dict[str, float]) -> bytes:
+        """
+        Build a raw packet, mainly for testing and simulation.
+
+        Args:
+            values(dict[str, float]): raw wire values keyed by field name or channel.
+                Missing fields are sent as zero.
+
+        Returns:
+            bytes: the packet as the Arduino would send it
+        """
+        raw = []
+        for packet_field in self.fields:
+            value = values.get(packet_field.key, 0)
+            raw.append(value if packet_field.type in "fd" else int(value))
+        return struct.pack(self.format, *raw)
+
+    @classmethod
+    def from_list(cls, data: list[dict]) -> "PacketLayout":
+        """Create a PacketLayout instance from a list of field dictionaries"""
+        return cls(fields=[PacketField.from_dict(item) for item in data])
+
+
+# The packet sent by the original Arduino firmware: "<ffffBBBBBH"
+DEFAULT_PACKET_LAYOUT = PacketLayout(
+    fields=[
+        PacketField(type="f", name="speed", round=2),
+        PacketField(type="f", name="airspeed", round=2),
+        PacketField(type="f", name="engine_temp", round=2),
+        PacketField(type="f", name="rad_temp", round=2),
+        PacketField(type="B", channel="channel0"),
+        PacketField(type="B", channel="channel1"),
+        PacketField(type="B", channel="channel2"),
+        PacketField(type="B", channel="channel3"),
+        PacketField(type="B", channel="channel4"),
+        PacketField(type="H", channel="channelA0"),
+    ]
+)
+
+
+# Derived channel types and the sources each one reads by default
+DERIVED_CHANNEL_TYPES = {
+    "acceleration": ["speed"],
+    "rolling_mean": None,
+    "product": None,
+    "road_load_power": ["speed"],
+    "energy_per_distance": None,
+}
+
+
+@dataclass
+class DerivedField:
+    """Class representing a channel computed from other channels of each record
+
+    Attributes:
+        name(str): output name of the channel
+        type(str): kind of computation, one of DERIVED_CHANNEL_TYPES
+        sources(list[str]): names of the record fields the channel is computed from
+        window(float | None): length in seconds of the trailing window, where used
+        scale(float): multiplier applied to the computed value
+        round(int | None): number of decimals the value is rounded to
+        params(dict): type specific settings, e.g. frontal_area for road_load_power
+    """
+
+    name: str
+    type: str
+    sources: list[str] = field(default_factory=list)
+    window: float | None = None
+    scale: float = 1.0
+    round: int | None = None
+    params: dict = field(default_factory=dict)
+
+    def __post_init__(self):
+        # Field Validation
+        if not self.name:
+            raise ValueError("Derived channel must have a name")
+        if self.type not in DERIVED_CHANNEL_TYPES:
+            raise ValueError(f"Invalid derived channel type: {self.type}")
+        if not self.sources:
+            if DERIVED_CHANNEL_TYPES[self.type] is None:
+                raise ValueError(f"Derived channel {self.name} must have a source")
+            self.sources = list(DERIVED_CHANNEL_TYPES[self.type])
+        if self.window is not None and self.window <= 0:
+            raise ValueError(f"Derived channel {self.name} window must be positive")
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "DerivedField":
+        """Create a DerivedField instance from a dictionary"""
+        sources = data.get("sources", None)
+        if sources is None and data.get("source", None) is not None:
+            sources = [data["source"]]
+        return cls(
+            name=data.get("name"),
+            type=data.get("type"),
+            sources=list(sources or []),
+            window=data.get("window", None),
+            scale=data.get("scale", 1.0),
+            round=data.get("round", None),
+            params=data.get("params", {}),
+        )
+
+
 @dataclass
 class Car:
     """Class representing a car configuration
@@ -85,6 +268,12 @@ class Car:
         theme(str): the name of the color profile for the display
         sensors(dict[str, Sensor]): dictionary of sensors for the car
         metadata(Metadata): collection of misc. metadata for the car
+        packet_layout(PacketLayout): layout of the data packet sent by the car's Arduino
+        derived(list[DerivedField]): channels computed from each record, in order
+        limits(dict[str, tuple[float | None, float | None]]): (min, max) alarm limits of
+            record fields that are not sensors, e.g. engine_temp, keyed by field name
+        config_hash(str | None): SHA-256 of the car's configuration, identifying the exact
+            configuration data was recorded with
     """
 
     name: str
@@ -92,6 +281,10 @@ class Car:
     theme: str
     sensors: dict[str, Sensor]
     metadata: Metadata
+    packet_layout: PacketLayout = field(default_factory=lambda: DEFAULT_PACKET_LAYOUT)
+    derived: list[DerivedField] = field(default_factory=list)
+    limits: dict[str, tuple[float | None, float | None]] = field(default_factory=dict)
+    config_hash: str | None = field(default=None, compare=False)
 
 
 class ConfigurationGeneratorError(Exception):
@@ -122,6 +315,7 @@ class ConfigurationGenerator:
                 "CONFIG_FILE_PATH must be provided in the environment or passed to the generator."
             )
         self.config: List[Car] = []
+        self._update_callbacks: List[Callable[[], None]] = []
         self._load_config()
 
     def _load_config(self) -> None:
@@ -155,6 +349,40 @@ class ConfigurationGenerator:
                     )
                 metadata_obj = Metadata.from_dict(metadata)
 
+                # Load packet layout, cars without one use the original firmware layout
+                layout: list | None = car.get("packet_layout", None)
+                try:
+                    layout_obj = (
+                        PacketLayout.from_list(layout)
+                        if layout is not None
+                        else DEFAULT_PACKET_LAYOUT
+                    )
+                except (ValueError, TypeError, AttributeError) as exc:
+                    raise ConfigurationGeneratorError(
+                        f"Invalid packet layout for car {car_name}: {exc}"
+                    ) from exc
+
+                # Load derived channels, computed in order from each record
+                derived: list = car.get("derived", [])
+                try:
+                    derived_list = [DerivedField.from_dict(item) for item in derived]
+                except (ValueError, TypeError, AttributeError) as exc:
+                    raise ConfigurationGeneratorError(
+                        f"Invalid derived channel for car {car_name}: {exc}"
+                    ) from exc
+
+                # Load alarm limits of hardcoded and derived fields
+                limits: dict = car.get("limits", {})
+                try:
+                    limits_dict = {
+                        name: (limit.get("min", None), limit.get("max", None))
+                        for name, limit in limits.items()
+                    }
+                except AttributeError as exc:
+                    raise ConfigurationGeneratorError(
+                        f"Invalid limits for car {car_name}: {exc}"
+                    ) from exc
+
                 # Create Car object
                 car_obj: Car = Car(
                     name=car_name,
@@ -162,6 +390,12 @@ class ConfigurationGenerator:
                     theme=car.get("theme", "default"),
                     sensors=sensor_list,
                     metadata=metadata_obj,
+                    packet_layout=layout_obj,
+                    derived=derived_list,
+                    limits=limits_dict,
+                    config_hash=hashlib.sha256(
+                        json.dumps(car, sort_keys=True).encode()
+                    ).hexdigest(),
                 )
                 self.config.append(car_obj)
 
@@ -178,16 +412,7 @@ class ConfigurationGenerator:
         Raises:
             ConfigurationGeneratorError: If the requested car is not found in the configuration.
         """
-        # Return active car if no name provided
-        if car_name is None:
-            for car in self.config:
-                if car.active:
-                    return car.sensors
-        # Otherwise, return specified car
-        for car in self.config:
-            if car.name == car_name:
-                return car.sensors
-        raise ConfigurationGeneratorError(f"Car not found: {car_name}")
+        return self._find_car(car_name).sensors
 
     def get_metadata(self, car_name: str | None = None) -> Metadata:
         """
@@ -202,21 +427,127 @@ class ConfigurationGenerator:
         Raises:
             ConfigurationGeneratorError: If the requested car is not found in the configuration.
         """
-        # Return active car if no name provided
+        return self._find_car(car_name).metadata
+
+    def get_packet_layout(self, car_name: str | None = None) -> PacketLayout:
+        """
+        Get the data packet layout for a specified car
+
+        Args:
+            car_name(str | None): Optional, name of the car to get information for
+
+        Returns:
+            PacketLayout: the layout of the packets sent by the requested car
+
+        Raises:
+            ConfigurationGeneratorError: If the requested car is not found in the configuration.
+        """
+        return self._find_car(car_name).packet_layout
+
+    def get_derived(self, car_name: str | None = None) -> list[DerivedField]:
+        """
+        Get the derived channels for a specified car
+
+        Args:
+            car_name(str | None): Optional, name of the car to get information for
+
+        Returns:
+            list[DerivedField]: the channels computed from each record of the requested car
+
+        Raises:
+            ConfigurationGeneratorError: If the requested car is not found in the configuration.
+        """
+        return self._find_car(car_name).derived
+
+    def get_limits(
+        self, car_name: str | None = None
+    ) -> dict[str, tuple[float | None, float | None]]:
+        """
+        Get the alarm limits for a specified car, for sensors and other record fields alike
+
+        Args:
+            car_name(str | None): Optional, name of the car to get information for
+
+        Returns:
+            dict[str, tuple[float | None, float | None]]: (min, max) limits keyed by record
+                field name. Fields without any limit are left out.
+
+        Raises:
+            ConfigurationGeneratorError: If the requested car is not found in the configuration.
+        """
+        car = self._find_car(car_name)
+        limits = {
+            sensor.name: (sensor.limit_min, sensor.limit_max)
+            for sensor in car.sensors.values()
+        }
+        limits.update(car.limits)
+        return {
+            name: limit
+            for name, limit in limits.items()
+            if limit[0] is not None or limit[1] is not None
+        }
+
+    def get_car_name(self, car_name: str | None = None) -> str:
+        """
+        Get the name of a specified car, useful to resolve the active car
+
+        Args:
+            car_name(str | None): Optional, name of the car to get information for
+
+        Returns:
+            str: the name of the requested car
+
+        Raises:
+            ConfigurationGeneratorError: If the requested car is not found in the configuration.
+        """
+        return self._find_car(car_name).name
+
+    def get_config_hash(self, car_name: str | None = None) -> str:
+        """
+        Get the configuration hash of a specified car
+
+        Args:
+            car_name(str | None): Optional, name of the car to get information for
+
+        Returns:
+            str: SHA-256 hex digest of the requested car's configuration
+
+        Raises:
+            ConfigurationGeneratorError: If the requested car is not found in the configuration.
+        """
+        return self._find_car(car_name).config_hash
+
+    def _find_car(self, car_name: str | None) -> Car:
+        """Find the named car, or the active car if no name is provided"""
+        # The most recently loaded definition wins, e.g. after update_config
+        cars = list(reversed(self.config))
+        car = None
         if car_name is None:
-            for car in self.config:
-                if car.active:
-                    return car.metadata
-        # Otherwise, return specified car
-        for car in self.config:
-            if car.name == car_name:
-                return car.metadata
-        raise ConfigurationGeneratorError(f"Car not found: {car_name}")
+            car = next((car for car in cars if car.active), None)
+        if car is None:
+            car = next((car for car in cars if car.name == car_name), None)
+        if car is None:
+            raise ConfigurationGeneratorError(f"Car not found: {car_name}")
+        return car
+
+    def add_update_callback(self, callback: Callable[[], None]) -> None:
+        """
+        Call a function after every successful configuration update.
+
+        Updates usually arrive on the MQTT thread, which the callback is called from.
+
+        Args:
+            callback(Callable[[], None]): e.g. recompiles the DataReader decode plan
+        """
+        self._update_callbacks.append(callback)
 
     def update_config(self, config_string: str) -> None:
         """
         Update the configuration stored in the JSON and reload it into the generator.
 
+        The update callbacks are called once the new configuration is loaded, see
+        add_update_callback.
+
         Args:
             config_string(str): the new configuration as a JSON string
         """
@@ -226,6 +557,8 @@ class ConfigurationGenerator:
                 json.dump(config_dict, config_file, indent=4)
             self._load_config()
             print("Configuration updated successfully")
+            for callback in self._update_callbacks:
+                callback()
         except json.JSONDecodeError as exc:
             raise ConfigurationGeneratorError(
                 f"Invalid JSON string provided for configuration update: {exc}"
@@ -233,4 +566,4 @@ class ConfigurationGenerator:
         except OSError as exc:
             raise ConfigurationGeneratorError(
                 f"Problem writing updated configuration to file: {exc}"
-            ) from exc
\ No newline at end of file
+            ) from exc
@@ -1,33 +1,175 @@
-import datetime
-import math
 import struct
+from functools import partial
+from operator import mul
 
-from configuration_generator import Sensor
+from configuration_generator import (
+    DEFAULT_PACKET_LAYOUT,
+    DerivedField,
+    Metadata,
+    PacketLayout,
+    Sensor,
+)
+from derived_channels import DerivedChannels
+from telemetry_clock import Odometer, TelemetryClock
+from telemetry_record import RecordSchema, TelemetryRecord
+
+
+def _make_converter(field_type: str, scale: float, digits: int | None):
+    """
+    Build the function converting a raw packet value into its output value.
+
+    8-bit values are converted through a precomputed 256-entry lookup table.
+    """
+    if digits is None:
+        convert = partial(mul, scale)
+    elif scale == 1.0:
+        convert = partial(round, ndigits=digits)
+    else:
+
+        def convert(raw):
+            return round(raw * scale, digits)
+
+    if field_type == "B":
+        return tuple(convert(raw) for raw in range(256)).__getitem__
+    if field_type == "b":
+        # Negative values index from the end of the table
+        return tuple(
+            convert(raw if raw < 128 else raw - 256) for raw in range(256)
+        ).__getitem__
+    return convert
 
 
 class DataReader:
     """
     Processes Arduino data packets and outputs data structures based on the car configuration.
 
+    The packet layout and sensor configuration are compiled once into a fixed decode plan,
+    so decoding a packet is a single unpack followed by one conversion per output field.
+
+    Packets are stamped with a monotonic clock; records carry wall clock time in ms since
+    epoch, and the distance traveled is integrated from the monotonic stamps.
+
     Args:
         sensors(dict[str, Sensor]): the current car sensor configuration
+        layout(PacketLayout, optional): the layout of the packets sent by the car.
+            Defaults to the original "<ffffBBBBBH" firmware layout.
+        clock(TelemetryClock, optional): the clock used to stamp packets
+        derived(list[DerivedField], optional): channels computed from each record
+        metadata(Metadata, optional): the car metadata, used by some derived channels
     """
 
-    def __init__(self, sensors: dict[str, Sensor]):
+    def __init__(
+        self,
+        sensors: dict[str, Sensor],
+        layout: PacketLayout = DEFAULT_PACKET_LAYOUT,
+        clock: TelemetryClock | None = None,
+        derived: list[DerivedField] | None = None,
+        metadata: Metadata | None = None,
+    ):
+        self._clock = clock if clock is not None else TelemetryClock()
+        self._odometer = Odometer()
+        self._derived_fields = derived or []
+        self._metadata = metadata
+        self._layout = layout
+        self.update_sensors(sensors)
+
+    def update_sensors(
+        self,
+        sensors: dict[str, Sensor],
+        layout: PacketLayout | None = None,
+        derived: list[DerivedField] | None = None,
+        metadata: Metadata | None = None,
+    ):
+        """
+        Compile a sensor configuration into the decode plan used for every packet.
+
+        Call this whenever the car configuration changes.
+
+        Args:
+            sensors(dict[str, Sensor]): the new car sensor configuration
+            layout(PacketLayout, optional): the new packet layout, defaults to keeping the current one
+            derived(list[DerivedField], optional): the new derived channels, defaults to keeping the current ones
+            metadata(Metadata, optional): the new car metadata, defaults to keeping the current one
+
+        Raises:
+            ValueError: If a derived channel cannot be computed from the record fields.
+        """
+        # Compile everything before assigning any of it, so a rejected configuration
+        # leaves the current one in place
+        derived_fields = derived if derived is not None else self._derived_fields
+        metadata = metadata if metadata is not None else self._metadata
+        layout = layout if layout is not None else self._layout
+        packet_struct = struct.Struct(layout.format)
+
+        # (output name, index in the unpacked packet, wire type, scale, decimals)
+        columns = []
+        channels = {}
+        for index, packet_field in enumerate(layout.fields):
+            if packet_field.name is not None:
+                columns.append(
+                    (
+                        packet_field.name,
+                        index,
+                        packet_field.type,
+                        packet_field.scale,
+                        packet_field.round,
+                    )
+                )
+            else:
+                channels[packet_field.channel] = (index, packet_field.type)
+        for sensor_name, sensor in sensors.items():
+            if sensor_name not in channels:
+                continue  # TODO: investigate whether an unknown sensor should raise an error, or if ignore is okay
+            index, field_type = channels[sensor_name]
+            columns.append(
+                (sensor.name, index, field_type, sensor.conversion_factor or 1.0, None)
+            )
+
+        decode_plan = tuple(
+            (index, _make_converter(field_type, scale, digits))
+            for _, index, field_type, scale, digits in columns
+        )
+        speed_position = next(
+            position for position, column in enumerate(columns) if column[0] == "speed"
+        )
+        base_fields = [column[0] for column in columns] + ["distance_traveled", "time"]
+        derived_channels = DerivedChannels(derived_fields, base_fields, metadata)
+        schema = RecordSchema(base_fields + list(derived_channels.fields))
+
+        self._derived_fields = derived_fields
+        self._metadata = metadata
+        self._layout = layout
+        self._packet_format = layout.format
+        self._packet_struct = packet_struct
+        self._packet_size = packet_struct.size
         self._sensors = sensors
-        self._packet_format = "<ffffBBBBBH"
-        self._packet_size = struct.calcsize(self._packet_format)
-        self._distance_traveled = 0
-        self._last_update = 0
+        self._columns = tuple(columns)
+        self._decode_plan = decode_plan
+        self._speed_position = speed_position
+        self._derived = derived_channels
+        self._schema = schema
+
+    @property
+    def fields(self) -> list[str]:
+        """Names of the fields of every data record, in order."""
+        return list(self._schema.fields)
 
-    def parse_sensor_data(self, raw_data: bytes) -> dict | None:
+    @property
+    def schema(self) -> RecordSchema:
+        """The schema shared by every record produced with the current configuration."""
+        return self._schema
+
+    def parse_sensor_data(
+        self, raw_data: bytes, received_ns: int | None = None
+    ) -> TelemetryRecord | None:
         """
         Reads raw sensor data and converts it based on the configuration.
 
         Args:
             raw_data (bytes): Raw bytes of sensor values.
+            received_ns (int, optional): monotonic receive time in ns. Defaults to now.
         Returns:
-            dict: A dictionary with sensor names as keys and converted values.
+            TelemetryRecord: A record with sensor names as keys and converted values.
             None: if the raw data is empty, then return a NoneType object.
         """
         # Validate and unpack the raw data
@@ -39,81 +181,81 @@ class DataReader:
                     f"Invalid data size: expected {self._packet_size}, got {len(raw_data)}"
                 )
 
-        unpacked_data = struct.unpack(self._packet_format, raw_data)
-
-        sensor_data = {}
+        sensor_data = self._decode(self._packet_struct.unpack(raw_data))
+        if received_ns is None:
+            received_ns = self._clock.now_ns()
 
-        # Handle the hardcoded sensors first
-        sensor_data["speed"] = round(unpacked_data[0], 2)
-        sensor_data["airspeed"] = round(unpacked_data[1], 2)
-        sensor_data["engine_temp"] = round(unpacked_data[2], 2)
-        sensor_data["rad_temp"] = round(unpacked_data[3], 2)
+        # Calculate the information derived from speed, and return the full data set
+        return self._parse_speed_derivative_data(sensor_data, received_ns)
 
-        # Handle configuration-defined sensor channels
-        for sensor_name, sensor in self._sensors.items():
-            if sensor.conversion_factor == 0.0:
-                sensor.conversion_factor = 1.0
-            match sensor_name:
-                case "channel0":
-                    sensor_data[sensor.name] = (
-                        unpacked_data[4] * sensor.conversion_factor
-                    )
-                case "channel1":
-                    sensor_data[sensor.name] = (
-                        unpacked_data[5] * sensor.conversion_factor
-                    )
-                case "channel2":
-                    sensor_data[sensor.name] = (
-                        unpacked_data[6] * sensor.conversion_factor
-                    )
-                case "channel3":
-                    sensor_data[sensor.name] = (
-                        unpacked_data[7] * sensor.conversion_factor
-                    )
-                case "channel4":
-                    sensor_data[sensor.name] = (
-                        unpacked_data[8] * sensor.conversion_factor
-                    )
-                case "channelA0":
-                    sensor_data[sensor.name] = (
-                        unpacked_data[9] * sensor.conversion_factor
-                    )
-                case _:
-                    continue  # TODO: investigate whether an unknown sensor should raise an error, or if ignore is okay
+    def parse_packets(self, packets: list[bytes]) -> list[TelemetryRecord]:
+        """
+        Decode a batch of packets that arrived together.
 
-        # Calculate the information derived from speed, and return the full data set
-        return self._parse_speed_derivative_data(sensor_data)
+        The packets are stamped evenly up to now, see TelemetryClock.spread.
 
-    def reset_distance(self):
-        """Resets the distance traveled to zero."""
-        self._distance_traveled = 0
-        self._last_update = 0
+        Args:
+            packets (list[bytes]): whole packets, oldest first.
+        Returns:
+            list[TelemetryRecord]: one data record per packet, in order.
+        """
+        stamps = self._clock.spread(len(packets))
+        return [
+            self.parse_sensor_data(packet, stamp)
+            for packet, stamp in zip(packets, stamps)
+        ]
 
-    def _parse_speed_derivative_data(self, data: dict) -> dict:
+    def parse_many(self, buffer: bytes) -> list[TelemetryRecord]:
         """
-        Parses data derived from the speed from the speed data dictionary.
+        Decode a contiguous buffer of back-to-back packets.
 
-        Args:
-            data (dict): Dictionary containing speed data.
+        The packets are stamped evenly up to now, see TelemetryClock.spread.
 
+        Args:
+            buffer (bytes): Raw bytes of one or more whole packets.
         Returns:
-            dict: Dictionary containing speed derivative data.
+            list[TelemetryRecord]: one data record per packet, in order.
         """
+        if len(buffer) % self._packet_size:
+            raise ValueError(
+                f"Invalid data size: expected a multiple of {self._packet_size}, got {len(buffer)}"
+            )
+        stamps = self._clock.spread(len(buffer) // self._packet_size)
+        return [
+            self._parse_speed_derivative_data(self._decode(values), stamp)
+            for values, stamp in zip(self._packet_struct.iter_unpack(buffer), stamps)
+        ]
 
-        if self._distance_traveled > 100000000:
-            self._distance_traveled = 0
+    def _decode(self, unpacked_data: tuple) -> list:
+        """Convert one unpacked packet into a list of values using the decode plan."""
+        # Hardcoded fields come first, then configuration-defined sensor channels
+        return [convert(unpacked_data[index]) for index, convert in self._decode_plan]
 
-        utc_dt_aware = datetime.datetime.now(datetime.timezone.utc)
-        timestamp = math.floor(utc_dt_aware.timestamp() * 1000)
+    @property
+    def distance_traveled(self) -> float:
+        """Total distance traveled in feet since start or the last reset."""
+        return self._odometer.distance
 
-        if self._last_update > 0:
-            delta = timestamp - self._last_update
+    def reset_distance(self):
+        """Resets the distance traveled to zero, along with the derived channel state."""
+        self._odometer.reset()
+        self._derived.reset()
 
-            # mph -> Ft/ms
-            speedFtms = 0.00146667 * data["speed"]
-            self._distance_traveled += speedFtms * delta
-        self._last_update = timestamp
+    def _parse_speed_derivative_data(
+        self, values: list, received_ns: int
+    ) -> TelemetryRecord:
+        """
+        Adds the distance, time and derived channels to the decoded packet values.
+
+        Args:
+            values (list): decoded packet values, in schema order.
+            received_ns (int): monotonic receive time of the packet in ns.
 
-        data["distance_traveled"] = round(self._distance_traveled, 2)
-        data["time"] = timestamp
-        return data
\ No newline at end of file
+        Returns:
+            TelemetryRecord: the complete data record.
+        """
+        distance = self._odometer.update(values[self._speed_position], received_ns)
+        values.append(round(distance, 2))
+        values.append(self._clock.to_wall_ms(received_ns))
+        self._derived.compute(values)
+        return TelemetryRecord(self._schema, values)
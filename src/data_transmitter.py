@@ -1,18 +1,52 @@
 import datetime
+import io
+import json
+import os
+import threading
+import time
+import zlib
 from abc import ABC, abstractmethod
+from collections import deque
 from csv import writer
 from os import getenv
+from typing import BinaryIO, Iterable, Mapping, Sequence
 
 import paho.mqtt.client as mqtt
 
-from configuration_generator import ConfigurationGenerator, Sensor
+from configuration_generator import ConfigurationGenerator
+from remote_outbox import Outbox, OutboxError
+from session_archive import (
+    INDEX_ENTRY,
+    INDEX_SUFFIX,
+    SessionArchiver,
+    segment_file_name,
+)
 from sim_data_handler import SimulationHandler
+from telemetry_batch import dictionary_id, encode_batch, encode_dictionary
+from uplink_controller import UplinkController
+
+# Last column of the local CSV rows, the CRC-32 of the rest of the row
+CHECKSUM_FIELD = "crc32"
 
 
 class TransmitterError(Exception):
     """Exception for transmitter errors"""
 
 
+def check_csv_row(row: bytes) -> bool:
+    """
+    Check the checksum column of a local CSV row.
+
+    Args:
+        row(bytes): the encoded row, with or without its line ending
+
+    Returns:
+        bool: True if the row ends with the CRC-32 of the rest of it
+    """
+    body, separator, checksum = row.rstrip(b"\r\n").rpartition(b",")
+    return bool(separator) and checksum == b"%08x" % zlib.crc32(body)
+
+
 class DataTransmitter(ABC):  # pragma: no cover
     """Base class for data transmission"""
 
@@ -20,80 +54,365 @@ class DataTransmitter(ABC):  # pragma: no cover
         pass
 
     @abstractmethod
-    def handle_record(data: dict):
+    def handle_record(data: Mapping):
         """
         send a data record to the relevant endpoint.
 
         Args:
-            data (dict): the data record to be sent
+            data (Mapping): the data record to be sent
         """
         pass
 
 
-class LocalTransmitter(DataTransmitter):
+class SegmentedFileTransmitter(DataTransmitter):
+    """
+    Base class of the transmitters saving records to local session files.
+
+    The current segment file is kept open and records are buffered in memory. The buffer is
+    written out and fsynced to the SD card once it holds flush_bytes, or once its oldest
+    record is flush_interval seconds old. The age is only checked when a record arrives
+    or flush_if_due is called, so a record can stay buffered for flush_interval plus the
+    time between those calls. Call flush_if_due periodically while the stream is idle,
+    with flush_interval shortened by that period to bound the data lost on a power cut,
+    and close on shutdown.
+
+    A session is written to a single file unless rotate_bytes or rotate_seconds are set.
+    The session then continues in a new numbered segment file, with its own header, after
+    the flush that crosses either limit. Closed segments are handed to the archiver.
+
+    With index_every set, the time and byte offset of every Nth record of a segment are
+    written to a sparse time index next to it, see session_archive.INDEX_ENTRY. The index is
+    not fsynced, readers fall back to scanning past its last entry.
+
+    Subclasses set the file extension and mode, and provide the segment header.
+
+    Args:
+        data_dir(str): the directory to write the session files to
+        flush_interval(float): age in seconds of the oldest record that triggers a flush
+        flush_bytes(int): buffer size that triggers a flush
+        rotate_bytes(int, optional): size of the records of a segment that triggers a rotation
+        rotate_seconds(float, optional): segment age that triggers a rotation
+        archiver(SessionArchiver, optional): compresses the closed segments and keeps the
+            disk quota
+        index_every(int, optional): records between time index entries, None for no index
+
+    Raises:
+        TransmitterError: If the file cannot be created.
+    """
+
+    _extension = ""
+    _mode = "ab"
+
+    def __init__(
+        self,
+        data_dir: str,
+        flush_interval: float,
+        flush_bytes: int,
+        rotate_bytes: int | None = None,
+        rotate_seconds: float | None = None,
+        archiver: SessionArchiver | None = None,
+        index_every: int | None = None,
+    ):
+        if index_every is not None and index_every < 1:
+            raise ValueError(f"Index interval must be at least 1, got {index_every}")
+        self._data_dir = data_dir
+        self._session = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        self._segment = 0
+        self._flush_interval = flush_interval
+        self._flush_bytes = flush_bytes
+        self._rotate_bytes = rotate_bytes
+        self._rotate_seconds = rotate_seconds
+        self._archiver = archiver
+        self._index_every = index_every
+        self._index_buffer = bytearray()
+        self._index_file: BinaryIO | None = None
+        self._buffer: list = []
+        self._buffered_size = 0
+        self._first_buffered: float | None = None
+        if archiver is not None:
+            archiver.begin_session(self._session)
+
+    @property
+    def session(self) -> str:
+        """The session name, i.e. its start timestamp."""
+        return self._session
+
+    @property
+    def path(self) -> str:
+        """The path of the current segment file."""
+        return self._data_file_name
+
+    def flush_if_due(self):
+        """
+        Flush the buffer if it is over the size threshold or its oldest record is too old.
+
+        Raises:
+            TransmitterError: If the file cannot be written.
+        """
+        if self._first_buffered is None:
+            return
+        if (
+            self._buffered_size >= self._flush_bytes
+            or time.monotonic() - self._first_buffered >= self._flush_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        """
+        Write out the buffered records and fsync them to disk, rotating the segment when due.
+
+        Raises:
+            TransmitterError: If the file cannot be written.
+        """
+        if self._first_buffered is None:
+            return
+        try:
+            self._file.writelines(self._buffer)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            if self._index_file is not None:
+                self._index_file.write(self._index_buffer)
+                self._index_file.flush()
+        except OSError as exc:
+            raise TransmitterError(
+                f"Problem writing to {self._data_file_name}, file cannot be opened and/or written: {exc}"
+            ) from exc
+        self._index_buffer.clear()
+        self._segment_size += self._buffered_size
+        self._buffer.clear()
+        self._buffered_size = 0
+        self._first_buffered = None
+        # Only records count towards the size, so a segment never holds just its header
+        records_size = self._segment_size - self._header_size
+        if records_size > 0 and (
+            (self._rotate_bytes is not None and records_size >= self._rotate_bytes)
+            or (
+                self._rotate_seconds is not None
+                and time.monotonic() - self._segment_opened >= self._rotate_seconds
+            )
+        ):
+            self._rotate()
+
+    def close(self):
+        """
+        Flush the remaining records and close the file.
+
+        Raises:
+            TransmitterError: If the file cannot be written.
+        """
+        try:
+            self.flush()
+        finally:
+            self._close_segment()
+
+    def _segment_header(self) -> list:
+        """The chunks written at the start of every segment file."""
+        return []
+
+    def _append(self, chunk: bytes, time_ms: float | None = None):
+        """Buffer a chunk for the current segment file, indexed if it is a timed record."""
+        if (
+            self._index_file is not None
+            and isinstance(time_ms, (int, float))
+            and self._segment_records % self._index_every == 0
+        ):
+            offset = self._segment_size + self._buffered_size
+            self._index_buffer += INDEX_ENTRY.pack(time_ms, offset)
+        if time_ms is not None:
+            self._segment_records += 1
+        self._buffer.append(chunk)
+        self._buffered_size += len(chunk)
+        if self._first_buffered is None:
+            self._first_buffered = time.monotonic()
+
+    def _open_segment(self):
+        """Open the current segment file and buffer its header."""
+        self._data_file_name = os.path.join(
+            self._data_dir,
+            segment_file_name(self._session, self._segment, self._extension),
+        )
+        try:
+            self._file = open(self._data_file_name, self._mode)
+            if self._index_every is not None:
+                self._index_file = open(self._data_file_name + INDEX_SUFFIX, "ab")
+        except OSError as exc:
+            raise TransmitterError(
+                f"Cannot create {self._data_file_name}: {exc}"
+            ) from exc
+        self._segment_opened = time.monotonic()
+        self._segment_size = 0
+        self._segment_records = 0
+        header = self._segment_header()
+        self._header_size = sum(len(chunk) for chunk in header)
+        for chunk in header:
+            self._append(chunk)
+
+    def _rotate(self):
+        """Close the current segment, hand it to the archiver and open the next one."""
+        self._close_segment()
+        if self._archiver is not None:
+            self._archiver.submit(self._data_file_name)
+        self._segment += 1
+        self._open_segment()
+
+    def _close_segment(self):
+        """Close the current segment file and its index."""
+        try:
+            self._file.close()
+        finally:
+            if self._index_file is not None:
+                self._index_file.close()
+
+
+class LocalTransmitter(SegmentedFileTransmitter):
     """
     A transmitter to save data records to a local file cache for posterity.
 
     A new CSV file is create for each instantiation of this class. In the context of running this on
     a car telemetry computer, it would make sense to instantiate this once per power cycle of the computer.
+    Buffering, rotation and the time index are described in SegmentedFileTransmitter, each
+    segment starts with the header row. Every row ends with a CHECKSUM_FIELD column so that
+    recovery can tell a torn row from a complete one, see check_csv_row.
 
     Args:
-        car_sensors (dict[str, Sensor])): the set of sensors for the car being written to
+        fields (Sequence[str]): the record fields, in record order, e.g. DataReader.fields
         data_dir (str, optional): the directory to write the CSV file to. Defaults to "Data".
+        flush_interval (float, optional): age in seconds of the oldest row that triggers a flush. Defaults to 1.
+        flush_bytes (int, optional): buffer size that triggers a flush. Defaults to 64 KiB.
+        rotate_bytes (int, optional): segment size that triggers a rotation. Defaults to no limit.
+        rotate_seconds (float, optional): segment age that triggers a rotation. Defaults to no limit.
+        archiver (SessionArchiver, optional): compresses closed segments and keeps the disk quota.
+        index_every (int, optional): rows between time index entries. Defaults to 100.
     """
 
-    def __init__(self, car_sensors: dict[str, Sensor], data_dir: str = "Data"):
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        self._data_file_name = f"{data_dir}/{timestamp}_car_data.csv"
+    _extension = "csv"
 
-        hardcoded_sensors = ["speed", "airspeed", "engine_temp", "rad_temp"]
-        dynamic_sensors = [sensor.name for _, sensor in car_sensors.items()]
-        derived_sensors = ["distance_traveled", "time"]
-        self._write_to_csv(
-            self._data_file_name, hardcoded_sensors + dynamic_sensors + derived_sensors
+    def __init__(
+        self,
+        fields: Sequence[str],
+        data_dir: str = "Data",
+        flush_interval: float = 1.0,
+        flush_bytes: int = 64 * 1024,
+        rotate_bytes: int | None = None,
+        rotate_seconds: float | None = None,
+        archiver: SessionArchiver | None = None,
+        index_every: int | None = 100,
+    ):
+        super().__init__(
+            data_dir,
+            flush_interval,
+            flush_bytes,
+            rotate_bytes,
+            rotate_seconds,
+            archiver,
+            index_every,
         )
+        self._row = io.StringIO()
+        self._csv_writer = writer(self._row)
 
-    def handle_record(self, data: dict):
+        self._header = list(fields)
+        self._open_segment()
+        self.flush()
+
+    def handle_record(self, data: Mapping):
         """
-        Write the data record to a local CSV cache file.
+        Buffer the data record for the local CSV cache file, flushing when due.
 
         Args:
-            data(dict): the data record to be saved.
+            data(Mapping): the data record to be saved, e.g. a TelemetryRecord.
 
         Raises:
             TransmitterError: If an error occurs while trying to write to the CSV.
                 Errors can be due to OS or data formatting.
         """
         try:
-            data_list = [data[key] for key in data]
-            self._write_to_csv(self._data_file_name, data_list)
-        except OSError as exc:
-            raise TransmitterError(
-                f"Problem writing to CSV file, file cannot be opened and/or written: {exc}"
-            ) from exc
-        except (KeyError, TypeError) as exc:
+            self._write_to_csv(data.values(), data.get("time"))
+        except (AttributeError, KeyError, TypeError) as exc:
             raise TransmitterError(
                 f"Invalid data being written, received: {data}\n{exc}"
             ) from exc
+        self.flush_if_due()
+
+    def _segment_header(self) -> list:
+        return [self._format_row([*self._header, CHECKSUM_FIELD])]
 
-    def _write_to_csv(self, file_name: str, line: dict):
-        """Helper function to write line to CSV, with error handling"""
-        with open(file_name, "a") as file:
-            csv_writer = writer(file)
-            csv_writer.writerow(line)
+    def _write_to_csv(self, line: Iterable, time_ms: float | None = None):
+        """Helper function to buffer a line of the CSV with its checksum"""
+        body = self._format_row(line).rstrip(b"\r\n")
+        self._append(b"%s,%08x\r\n" % (body, zlib.crc32(body)), time_ms)
+
+    def _format_row(self, line: Iterable) -> bytes:
+        """Format a line as an encoded CSV row."""
+        self._csv_writer.writerow(line)
+        row = self._row.getvalue()
+        self._row.seek(0)
+        self._row.truncate()
+        return row.encode()
 
 
 class RemoteTransmitter(DataTransmitter):
     """
     A transmitter to send data over MQTT to the cloud server.
+
+    By default every record is published as its own message. With batch_size set, records
+    are buffered and published together as one compact columnar message on the batch
+    topic (MQTT_BATCH_TOPIC, defaults to "<publish topic>/batch"), see telemetry_batch.
+    A batch is published once it holds batch_size records, or once its oldest record is
+    batch_interval seconds old. Call flush_if_due periodically to keep that bound while
+    the stream is idle. The field dictionary of the batches is published retained on
+    "<batch topic>/fields/<dictionary id>".
+
+    With an outbox, batches are numbered and stored on disk until the broker acknowledges
+    them (QoS 1), see remote_outbox. A new batch is published right away while connected.
+    Stored batches that were never handed to the MQTT client, because the car was out of
+    range or the server restarted, are resent in the background at most backfill_rate per
+    second while fewer than max_in_flight batches await acknowledgement, so live data
+    keeps priority over the backfill.
+
+    With a controller, the batch size and interval follow the controller, which also
+    drops the records over its current rate, see uplink_controller. It is fed the message
+    ids of the published batches and their on_publish completions.
+
+    Args:
+        config_gen(ConfigurationGenerator, optional): updated by configuration messages
+        sim_handler(SimulationHandler, optional): updated by simulation messages
+        batch_size(int, optional): records per batch message. Defaults to no batching.
+        batch_interval(float, optional): longest time in seconds a record stays buffered.
+            Defaults to 1.
+        config_hash(str, optional): the car's configuration hash, stored in the field dictionary
+        outbox(Outbox, optional): stores the batches until they are acknowledged, needs batch_size
+        backfill_rate(float, optional): stored batches resent per second. Defaults to 5.
+        max_in_flight(int, optional): most batches awaiting acknowledgement before the
+            backfill waits. Defaults to 10.
+        controller(UplinkController, optional): adapts the record rate and batch size to
+            the link, replaces batch_size and batch_interval
+
+    Raises:
+        TransmitterError: If the MQTT settings are missing from the environment.
+        ValueError: If an outbox is given without batch_size or a controller.
     """
 
-    def __init__(self, config_gen: ConfigurationGenerator = None, sim_handler: SimulationHandler = None):
+    def __init__(
+        self,
+        config_gen: ConfigurationGenerator = None,
+        sim_handler: SimulationHandler = None,
+        batch_size: int | None = None,
+        batch_interval: float = 1.0,
+        config_hash: str | None = None,
+        outbox: Outbox | None = None,
+        backfill_rate: float = 5.0,
+        max_in_flight: int = 10,
+        controller: UplinkController | None = None,
+    ):
+        if outbox is not None and batch_size is None and controller is None:
+            raise ValueError("The outbox only stores batches, set a batch size")
         self._broker_address = getenv("MQTT_HOST", None)
         self._port = getenv("MQTT_PORT", None)
         self._publish_topic = getenv("MQTT_PUBLISH_TOPIC", None)
         self._subscribe_topic = getenv("MQTT_SUBSCRIBE_TOPIC", None)
         self._sim_topic = getenv("MQTT_SIMULATION_TOPIC", None)
+        self._alarm_topic = getenv("MQTT_ALARM_TOPIC", None)
+        self._batch_topic = getenv("MQTT_BATCH_TOPIC", None)
         self._username = getenv("MQTT_USERNAME", None)
         self._password = getenv("MQTT_PASSWORD", None)
         self._sim_handler = sim_handler
@@ -109,6 +428,36 @@ class RemoteTransmitter(DataTransmitter):
                 "MQTT broker address, port, publish topic, username, or password not set in environment variables."
             )
         self._port = int(self._port)
+        if not self._alarm_topic:
+            self._alarm_topic = f"{self._publish_topic}/alarms"
+        if not self._batch_topic:
+            self._batch_topic = f"{self._publish_topic}/batch"
+        self._batch_size = batch_size
+        self._controller = controller
+        self._batching = batch_size is not None or controller is not None
+        self._batch_interval = batch_interval
+        self._config_hash = config_hash
+        self._batch: list[list] = []
+        # (dictionary id, fields) of the batch, replaced as a whole for the MQTT thread
+        self._dictionary: tuple[str, tuple[str, ...]] | None = None
+        self._first_batched: float | None = None
+
+        self._outbox = outbox
+        self._backfill_interval = 1 / backfill_rate
+        self._max_in_flight = max_in_flight
+        self._connected = False
+        self._lock = threading.Lock()
+        # Sequence numbers of the stored batches handed to the client, by message id
+        self._in_flight: dict[int, int] = {}
+        # Sequence numbers being published or removed, flush, backfill and acknowledgements
+        # claim a stored batch here first so only one of them handles it
+        self._claimed: set[int] = set()
+        # Message ids timed by the controller, only their acknowledgements are passed on
+        self._timed: set[int] = set()
+        # Acknowledgements that may arrive before publish returns the message id
+        self._unmatched_acks: deque[int] = deque(maxlen=64)
+        self._backfill_after = 0
+        self._closing = threading.Event()
 
         self._client = mqtt.Client(
             mqtt.CallbackAPIVersion.VERSION2,
@@ -120,24 +469,52 @@ class RemoteTransmitter(DataTransmitter):
         self._client.tls_set(cert_reqs=mqtt.ssl.CERT_REQUIRED)
         self._client.on_connect = self._on_connect
         self._client.on_message = self._receive_message
+        self._client.on_disconnect = self._on_disconnect
+        self._client.on_publish = self._on_publish
         self._client.reconnect_delay_set(min_delay=1, max_delay=60)
         self._client.connect_async(self._broker_address, self._port)
         self._client.loop_start()
 
+        self._backfill_thread = None
+        if outbox is not None:
+            self._backfill_thread = threading.Thread(
+                target=self._backfill, name="remote-backfill", daemon=True
+            )
+            self._backfill_thread.start()
+
     def _on_connect(self, client, userdata, flags, reason_code, properties=None):
         if getattr(reason_code, "is_failure", False):
             return
         # Subscribe after reconnect as well, so config updates resume automatically.
         client.subscribe(self._subscribe_topic)
+        if self._dictionary is not None:
+            self._publish_dictionary()
+        # Look through the whole outbox again, e.g. for batches the client refused
+        self._backfill_after = 0
+        self._connected = True
+
+    def _on_disconnect(
+        self, client, userdata, flags=None, reason_code=None, properties=None
+    ):
+        # Batches in flight stay with the client, which resends them on reconnect
+        self._connected = False
 
-    def handle_record(self, data: dict):
+    def handle_record(self, data: Mapping):
         """
         Send the data record to the remote cloud client.
 
         Args:
-            data(dict): the data record to be sent
+            data(Mapping): the data record to be sent, e.g. a TelemetryRecord.
+
+        Raises:
+            TransmitterError: If the record, or the batch it completes, could not be
+                queued for publishing.
         """
+        if self._batching:
+            self._batch_record(data)
+            return
         try:
+            # A TelemetryRecord prints exactly like the equivalent dict
             result = self._client.publish(
                 self._publish_topic, str(data), qos=0
             )  # QoS 0 = fire and forget
@@ -150,6 +527,273 @@ class RemoteTransmitter(DataTransmitter):
                 f"Problem publishing to MQTT broker at on topic {self._publish_topic}: Topic or QoS is invalid. {exc}"
             ) from exc
 
+    def flush_if_due(self):
+        """
+        Publish the batch if it is full or its oldest record is too old.
+
+        Raises:
+            TransmitterError: If the batch could not be queued for publishing.
+        """
+        if self._first_batched is None:
+            return
+        if self._controller is not None:
+            batch_size = self._controller.batch_size
+            batch_interval = self._controller.batch_interval
+        else:
+            batch_size, batch_interval = self._batch_size, self._batch_interval
+        if (
+            len(self._batch) >= batch_size
+            or time.monotonic() - self._first_batched >= batch_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        """
+        Publish the buffered records as one batch message.
+
+        The batch is dropped if it cannot be published, like records published one by one.
+
+        Raises:
+            TransmitterError: If the batch could not be queued for publishing.
+        """
+        if not self._batch:
+            return
+        rows = self._batch
+        self._batch = []
+        self._first_batched = None
+        sequence = self._outbox.next_sequence() if self._outbox is not None else None
+        try:
+            payload = encode_batch(self._dictionary[0], rows, sequence)
+        except ValueError as exc:
+            raise TransmitterError(f"Invalid data dropped from batch: {exc}") from exc
+        if self._outbox is not None:
+            self._store(sequence, self._batch_topic, payload)
+            return
+        result = self._client.publish(self._batch_topic, payload, qos=0)
+        if result.rc != mqtt.MQTT_ERR_SUCCESS:
+            raise TransmitterError(
+                f"Failed to publish batch to MQTT broker at {self._broker_address}:{self._port} on topic {self._batch_topic}, return code: {result.rc}"
+            )
+        self._track(result)
+
+    def outbox_stats(self) -> dict[str, int]:
+        """
+        Outbox metrics, see Outbox.stats.
+
+        Returns:
+            dict[str, int]: the outbox stats, and the batches awaiting acknowledgement
+        """
+        if self._outbox is None:
+            return {}
+        with self._lock:
+            in_flight = len(self._in_flight)
+        return {**self._outbox.stats(), "in_flight": in_flight}
+
+    def uplink_stats(self) -> dict[str, float]:
+        """
+        Uplink metrics, see UplinkController.stats.
+
+        Returns:
+            dict[str, float]: the controller stats, the records buffered for the next
+                batch and the batches waiting in the outbox
+        """
+        stats = self._controller.stats() if self._controller is not None else {}
+        stats["buffered"] = len(self._batch)
+        if self._outbox is not None:
+            stats["outbox_pending"] = self._outbox.stats()["pending"]
+        return stats
+
+    def _store(self, sequence: int, topic: str, payload: bytes):
+        """Keep a message in the outbox until acknowledged, publishing it if connected."""
+        try:
+            self._outbox.put(sequence, topic, payload)
+        except OutboxError as exc:
+            raise TransmitterError(f"Message dropped from outbox: {exc}") from exc
+        # Otherwise the backfill sends it once connected
+        if self._connected:
+            self._publish_stored(sequence, topic, payload)
+
+    def _publish_stored(self, sequence: int, topic: str, payload: bytes) -> bool:
+        """Hand a stored batch to the client, returns False if it was refused."""
+        with self._lock:
+            # Already being published by the backfill, or in flight
+            if sequence in self._claimed or sequence in self._in_flight.values():
+                return True
+            self._claimed.add(sequence)
+        return self._publish_claimed(sequence, topic, payload)
+
+    def _publish_claimed(self, sequence: int, topic: str, payload: bytes) -> bool:
+        """Hand a claimed stored batch to the client, then release the claim."""
+        try:
+            info = self._client.publish(topic, payload, qos=1)
+            # Without a connection the client keeps the message and sends it on reconnect
+            if info.rc not in (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_NO_CONN):
+                return False
+            if self._track(info, sequence, timed=info.rc == mqtt.MQTT_ERR_SUCCESS):
+                self._acknowledge(sequence)
+            return True
+        finally:
+            self._release(sequence)
+
+    def _track(self, info, sequence: int | None = None, timed: bool = True) -> bool:
+        """
+        Track a published message until its acknowledgement.
+
+        Only messages the client sent right away are timed by the controller, not those
+        it keeps for a reconnect.
+
+        Args:
+            info(mqtt.MQTTMessageInfo): the result of publish
+            sequence(int, optional): the sequence number of a stored batch
+            timed(bool): whether the message was sent. Defaults to True.
+
+        Returns:
+            bool: True if the message was already acknowledged
+        """
+        timed = timed and self._controller is not None
+        with self._lock:
+            acknowledged = info.mid in self._unmatched_acks or info.is_published()
+            if info.mid in self._unmatched_acks:
+                self._unmatched_acks.remove(info.mid)
+            if not acknowledged:
+                if timed:
+                    self._timed.add(info.mid)
+                if sequence is not None:
+                    self._in_flight[info.mid] = sequence
+        if timed:
+            self._controller.sent(info.mid)
+            if acknowledged:
+                self._controller.acknowledged(info.mid)
+        return acknowledged
+
+    def _release(self, sequence: int):
+        """Let flush and backfill publish a stored batch again, e.g. after a refusal."""
+        with self._lock:
+            self._claimed.discard(sequence)
+
+    def _on_publish(self, client, userdata, mid, reason_code=None, properties=None):
+        with self._lock:
+            timed = mid in self._timed
+            self._timed.discard(mid)
+            sequence = self._in_flight.pop(mid, None)
+            if not timed and sequence is None:
+                # Before publish returned, or e.g. a field dictionary that is not tracked
+                self._unmatched_acks.append(mid)
+                return
+            if sequence is not None:
+                # Claimed until removed, or the backfill could resend it meanwhile
+                self._claimed.add(sequence)
+        if timed:
+            self._controller.acknowledged(mid)
+        if sequence is None:
+            return
+        try:
+            self._acknowledge(sequence)
+        finally:
+            self._release(sequence)
+
+    def _acknowledge(self, sequence: int):
+        """Delete an acknowledged batch from the outbox."""
+        try:
+            self._outbox.remove(sequence)
+        except OutboxError as exc:  # resent later, the cloud drops the duplicate
+            print(f"Error updating remote outbox: {exc}")
+
+    def _backfill(self):
+        """
+        Backfill thread, resends the stored messages not handed to the client yet.
+
+        Stored alarms go first, so an alarm raised out of range does not wait behind the
+        batches recorded meanwhile.
+        """
+        while not self._closing.wait(self._backfill_interval):
+            if not self._connected:
+                continue
+            with self._lock:
+                if len(self._in_flight) >= self._max_in_flight:
+                    continue
+                # Peeked and claimed at once, so a live flush cannot publish it as well
+                skip = {*self._in_flight.values(), *self._claimed}
+                try:
+                    message = self._outbox.peek(
+                        skip=skip, topic=self._alarm_topic
+                    ) or self._outbox.peek(self._backfill_after, skip)
+                except OutboxError as exc:
+                    print(f"Error reading remote outbox: {exc}")
+                    continue
+                if message is None:
+                    continue
+                self._claimed.add(message[0])
+            sequence, topic, payload = message
+            if topic != self._alarm_topic:
+                self._backfill_after = sequence
+            try:
+                self._publish_claimed(sequence, topic, payload)
+            except ValueError as exc:  # never published, keep the outbox moving
+                print(f"Error resending batch {sequence}: {exc}")
+
+    def _batch_record(self, data: Mapping):
+        """Buffer a record for the batch, starting a new batch if its fields changed."""
+        if self._controller is not None and not self._controller.admit():
+            return
+        try:
+            fields = tuple(data)
+            values = data.values()
+        except (AttributeError, TypeError) as exc:
+            raise TransmitterError(
+                f"Invalid data being written, received: {data}\n{exc}"
+            ) from exc
+        if self._dictionary is None or fields != self._dictionary[1]:
+            self.flush()
+            self._dictionary = (dictionary_id(fields, self._config_hash), fields)
+            self._publish_dictionary()
+        self._batch.append(list(values))
+        if self._first_batched is None:
+            self._first_batched = time.monotonic()
+        self.flush_if_due()
+
+    def _publish_dictionary(self):
+        """Publish the field dictionary of the batches, retained for new subscribers."""
+        dictionary, fields = self._dictionary
+        self._client.publish(
+            f"{self._batch_topic}/fields/{dictionary}",
+            encode_dictionary(fields, self._config_hash),
+            qos=1,
+            retain=True,
+        )
+
+    def handle_alarm(self, event: dict):
+        """
+        Send an alarm event to the remote cloud client right away, on the alarm topic.
+
+        Alarms are published as JSON with QoS 1, so the broker acknowledges them. Without
+        a connection the client keeps the alarm and sends it on reconnect. With an outbox,
+        the alarm is stored with the batches until acknowledged, so it survives a restart,
+        and its outbox sequence number is added under "sequence" for de-duplication.
+
+        Args:
+            event(dict): the alarm event to be sent
+
+        Raises:
+            TransmitterError: If the alarm could not be queued for publishing.
+        """
+        try:
+            if self._outbox is not None:
+                sequence = self._outbox.next_sequence()
+                payload = json.dumps({"sequence": sequence, **event})
+                self._store(sequence, self._alarm_topic, payload.encode())
+                return
+            payload = json.dumps(event)
+            result = self._client.publish(self._alarm_topic, payload, qos=1)
+            if result.rc not in (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_NO_CONN):
+                raise TransmitterError(
+                    f"Failed to publish alarm to MQTT broker at {self._broker_address}:{self._port} on topic {self._alarm_topic}, return code: {result.rc}"
+                )
+        except (ValueError, TypeError) as exc:
+            raise TransmitterError(
+                f"Problem publishing alarm on topic {self._alarm_topic}: {exc}"
+            ) from exc
+
     def _receive_message(self, client, userdata, msg):
         """
         Receive a message from the MQTT broker on the specified topic.
@@ -172,5 +816,8 @@ class RemoteTransmitter(DataTransmitter):
             ) from exc
 
     def disconnect(self):
-        """Disconnect the MQTT client cleanly."""
+        """Disconnect the MQTT client cleanly, batches not acknowledged stay in the outbox."""
+        self._closing.set()
+        if self._backfill_thread is not None:
+            self._backfill_thread.join()
         self._client.disconnect()
@@ -0,0 +1,266 @@
+"""
+Channels computed incrementally from the other fields of each record.
+
+Derived channels are declared per car under "derived" in the configuration file and are
+computed once in DataReader, so every sink receives them with the record. Each channel
+keeps only the state it needs (at most a trailing time window), making every update O(1)
+amortized. Channels are evaluated in declaration order, so a channel can be computed from
+an earlier one.
+"""
+
+import math
+from collections import deque
+from typing import Sequence
+
+from configuration_generator import DerivedField, Metadata
+
+MPH_TO_M_PER_S = 0.44704
+LB_TO_KG = 0.45359237
+GRAVITY = 9.80665
+FT_PER_MILE = 5280
+# Longest interval in seconds integrated across, the same limit as the odometer
+MAX_GAP_SECONDS = 2.0
+
+
+class _TrailingWindow:
+    """(time, value) samples of the last `window` seconds, oldest first."""
+
+    def __init__(self, window: float):
+        self._window_ms = window * 1000
+        self.samples: deque[tuple[float, float]] = deque()
+
+    def add(self, time_ms: float, value: float) -> list[float]:
+        """Add a sample and return the values of the samples that fell out of the window."""
+        self.samples.append((time_ms, value))
+        expired = []
+        while self.samples[0][0] < time_ms - self._window_ms:
+            expired.append(self.samples.popleft()[1])
+        return expired
+
+
+class Acceleration:
+    """
+    Rate of change per second of a source channel, over a trailing window.
+
+    The slope between the oldest and newest sample of the window is used, which is far
+    less noisy than differencing consecutive packets.
+    """
+
+    def __init__(self, definition: DerivedField, sources: list[int], time: int, **_):
+        self._source = sources[0]
+        self._time = time
+        self._window = _TrailingWindow(definition.window or 1.0)
+
+    def update(self, values: list) -> float:
+        value = values[self._source]
+        if math.isfinite(value):
+            self._window.add(values[self._time], value)
+        samples = self._window.samples
+        if len(samples) < 2 or samples[-1][0] == samples[0][0]:
+            return 0.0
+        return (
+            (samples[-1][1] - samples[0][1]) * 1000 / (samples[-1][0] - samples[0][0])
+        )
+
+    def reset(self):
+        self._window.samples.clear()
+
+
+class RollingMean:
+    """Mean of a source channel over a trailing window, from a running sum."""
+
+    def __init__(self, definition: DerivedField, sources: list[int], time: int, **_):
+        self._source = sources[0]
+        self._time = time
+        self._window = _TrailingWindow(definition.window or 10.0)
+        self._sum = 0.0
+
+    def update(self, values: list) -> float:
+        value = values[self._source]
+        if math.isfinite(value):
+            self._sum += value
+            for expired in self._window.add(values[self._time], value):
+                self._sum -= expired
+        count = len(self._window.samples)
+        return self._sum / count if count else 0.0
+
+    def reset(self):
+        self._window.samples.clear()
+        self._sum = 0.0
+
+
+class Product:
+    """Product of two source channels, e.g. voltage and current for electrical power."""
+
+    def __init__(self, definition: DerivedField, sources: list[int], **_):
+        if len(sources) != 2:
+            raise ValueError(
+                f"Derived channel {definition.name} needs exactly two sources"
+            )
+        self._first, self._second = sources
+
+    def update(self, values: list) -> float:
+        return values[self._first] * values[self._second]
+
+    def reset(self):
+        pass
+
+
+class RoadLoadPower:
+    """
+    Power in watts needed to drive the car at the source speed (mph).
+
+    The sum of the inertial, aerodynamic drag and rolling resistance forces times the
+    speed. It is negative while the car slows down faster than drag and rolling resistance
+    alone would slow it, e.g. braking. Uses the weight (lb) and drag coefficient from the car
+    metadata, and the frontal_area (m²), rolling_resistance and air_density (kg/m³) params.
+    """
+
+    def __init__(
+        self,
+        definition: DerivedField,
+        sources: list[int],
+        time: int,
+        metadata: Metadata | None,
+        **_,
+    ):
+        if metadata is None or not metadata.weight or metadata.drag_coefficient is None:
+            raise ValueError(
+                f"Derived channel {definition.name} needs the car weight and drag coefficient in the metadata"
+            )
+        params = definition.params
+        self._mass = metadata.weight * LB_TO_KG
+        self._drag = (
+            0.5
+            * params.get("air_density", 1.204)
+            * metadata.drag_coefficient
+            * params.get("frontal_area", 1.0)
+        )
+        self._rolling = params.get("rolling_resistance", 0.0015) * self._mass * GRAVITY
+        self._acceleration = Acceleration(definition, sources, time)
+        self._source = sources[0]
+
+    def update(self, values: list) -> float:
+        speed = values[self._source]
+        acceleration = self._acceleration.update(values) * MPH_TO_M_PER_S
+        if not math.isfinite(speed):
+            return 0.0
+        speed *= MPH_TO_M_PER_S
+        force = self._mass * acceleration + self._drag * speed**2 + self._rolling
+        return force * speed
+
+    def reset(self):
+        self._acceleration.reset()
+
+
+class EnergyPerDistance:
+    """
+    Energy used per mile (Wh/mi) since the start, from a power source channel in watts.
+
+    Power is integrated with the trapezoidal rule and divided by the distance traveled.
+    """
+
+    def __init__(
+        self,
+        definition: DerivedField,
+        sources: list[int],
+        time: int,
+        distance: int,
+        **_,
+    ):
+        self._source = sources[0]
+        self._time = time
+        self._distance = distance
+        self.reset()
+
+    def update(self, values: list) -> float:
+        power, time_ms = values[self._source], values[self._time]
+        if not math.isfinite(power):
+            power = None
+        if self._start_distance is None:
+            self._start_distance = values[self._distance]
+        elif power is not None and self._last_power is not None:
+            delta = (time_ms - self._last_time) / 1000
+            if 0 < delta <= MAX_GAP_SECONDS:
+                self._energy += (self._last_power + power) / 2 * delta
+        if power is not None:
+            self._last_power, self._last_time = power, time_ms
+
+        miles = (values[self._distance] - self._start_distance) / FT_PER_MILE
+        return self._energy / 3600 / miles if miles > 0 else 0.0
+
+    def reset(self):
+        self._energy = 0.0
+        self._start_distance = None
+        self._last_power = None
+        self._last_time = None
+
+
+# Keyed by the names in configuration_generator.DERIVED_CHANNEL_TYPES
+CHANNEL_TYPES = {
+    "acceleration": Acceleration,
+    "rolling_mean": RollingMean,
+    "product": Product,
+    "road_load_power": RoadLoadPower,
+    "energy_per_distance": EnergyPerDistance,
+}
+
+
+class DerivedChannels:
+    """
+    The compiled derived channels of a car, appended to each record's values.
+
+    Args:
+        definitions(list[DerivedField]): the derived channels, in evaluation order
+        fields(Sequence[str]): the fields of the record before the derived channels,
+            which must include "time" and "distance_traveled"
+        metadata(Metadata, optional): the car metadata, needed by some channel types
+
+    Raises:
+        ValueError: If a channel name is already used or a source does not exist.
+    """
+
+    def __init__(
+        self,
+        definitions: list[DerivedField],
+        fields: Sequence[str],
+        metadata: Metadata | None = None,
+    ):
+        names = list(fields)
+        self._channels = []
+        for definition in definitions:
+            if definition.name in names:
+                raise ValueError(
+                    f"Derived channel {definition.name} has the name of an existing field"
+                )
+            missing = [source for source in definition.sources if source not in names]
+            if missing:
+                raise ValueError(
+                    f"Unknown source for derived channel {definition.name}: {', '.join(missing)}"
+                )
+            channel = CHANNEL_TYPES[definition.type](
+                definition,
+                sources=[names.index(source) for source in definition.sources],
+                time=names.index("time"),
+                distance=names.index("distance_traveled"),
+                metadata=metadata,
+            )
+            self._channels.append((channel, definition.scale, definition.round))
+            names.append(definition.name)
+        self.fields = tuple(names[len(fields) :])
+
+    def compute(self, values: list):
+        """
+        Compute every derived channel and append them to the record values.
+
+        Args:
+            values(list): the record values, in the order of the fields given at creation
+        """
+        for channel, scale, digits in self._channels:
+            value = channel.update(values) * scale
+            values.append(value if digits is None else round(value, digits))
+
+    def reset(self):
+        """Clear the state of every channel, e.g. when the distance is reset."""
+        for channel, _, _ in self._channels:
+            channel.reset()
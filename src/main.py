@@ -1,17 +1,32 @@
 import asyncio
 from os import getenv
-from time import sleep
 
 import nest_asyncio  # async in python is dumb idek what this does but stackoverflow said to do it and now it works
 import socketio
 from aiohttp import web
 from dotenv import load_dotenv
 
-from configuration_generator import ConfigurationGenerator
+from alarm_engine import (
+    DEFAULT_CLEAR_DEBOUNCE,
+    DEFAULT_DEBOUNCE,
+    DEFAULT_HYSTERESIS,
+    AlarmEngine,
+)
+from background_writer import BackgroundWriter
+from configuration_generator import ConfigurationGenerator, ConfigurationGeneratorError
 from data_reader import DataReader
 from data_transmitter import LocalTransmitter, RemoteTransmitter, TransmitterError
+from rate_policy import parse_rate_policy
+from remote_outbox import Outbox
+from session_archive import SessionArchiver
+from session_catalog import SessionSummary
+from session_log import SessionLogError, SessionLogWriter
+from session_recovery import recover_last_session
 from sim_data_handler import SimulationHandler
-from sm_serial import SmSerial, SmSerialError
+from sm_serial import SmSerial
+from sqlite_store import SQLiteTransmitter
+from telemetry_history import TelemetryHistory
+from uplink_controller import UplinkController
 from utils import get_env_flags
 
 nest_asyncio.apply()
@@ -21,6 +36,9 @@ localDisplaySio = socketio.AsyncServer(async_mode="aiohttp", cors_allowed_origin
 app = web.Application()
 localDisplaySio.attach(app)
 
+# Seconds of history sent to a display when it connects
+BACKFILL_SECONDS = 60
+
 
 async def main():
     print("Initializing Server...")
@@ -35,68 +53,360 @@ async def main():
     # Automatically generate configuration from a JSON file defined in the environment.
     config_gen = ConfigurationGenerator()
     sensors = config_gen.get_sensors(CAR_SELECTION)
+    packet_layout = config_gen.get_packet_layout(CAR_SELECTION)
+    derived = config_gen.get_derived(CAR_SELECTION)
     sim_handler = SimulationHandler()
-    data_reader = DataReader(sensors)
+    data_reader = DataReader(
+        sensors,
+        packet_layout,
+        derived=derived,
+        metadata=config_gen.get_metadata(CAR_SELECTION),
+    )
+
+    alarms = AlarmEngine(
+        config_gen.get_limits(CAR_SELECTION),
+        hysteresis=float(getenv("ALARM_HYSTERESIS", DEFAULT_HYSTERESIS)),
+        debounce=int(getenv("ALARM_DEBOUNCE", DEFAULT_DEBOUNCE)),
+        clear_debounce=int(getenv("ALARM_CLEAR_DEBOUNCE", DEFAULT_CLEAR_DEBOUNCE)),
+    )
+
+    def reload_configuration():
+        """Recompile the decode plan after a configuration update, on the event loop."""
+        fields = data_reader.fields
+        try:
+            data_reader.update_sensors(
+                config_gen.get_sensors(CAR_SELECTION),
+                config_gen.get_packet_layout(CAR_SELECTION),
+                config_gen.get_derived(CAR_SELECTION),
+                config_gen.get_metadata(CAR_SELECTION),
+            )
+        except (ConfigurationGeneratorError, ValueError) as exc:
+            print(
+                f"Error applying configuration update, keeping the current one: {exc}"
+            )
+            return
+        if data_reader.fields != fields:
+            print(
+                "Record fields changed, the local session keeps its fields until restart"
+            )
 
-    # Create CSV for this session
-    car_cache = (
-        LocalTransmitter(sensors) if not DISABLE_LOCAL else None
+    # Remote updates arrive on the MQTT thread, the reader is only used from the loop
+    loop = asyncio.get_running_loop()
+    config_gen.add_update_callback(
+        lambda: loop.call_soon_threadsafe(reload_configuration)
+    )
+
+    # Create a CSV, binary log or database session, at most LOCAL_FLUSH_INTERVAL seconds of it are buffered.
+    # The age of the oldest buffered record is checked every tick, so the sinks flush it
+    # one tick early to keep the bound while no packets arrive
+    LOCAL_FLUSH_INTERVAL = float(getenv("LOCAL_FLUSH_INTERVAL", 1.0))
+    LOCAL_FLUSH_TICK = LOCAL_FLUSH_INTERVAL / 10
+    LOCAL_FLUSH_BYTES = int(getenv("LOCAL_FLUSH_BYTES", 64 * 1024))
+    LOCAL_FORMAT = getenv("LOCAL_FORMAT", "csv")
+    # Optionally split sessions into segments, compressed on a background thread,
+    # and delete the oldest sessions to stay within a disk quota
+    LOCAL_ROTATE_MB = getenv("LOCAL_ROTATE_MB")
+    LOCAL_ROTATE_MINUTES = getenv("LOCAL_ROTATE_MINUTES")
+    LOCAL_COMPRESSION = getenv("LOCAL_COMPRESSION", "none")
+    LOCAL_QUOTA_MB = getenv("LOCAL_QUOTA_MB")
+    rotation = {
+        "rotate_bytes": int(float(LOCAL_ROTATE_MB) * 1024 * 1024)
+        if LOCAL_ROTATE_MB
+        else None,
+        "rotate_seconds": float(LOCAL_ROTATE_MINUTES) * 60
+        if LOCAL_ROTATE_MINUTES
+        else None,
+    }
+    # Cut the torn tail a power cut may have left, before the archiver compresses it
+    if not DISABLE_LOCAL:
+        try:
+            report = recover_last_session()
+        except (OSError, SessionLogError) as exc:
+            print(f"Error recovering local data: {exc}")
+        else:
+            if report is not None:
+                print(
+                    f"Recovered {report.records} records of {report.path}, truncated {report.truncated_bytes} bytes"
+                    f" and dropped {report.dropped_records} records failing their checksum"
+                )
+    archiver = (
+        SessionArchiver(
+            compression=LOCAL_COMPRESSION if LOCAL_COMPRESSION != "none" else None,
+            max_bytes=int(float(LOCAL_QUOTA_MB) * 1024 * 1024)
+            if LOCAL_QUOTA_MB
+            else None,
+        )
+        if not DISABLE_LOCAL
+        and LOCAL_FORMAT != "sqlite"
+        and (LOCAL_COMPRESSION != "none" or LOCAL_QUOTA_MB)
+        else None
+    )
+    if DISABLE_LOCAL:
+        car_cache = None
+    elif LOCAL_FORMAT == "binary":
+        car_cache = SessionLogWriter(
+            data_reader.fields,
+            car=config_gen.get_car_name(CAR_SELECTION),
+            config_hash=config_gen.get_config_hash(CAR_SELECTION),
+            flush_interval=LOCAL_FLUSH_INTERVAL - LOCAL_FLUSH_TICK,
+            flush_bytes=LOCAL_FLUSH_BYTES,
+            archiver=archiver,
+            **rotation,
+        )
+    elif LOCAL_FORMAT == "sqlite":
+        # Every session shares one database file, see LOCAL_QUOTA_MB in the README
+        if LOCAL_COMPRESSION != "none" or LOCAL_QUOTA_MB:
+            print(
+                "LOCAL_COMPRESSION and LOCAL_QUOTA_MB are ignored by the sqlite format"
+            )
+        car_cache = SQLiteTransmitter(
+            data_reader.fields,
+            database=getenv("LOCAL_DATABASE", "Data/telemetry.db"),
+            car=config_gen.get_car_name(CAR_SELECTION),
+            config_hash=config_gen.get_config_hash(CAR_SELECTION),
+            batch_size=int(getenv("LOCAL_BATCH_SIZE", 500)),
+            flush_interval=LOCAL_FLUSH_INTERVAL - LOCAL_FLUSH_TICK,
+        )
+    elif LOCAL_FORMAT == "csv":
+        car_cache = LocalTransmitter(
+            data_reader.fields,
+            flush_interval=LOCAL_FLUSH_INTERVAL - LOCAL_FLUSH_TICK,
+            flush_bytes=LOCAL_FLUSH_BYTES,
+            archiver=archiver,
+            **rotation,
+        )
+    else:
+        raise ValueError(f"Invalid local format: {LOCAL_FORMAT}")
+    # The catalog entry points at the session files, or at the database of the session
+    if isinstance(car_cache, SQLiteTransmitter):
+        local_session = (car_cache.name, getenv("LOCAL_DATABASE", "Data/telemetry.db"))
+    elif car_cache is not None:
+        local_session = (car_cache.session, car_cache.path)
+    # Optionally publish records to the cloud in batches, see telemetry_batch
+    REMOTE_BATCH_SIZE = getenv("REMOTE_BATCH_SIZE")
+    # Or let a feedback controller follow the link quality, see uplink_controller
+    REMOTE_ADAPTIVE = flags["REMOTE_ADAPTIVE"]
+    REMOTE_BATCHING = bool(REMOTE_BATCH_SIZE) or REMOTE_ADAPTIVE
+    REMOTE_BATCH_INTERVAL = float(getenv("REMOTE_BATCH_INTERVAL", 1.0))
+    # Optionally keep batches on disk until acknowledged, resent after a loss of signal
+    REMOTE_OUTBOX = getenv("REMOTE_OUTBOX")
+    outbox = (
+        Outbox(
+            REMOTE_OUTBOX,
+            max_bytes=int(float(getenv("REMOTE_OUTBOX_MB", 64)) * 1024 * 1024),
+        )
+        if not DISABLE_REMOTE and REMOTE_OUTBOX
+        else None
     )
     car_remote = (
-        RemoteTransmitter(config_gen=config_gen, sim_handler=sim_handler) if not DISABLE_REMOTE else None
+        RemoteTransmitter(
+            config_gen=config_gen,
+            sim_handler=sim_handler,
+            batch_size=int(REMOTE_BATCH_SIZE) if REMOTE_BATCH_SIZE else None,
+            batch_interval=REMOTE_BATCH_INTERVAL,
+            config_hash=config_gen.get_config_hash(CAR_SELECTION),
+            outbox=outbox,
+            backfill_rate=float(getenv("REMOTE_BACKFILL_RATE", 5.0)),
+            controller=UplinkController(
+                target_latency=float(getenv("REMOTE_TARGET_LATENCY", 1.0)),
+                max_rate=float(getenv("REMOTE_MAX_RATE", 100.0)),
+                batch_interval=REMOTE_BATCH_INTERVAL,
+            )
+            if REMOTE_ADAPTIVE
+            else None,
+        )
+        if not DISABLE_REMOTE
+        else None
     )
 
+    # Keep the last few minutes of records in memory for displays that (re)connect
+    history = TelemetryHistory(
+        data_reader.schema,
+        int(
+            float(getenv("HISTORY_MINUTES", "5"))
+            * 60
+            * float(getenv("HISTORY_RATE", "50"))
+        ),
+    )
+
+    async def backfill_display(sid, environ, auth=None):
+        """Send the recent history and active alarms to a newly connected display."""
+        window = history.last(BACKFILL_SECONDS)
+        await localDisplaySio.emit(
+            "history",
+            {name: column.tolist() for name, column in window.items()},
+            to=sid,
+        )
+        await localDisplaySio.emit("active_alarms", alarms.active, to=sid)
+
+    if not DISABLE_DISPLAY:
+        localDisplaySio.on("connect", backfill_display)
+
     # port='COM6' #for testing on Windows only
-    ser = SmSerial(timeout=0.025, crashloop=True)
+    ser = SmSerial(
+        timeout=0.025,
+        crashloop=True,
+        framed=flags["SERIAL_FRAMED"],
+        layout=packet_layout,
+    )
 
-    PACKET_SIZE = int(getenv("DATA_PACKET_SIZE")) if getenv("DATA_PACKET_SIZE") else 23
+    # Optionally summarize the session into a catalog, to list sessions without opening them.
+    # The summary wraps the local cache, so it counts the records the cache accepted.
+    LOCAL_CATALOG = getenv("LOCAL_CATALOG")
+    if car_cache is not None and LOCAL_CATALOG:
+        car_cache = SessionSummary(
+            LOCAL_CATALOG,
+            session=local_session[0],
+            fields=data_reader.fields,
+            location=local_session[1],
+            car=config_gen.get_car_name(CAR_SELECTION),
+            config_hash=config_gen.get_config_hash(CAR_SELECTION),
+            # The link counters only exist for framed packets
+            counters=ser.stats if flags["SERIAL_FRAMED"] else None,
+            sink=car_cache,
+        )
+    if car_cache is not None and flags["LOCAL_BACKGROUND"]:
+        # Write on a dedicated thread so SD card stalls never block the main loop,
+        # the catalog included
+        car_cache = BackgroundWriter(
+            car_cache,
+            max_queue=int(getenv("LOCAL_QUEUE_SIZE", 10000)),
+            overflow=getenv("LOCAL_OVERFLOW", "drop_oldest"),
+            flush_interval=LOCAL_FLUSH_TICK,
+        )
+
+    PACKET_SIZE = (
+        int(getenv("DATA_PACKET_SIZE"))
+        if getenv("DATA_PACKET_SIZE")
+        else packet_layout.size
+    )
 
     # Spinning up the local python server
     runner = web.AppRunner(app)
     await runner.setup()
     await web.TCPSite(runner, "0.0.0.0", 8080).start()
 
-    message_counter = 0
+    # Each sink gets its own decimation, see rate_policy for the available policies
+    display_policy = parse_rate_policy(getenv("DISPLAY_RATE", "latest:0"))
+    # Batches carry every record over the same link, single messages need decimating
+    remote_policy = parse_rate_policy(
+        getenv("REMOTE_RATE", "all" if REMOTE_BATCHING else "every:10")
+    )
+    local_policy = parse_rate_policy(getenv("LOCAL_RATE", "all"))
 
-    # Main server loop
-    while True:
-        if ser.is_open():
+    async def flush_local_cache():
+        """Keep the durability bound of the local cache while no packets arrive."""
+        while True:
+            await asyncio.sleep(LOCAL_FLUSH_TICK)
             try:
-                # read serial data from arduino
-                last_line = ser.read_response(PACKET_SIZE)
-
-                # parse the arduino data, send data to local (sio) and remote (cursor)
-                data = data_reader.parse_sensor_data(last_line)
-                sim_data = sim_handler.get_sim_data()
-                print(data)
-                if data:
-                    # Broadcast to connected clients
+                car_cache.flush_if_due()
+            except TransmitterError as exc:
+                print(f"Error transmitting data locally: {exc}")
+
+    flush_task = asyncio.create_task(flush_local_cache()) if not DISABLE_LOCAL else None
+
+    async def flush_remote_batch():
+        """Keep the latency bound of the remote batches while no packets arrive."""
+        while True:
+            await asyncio.sleep(REMOTE_BATCH_INTERVAL)
+            try:
+                car_remote.flush_if_due()
+            except TransmitterError as exc:
+                print(f"Error transmitting data remotely: {exc}")
+            if REMOTE_ADAPTIVE and not DISABLE_DISPLAY:
+                await localDisplaySio.emit("uplink_stats", car_remote.uplink_stats())
+
+    remote_flush_task = (
+        asyncio.create_task(flush_remote_batch())
+        if not DISABLE_REMOTE and REMOTE_BATCHING
+        else None
+    )
+
+    # Main server loop, wakes up whenever the arduino has sent data.
+    # Serial reconnects are handled in the background by the packet iterator.
+    try:
+        async for packets in ser.iter_packets(PACKET_SIZE):
+            # parse the arduino data, send data to local (sio) and remote (cursor)
+            records = data_reader.parse_packets(packets)
+            if not records:
+                continue
+            history.extend(records)
+            print(records[-1])
+
+            # Alarms bypass any decimation and go out as soon as they are detected
+            for record in records:
+                for event in alarms.check(record):
+                    print(f"Alarm: {event}")
                     if not DISABLE_DISPLAY:
-                        await localDisplaySio.emit("new_data", data)
-                        await localDisplaySio.emit("new_sim_data", sim_data)
-                        # TODO: Create way to identify which car we are using
-                    await asyncio.sleep(0.05)
-
-                    # Transmit to the cloud, only on every 10th message to reduce connection saturation
-                    if not DISABLE_REMOTE and message_counter % 10 == 0:
-                        car_remote.handle_record(data)
-                    message_counter += 1
-
-                    # Write data locally to a CSV file
-                    if not DISABLE_LOCAL:
-                        car_cache.handle_record(data)
-            except SmSerialError as exc:
-                print(exc)
+                        await localDisplaySio.emit("alarm", event.to_dict())
+                    if not DISABLE_REMOTE:
+                        try:
+                            car_remote.handle_alarm(event.to_dict())
+                        except TransmitterError as exc:
+                            print(f"Error transmitting alarm remotely: {exc}")
+
+            # Broadcast to connected clients
+            if not DISABLE_DISPLAY:
+                display_records = display_policy.select(records)
+                for data in display_records:
+                    await localDisplaySio.emit("new_data", data.to_dict())
+                if display_records:
+                    sim_data = sim_handler.get_sim_data()
+                    await localDisplaySio.emit("new_sim_data", sim_data)
+                # TODO: Create way to identify which car we are using
+
+            # Write records locally to a CSV file
+            if not DISABLE_LOCAL:
+                try:
+                    for record in local_policy.select(records):
+                        car_cache.handle_record(record)
+                except TransmitterError as exc:
+                    print(f"Error transmitting data locally: {exc}")
+
+            # Transmit to the cloud, decimated to reduce connection saturation
+            if not DISABLE_REMOTE:
+                try:
+                    for record in remote_policy.select(records):
+                        car_remote.handle_record(record)
+                except TransmitterError as exc:
+                    print(f"Error transmitting data remotely: {exc}")
+    except KeyboardInterrupt:
+        print("Keyboard Interrupt, closing connections")
+        ser.close()
+    finally:
+        # Write out whatever is still buffered or held back for the local cache
+        if not DISABLE_LOCAL:
+            flush_task.cancel()
+            try:
+                for record in local_policy.flush():
+                    car_cache.handle_record(record)
+                car_cache.close()
             except TransmitterError as exc:
-                print(f"Error transmitting data either locally or remotely: {exc}")
-            except KeyboardInterrupt:
-                print("Keyboard Interrupt, closing connections")
-                ser.close()
-                break
-        else:
-            # Serial is not open, give time to open
-            ser.reconnect()
-            sleep(3)
+                print(f"Error transmitting data locally: {exc}")
+            if isinstance(car_cache, BackgroundWriter):
+                print(f"Local writer stats: {car_cache.stats()}")
+        # Send the records the remote policy held back, e.g. the last minmax pair
+        if not DISABLE_REMOTE:
+            try:
+                for record in remote_policy.flush():
+                    car_remote.handle_record(record)
+            except TransmitterError as exc:
+                print(f"Error transmitting data remotely: {exc}")
+        if remote_flush_task is not None:
+            remote_flush_task.cancel()
+            try:
+                car_remote.flush()
+            except TransmitterError as exc:
+                print(f"Error transmitting data remotely: {exc}")
+            if REMOTE_ADAPTIVE:
+                print(f"Uplink stats: {car_remote.uplink_stats()}")
+        if outbox is not None:
+            # Batches not acknowledged yet are resent by the next run
+            car_remote.disconnect()
+            print(f"Remote outbox stats: {car_remote.outbox_stats()}")
+            outbox.close()
+        if archiver is not None:
+            archiver.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,239 @@
+"""
+Vectorized packet decoding for bulk and offline workloads.
+
+NumPy is an optional dependency, only needed for this module. Install it with `uv sync --extra numpy`.
+"""
+
+import struct
+
+from configuration_generator import (
+    DEFAULT_PACKET_LAYOUT,
+    DerivedField,
+    Metadata,
+    PacketLayout,
+    Sensor,
+)
+from data_reader import DataReader
+from telemetry_clock import MPH_TO_FT_PER_NS, TelemetryClock
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+# struct format characters and their NumPy equivalents
+NUMPY_TYPES = {
+    "b": "i1",
+    "B": "u1",
+    "h": "i2",
+    "H": "u2",
+    "i": "i4",
+    "I": "u4",
+    "q": "i8",
+    "Q": "u8",
+    "f": "f4",
+    "d": "f8",
+}
+
+
+def packet_dtype(packet_format: str) -> "np.dtype":
+    """
+    Build a structured dtype matching a little-endian struct packet format.
+
+    Args:
+        packet_format(str): struct format such as "<ffffBBBBBH"
+
+    Returns:
+        np.dtype: a packed structured dtype with one field per value, named f0, f1, ...
+    """
+    if not packet_format.startswith("<"):
+        raise ValueError(f"Packet format must be little-endian, got {packet_format}")
+    codes = packet_format[1:]
+    dtype = np.dtype(
+        [(f"f{i}", "<" + NUMPY_TYPES[code]) for i, code in enumerate(codes)]
+    )
+    if dtype.itemsize != struct.calcsize(packet_format):
+        raise ValueError(f"Unsupported packet format: {packet_format}")
+    return dtype
+
+
+def round_like_python(values: "np.ndarray", digits: int) -> "np.ndarray":
+    """
+    Round an array to the given number of decimals, exactly like the builtin round().
+
+    np.round scales, rounds and unscales, which can pick the other side of a tie when the
+    scaled value is inexact. Those rare near-tie elements are recomputed with round().
+    """
+    values = np.asarray(values, dtype=np.float64)
+    rounded = np.round(values, digits)
+    scaled = values * 10.0**digits
+    # NaN and infinity are never near a tie, and round() leaves them unchanged
+    with np.errstate(invalid="ignore"):
+        tolerance = np.abs(np.spacing(scaled))
+        near_tie = np.abs(np.abs(scaled - np.rint(scaled)) - 0.5) <= tolerance
+    for index in np.flatnonzero(near_tie):
+        rounded[index] = round(float(values[index]), digits)
+    return rounded
+
+
+class NumpyDataReader(DataReader):
+    """
+    A DataReader that can also decode whole buffers of packets into columns.
+
+    Conversion factors, rounding and distance integration are applied as vectorized
+    column operations, giving the same values as parse_sensor_data without building a
+    record per packet. Derived channels depend on their own history and are computed row
+    by row. Distance and derived channel state is shared with the scalar path, so both can
+    be used on the same stream.
+
+    Args:
+        sensors(dict[str, Sensor]): the current car sensor configuration
+        layout(PacketLayout, optional): the layout of the packets sent by the car
+        clock(TelemetryClock, optional): the clock used to stamp packets
+        derived(list[DerivedField], optional): channels computed from each record
+        metadata(Metadata, optional): the car metadata, used by some derived channels
+
+    Raises:
+        ImportError: If NumPy is not installed.
+    """
+
+    def __init__(
+        self,
+        sensors: dict[str, Sensor],
+        layout: PacketLayout = DEFAULT_PACKET_LAYOUT,
+        clock: TelemetryClock | None = None,
+        derived: list[DerivedField] | None = None,
+        metadata: Metadata | None = None,
+    ):
+        if np is None:
+            raise ImportError(
+                "NumpyDataReader requires NumPy, install it with `uv sync --extra numpy`"
+            )
+        super().__init__(sensors, layout, clock, derived, metadata)
+
+    def update_sensors(
+        self,
+        sensors: dict[str, Sensor],
+        layout: PacketLayout | None = None,
+        derived: list[DerivedField] | None = None,
+        metadata: Metadata | None = None,
+    ):
+        super().update_sensors(sensors, layout, derived, metadata)
+        self._dtype = packet_dtype(self._packet_format)
+
+    def parse_columns(
+        self, buffer: bytes, timestamps: "np.ndarray | None" = None
+    ) -> dict[str, "np.ndarray"]:
+        """
+        Decode a contiguous buffer of back-to-back packets into columns.
+
+        Args:
+            buffer(bytes): Raw bytes of zero or more whole packets.
+            timestamps(np.ndarray, optional): monotonic receive time of each packet in ns.
+                Defaults to TelemetryClock.spread of the reader clock.
+
+        Returns:
+            dict[str, np.ndarray]: one array per output field, in the same order as the
+                keys of a parse_sensor_data record.
+
+        Raises:
+            ValueError: If the buffer holds a partial packet or the timestamps do not match.
+        """
+        if len(buffer) % self._packet_size:
+            raise ValueError(
+                f"Invalid data size: expected a multiple of {self._packet_size}, got {len(buffer)}"
+            )
+        packets = np.frombuffer(buffer, dtype=self._dtype)
+        count = len(packets)
+        if timestamps is None:
+            timestamps = np.array(self._clock.spread(count), dtype=np.int64)
+        else:
+            timestamps = np.asarray(timestamps, dtype=np.int64)
+            if timestamps.shape != (count,):
+                raise ValueError(
+                    f"Expected {count} timestamps, got {timestamps.shape[0]}"
+                )
+
+        columns = {}
+        for name, index, field_type, scale, digits in self._columns:
+            raw = packets[f"f{index}"]
+            if digits is not None and scale == 1.0:
+                columns[name] = round_like_python(raw, digits)
+                continue
+            # Widen before scaling, the same way Python promotes the scalar values
+            is_float = field_type in "fd" or isinstance(scale, float)
+            values = raw.astype(np.float64 if is_float else np.int64) * scale
+            columns[name] = (
+                values if digits is None else round_like_python(values, digits)
+            )
+
+        columns["distance_traveled"] = round_like_python(
+            self._integrate_distance(columns["speed"], timestamps), 2
+        )
+        columns["time"] = self._to_wall_ms(timestamps)
+        if self._derived.fields:
+            self._derive_columns(columns, count)
+        return columns
+
+    def _derive_columns(self, columns: dict[str, "np.ndarray"], count: int):
+        """Compute the derived channels, which depend on their own history, row by row."""
+        base = [column.tolist() for column in columns.values()]
+        derived = [np.empty(count) for _ in self._derived.fields]
+        for row in range(count):
+            values = [column[row] for column in base]
+            self._derived.compute(values)
+            for column, value in zip(derived, values[len(base) :]):
+                column[row] = value
+        columns.update(zip(self._derived.fields, derived))
+
+    def _to_wall_ms(self, timestamps: "np.ndarray") -> "np.ndarray":
+        """Vectorized equivalent of TelemetryClock.to_wall_ms."""
+        offset_ns, check_mono_ns, rate = self._clock.mapping
+        correction = ((timestamps - check_mono_ns) * rate).astype(np.int64)
+        wall_ns = timestamps + offset_ns + correction
+        return (wall_ns // 1000) / 1000
+
+    def _integrate_distance(
+        self, speed: "np.ndarray", timestamps: "np.ndarray"
+    ) -> "np.ndarray":
+        """Vectorized equivalent of feeding every sample to the odometer in order."""
+        odometer = self._odometer
+        count = len(speed)
+        if count == 0:
+            return np.empty(0)
+
+        valid = np.isfinite(speed) & (speed >= 0) & (speed <= odometer.max_speed)
+        positions = np.flatnonzero(valid)
+        if len(positions) == 0:
+            return np.full(count, odometer.distance)
+
+        valid_speed = speed[positions]
+        valid_ns = timestamps[positions]
+        previous_speed = np.empty(len(positions))
+        previous_speed[1:] = valid_speed[:-1]
+        previous_ns = np.empty(len(positions), dtype=np.int64)
+        previous_ns[1:] = valid_ns[:-1]
+        if odometer.last_ns is None:
+            previous_speed[0] = 0.0
+            previous_ns[0] = valid_ns[0]
+        else:
+            previous_speed[0] = odometer.last_speed
+            previous_ns[0] = odometer.last_ns
+
+        delta = valid_ns - previous_ns
+        increments = (previous_speed + valid_speed) / 2 * MPH_TO_FT_PER_NS * delta
+        increments[(delta <= 0) | (delta > odometer.max_gap_ns)] = 0.0
+
+        # cumsum adds strictly in order, matching the scalar running sum bit for bit
+        totals = np.cumsum(np.concatenate(([odometer.distance], increments)))
+
+        # Invalid samples carry the distance of the last valid sample before them
+        last_valid = np.where(valid, np.arange(count), -1)
+        np.maximum.accumulate(last_valid, out=last_valid)
+        distance = totals[np.searchsorted(positions, last_valid) + 1]
+        distance[last_valid < 0] = odometer.distance
+
+        odometer.distance = float(totals[-1])
+        odometer.last_speed = float(valid_speed[-1])
+        odometer.last_ns = int(valid_ns[-1])
+        return distance
@@ -0,0 +1,207 @@
+"""
+Rate policies deciding which records each sink receives.
+
+Every sink (display, remote, local) has its own policy, so logging can run at the full
+packet rate while the display and the cloud get decimated streams, without one sink
+throttling another. Policies see each batch of records in order and return the records
+to deliver. Time based policies use the record "time" field. Records a policy holds
+back, like the extremes of an unfinished minmax interval, are returned by flush() when
+the sink shuts down.
+
+Policies are configured with a short spec string:
+
+    all                      every record
+    every:N                  every Nth record
+    interval:SECONDS         the first record of each interval
+    latest:SECONDS           the newest record of a batch, at most once per interval
+    minmax:SECONDS[:FIELD]   the records with the lowest and highest FIELD (default speed)
+                             of each interval, delivered in time order when it ends
+"""
+
+from abc import ABC, abstractmethod
+from typing import Mapping
+
+
+class RatePolicy(ABC):
+    """Base class for rate policies"""
+
+    @abstractmethod
+    def select(self, records: list[Mapping]) -> list[Mapping]:
+        """
+        Choose the records of a batch to deliver to the sink.
+
+        Args:
+            records(list[Mapping]): the new records, oldest first
+
+        Returns:
+            list[Mapping]: the records to deliver, oldest first
+        """
+
+    def flush(self) -> list[Mapping]:
+        """
+        Release the records held back for later batches, e.g. at shutdown.
+
+        Returns:
+            list[Mapping]: the records to deliver, oldest first
+        """
+        return []
+
+
+class AllPolicy(RatePolicy):
+    """Deliver every record."""
+
+    def select(self, records: list[Mapping]) -> list[Mapping]:
+        return records
+
+
+class EveryNthPolicy(RatePolicy):
+    """
+    Deliver every Nth record, starting with the first.
+
+    Args:
+        n(int): the decimation factor
+    """
+
+    def __init__(self, n: int):
+        if n < 1:
+            raise ValueError(f"Decimation factor must be at least 1, got {n}")
+        self._n = n
+        self._counter = 0
+
+    def select(self, records: list[Mapping]) -> list[Mapping]:
+        offset = -self._counter % self._n
+        self._counter += len(records)
+        return records[offset :: self._n]
+
+
+class IntervalPolicy(RatePolicy):
+    """
+    Deliver the first record of each interval.
+
+    Args:
+        seconds(float): the shortest time between delivered records
+    """
+
+    def __init__(self, seconds: float):
+        if seconds < 0:
+            raise ValueError(f"Interval must not be negative, got {seconds}")
+        self._interval_ms = seconds * 1000
+        self._next_ms: float | None = None
+
+    def select(self, records: list[Mapping]) -> list[Mapping]:
+        selected = []
+        for record in records:
+            time_ms = record["time"]
+            if self._next_ms is None or time_ms >= self._next_ms:
+                selected.append(record)
+                self._next_ms = time_ms + self._interval_ms
+        return selected
+
+
+class LatestPolicy(RatePolicy):
+    """
+    Deliver only the newest record of a batch, at most once per interval.
+
+    Args:
+        seconds(float): the shortest time between delivered records, 0 for every batch
+    """
+
+    def __init__(self, seconds: float):
+        if seconds < 0:
+            raise ValueError(f"Interval must not be negative, got {seconds}")
+        self._interval_ms = seconds * 1000
+        self._next_ms: float | None = None
+
+    def select(self, records: list[Mapping]) -> list[Mapping]:
+        if not records:
+            return []
+        newest = records[-1]
+        time_ms = newest["time"]
+        if self._next_ms is not None and time_ms < self._next_ms:
+            return []
+        self._next_ms = time_ms + self._interval_ms
+        return [newest]
+
+
+class MinMaxPolicy(RatePolicy):
+    """
+    Deliver the records with the lowest and highest value of a field in each interval.
+
+    Peaks survive the decimation, at the cost of a delay of up to one interval.
+
+    Args:
+        seconds(float): the length of each interval
+        field(str): the record field whose extremes are kept
+    """
+
+    def __init__(self, seconds: float, field: str = "speed"):
+        if seconds <= 0:
+            raise ValueError(f"Interval must be positive, got {seconds}")
+        self._interval_ms = seconds * 1000
+        self._field = field
+        self._end_ms: float | None = None
+        self._low: tuple[int, Mapping] | None = None
+        self._high: tuple[int, Mapping] | None = None
+        self._index = 0
+
+    def select(self, records: list[Mapping]) -> list[Mapping]:
+        selected = []
+        for record in records:
+            time_ms = record["time"]
+            if self._end_ms is None or time_ms >= self._end_ms:
+                selected.extend(self.flush())
+                self._end_ms = time_ms + self._interval_ms
+            self._index += 1
+            value = record[self._field]
+            if self._low is None or value < self._low[1][self._field]:
+                self._low = (self._index, record)
+            if self._high is None or value > self._high[1][self._field]:
+                self._high = (self._index, record)
+        return selected
+
+    def flush(self) -> list[Mapping]:
+        """
+        Release the extremes of the open interval in time order.
+
+        The next record starts a new interval.
+
+        Returns:
+            list[Mapping]: the pending lowest and highest records, oldest first
+        """
+        self._end_ms = None
+        if self._low is None:
+            return []
+        extremes = sorted({self._low[0]: self._low, self._high[0]: self._high}.values())
+        self._low = self._high = None
+        return [record for _, record in extremes]
+
+
+def parse_rate_policy(spec: str) -> RatePolicy:
+    """
+    Create a rate policy from its spec string, see the module documentation.
+
+    Args:
+        spec(str): the policy spec, e.g. "every:10" or "latest:0.05"
+
+    Returns:
+        RatePolicy: a new policy instance
+
+    Raises:
+        ValueError: If the spec is not a valid policy.
+    """
+    name, _, args = spec.strip().partition(":")
+    params = args.split(":") if args else []
+    try:
+        if name == "all" and not params:
+            return AllPolicy()
+        if name == "every" and len(params) == 1:
+            return EveryNthPolicy(int(params[0]))
+        if name == "interval" and len(params) == 1:
+            return IntervalPolicy(float(params[0]))
+        if name == "latest" and len(params) == 1:
+            return LatestPolicy(float(params[0]))
+        if name == "minmax" and len(params) in (1, 2):
+            return MinMaxPolicy(float(params[0]), *params[1:])
+    except ValueError as exc:
+        raise ValueError(f"Invalid rate policy {spec!r}: {exc}") from exc
+    raise ValueError(f"Invalid rate policy {spec!r}")
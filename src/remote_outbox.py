@@ -0,0 +1,198 @@
+"""
+Disk-backed store-and-forward outbox for the cloud upload.
+
+Out of cellular range, messages published with QoS 0 are lost, and messages waiting in the
+MQTT client's memory are lost on a restart. An Outbox keeps every batch message in a small
+SQLite database until the broker acknowledges it, so RemoteTransmitter can resend what
+is missing after a reconnect or a restart.
+
+Every message gets a sequence number, stored in the batch header (see telemetry_batch)
+or in the "sequence" key of an alarm.
+Sequence numbers keep increasing across restarts, so the cloud side can de-duplicate
+messages that were sent more than once, e.g. resent after a lost acknowledgement.
+
+The outbox is bounded: once its messages go over max_bytes, the oldest are dropped.
+"""
+
+import sqlite3
+import threading
+from typing import Collection
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    sequence INTEGER PRIMARY KEY AUTOINCREMENT,
+    topic TEXT NOT NULL,
+    payload BLOB NOT NULL
+);
+"""
+
+
+class OutboxError(Exception):
+    """Outbox error class"""
+
+
+class Outbox:
+    """
+    Messages waiting for the broker's acknowledgement, see the module documentation.
+
+    Safe to use from several threads, e.g. the main loop storing messages and the MQTT
+    thread removing the acknowledged ones.
+
+    Args:
+        path(str): path of the outbox database. Defaults to "Data/outbox.db".
+        max_bytes(int): most payload bytes kept, the oldest messages are dropped first.
+            Defaults to 64 MiB.
+
+    Raises:
+        OutboxError: If the database cannot be opened.
+        ValueError: If max_bytes is not positive.
+    """
+
+    def __init__(self, path: str = "Data/outbox.db", max_bytes: int = 64 * 1024 * 1024):
+        if max_bytes <= 0:
+            raise ValueError(f"Outbox size must be positive, got {max_bytes}")
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._dropped = 0
+        try:
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=FULL")
+            self._connection.executescript(SCHEMA)
+            row = self._connection.execute(
+                "SELECT seq FROM sqlite_sequence WHERE name = 'messages'"
+            ).fetchone()
+            self._last_sequence = row[0] if row else 0
+            self._count, self._bytes = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM messages"
+            ).fetchone()
+        except sqlite3.Error as exc:
+            raise OutboxError(f"Cannot open outbox {path}: {exc}") from exc
+
+    def next_sequence(self) -> int:
+        """
+        Reserve the sequence number of the next message.
+
+        Returns:
+            int: a number greater than that of every message stored before, even by a
+                previous run
+        """
+        with self._lock:
+            self._last_sequence += 1
+            return self._last_sequence
+
+    def put(self, sequence: int, topic: str, payload: bytes):
+        """
+        Store a message until it is acknowledged, dropping the oldest if over the size bound.
+
+        Args:
+            sequence(int): the sequence number of the message, see next_sequence
+            topic(str): the topic to publish the message on
+            payload(bytes): the message
+
+        Raises:
+            OutboxError: If the message cannot be stored.
+        """
+        with self._lock:
+            try:
+                with self._connection:
+                    self._connection.execute(
+                        "INSERT INTO messages (sequence, topic, payload) VALUES (?, ?, ?)",
+                        (sequence, topic, payload),
+                    )
+                    self._count += 1
+                    self._bytes += len(payload)
+                    while self._bytes > self._max_bytes and self._count > 1:
+                        oldest, size = self._connection.execute(
+                            "SELECT sequence, LENGTH(payload) FROM messages ORDER BY sequence LIMIT 1"
+                        ).fetchone()
+                        self._connection.execute(
+                            "DELETE FROM messages WHERE sequence = ?", (oldest,)
+                        )
+                        self._count -= 1
+                        self._bytes -= size
+                        self._dropped += 1
+            except sqlite3.Error as exc:
+                self._count, self._bytes = self._connection.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM messages"
+                ).fetchone()
+                raise OutboxError(f"Cannot store message {sequence}: {exc}") from exc
+
+    def peek(
+        self, after: int = 0, skip: Collection[int] = (), topic: str | None = None
+    ) -> tuple[int, str, bytes] | None:
+        """
+        Find the oldest stored message after a sequence number.
+
+        Args:
+            after(int): only messages with a greater sequence number
+            skip(Collection[int]): sequence numbers to leave out, e.g. messages in flight
+            topic(str, optional): only messages on this topic
+
+        Returns:
+            tuple[int, str, bytes] | None: the sequence number, topic and payload, or None
+                if there is no such message
+
+        Raises:
+            OutboxError: If the outbox cannot be read.
+        """
+        skip = list(skip)
+        placeholders = ", ".join("?" * len(skip))
+        on_topic = "" if topic is None else " AND topic = ?"
+        with self._lock:
+            try:
+                return self._connection.execute(
+                    "SELECT sequence, topic, payload FROM messages"
+                    f" WHERE sequence > ? AND sequence NOT IN ({placeholders}){on_topic}"
+                    " ORDER BY sequence LIMIT 1",
+                    (after, *skip, *([] if topic is None else [topic])),
+                ).fetchone()
+            except sqlite3.Error as exc:
+                raise OutboxError(f"Cannot read outbox: {exc}") from exc
+
+    def remove(self, sequence: int):
+        """
+        Delete an acknowledged message. Messages already dropped are ignored.
+
+        Args:
+            sequence(int): the sequence number of the message
+
+        Raises:
+            OutboxError: If the message cannot be deleted.
+        """
+        with self._lock:
+            try:
+                with self._connection:
+                    row = self._connection.execute(
+                        "SELECT LENGTH(payload) FROM messages WHERE sequence = ?",
+                        (sequence,),
+                    ).fetchone()
+                    if row is None:
+                        return
+                    self._connection.execute(
+                        "DELETE FROM messages WHERE sequence = ?", (sequence,)
+                    )
+                    self._count -= 1
+                    self._bytes -= row[0]
+            except sqlite3.Error as exc:
+                raise OutboxError(f"Cannot remove message {sequence}: {exc}") from exc
+
+    def stats(self) -> dict[str, int]:
+        """
+        Outbox metrics.
+
+        Returns:
+            dict[str, int]: the messages and payload bytes stored, and the messages dropped
+                to keep the size bound
+        """
+        with self._lock:
+            return {
+                "pending": self._count,
+                "bytes": self._bytes,
+                "dropped": self._dropped,
+            }
+
+    def close(self):
+        """Close the outbox database, stored messages are kept for the next run."""
+        with self._lock:
+            self._connection.close()
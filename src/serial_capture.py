@@ -0,0 +1,145 @@
+"""
+Raw serial capture and replay.
+
+A capture file is a compact binary log of every raw byte chunk read from the serial port:
+
+    HEADER: magic (6 bytes, b"SMCAP1") | wall clock start time (uint64 ns since epoch)
+    CHUNK:  monotonic offset from start (uint64 ns) | length (uint32) | raw bytes
+
+All integers are little-endian. Captures can be fed back through SmSerial with their
+original timing, scaled in speed, or as fast as possible.
+"""
+
+import struct
+import time
+from typing import BinaryIO, Iterator
+
+CAPTURE_MAGIC = b"SMCAP1"
+CAPTURE_HEADER = struct.Struct("<6sQ")
+CHUNK_HEADER = struct.Struct("<QI")
+
+
+class CaptureError(Exception):
+    """Serial capture error class"""
+
+
+class CaptureWriter:
+    """
+    Writes raw serial chunks with a monotonic timestamp to a capture file.
+
+    Args:
+        path(str): the capture file to create, overwritten if it exists
+    """
+
+    def __init__(self, path: str):
+        self._file: BinaryIO = open(path, "wb")
+        self._start_ns = time.monotonic_ns()
+        self._file.write(CAPTURE_HEADER.pack(CAPTURE_MAGIC, time.time_ns()))
+
+    def write(self, chunk: bytes):
+        """
+        Append a raw chunk to the capture. Empty chunks are skipped.
+
+        Args:
+            chunk(bytes): the bytes returned by a single serial read
+        """
+        if chunk:
+            offset = time.monotonic_ns() - self._start_ns
+            self._file.write(CHUNK_HEADER.pack(offset, len(chunk)))
+            self._file.write(chunk)
+
+    def close(self):
+        """Flush and close the capture file."""
+        self._file.close()
+
+
+def read_capture(path: str) -> tuple[int, Iterator[tuple[int, bytes]]]:
+    """
+    Open a capture file for reading.
+
+    Args:
+        path(str): the capture file to read
+
+    Returns:
+        tuple[int, Iterator[tuple[int, bytes]]]: the wall clock start time of the capture in
+            ns since epoch, and an iterator of (monotonic offset in ns, chunk) pairs.
+
+    Raises:
+        CaptureError: If the file is not a capture file.
+    """
+    file = open(path, "rb")
+    header = file.read(CAPTURE_HEADER.size)
+    if len(header) < CAPTURE_HEADER.size or header[:6] != CAPTURE_MAGIC:
+        file.close()
+        raise CaptureError(f"{path} is not a serial capture file")
+    _, start_time_ns = CAPTURE_HEADER.unpack(header)
+
+    def chunks() -> Iterator[tuple[int, bytes]]:
+        with file:
+            while True:
+                chunk_header = file.read(CHUNK_HEADER.size)
+                if len(chunk_header) < CHUNK_HEADER.size:
+                    return
+                offset, length = CHUNK_HEADER.unpack(chunk_header)
+                chunk = file.read(length)
+                if len(chunk) < length:
+                    return  # capture was cut off mid-chunk
+                yield offset, chunk
+
+    return start_time_ns, chunks()
+
+
+class ReplaySource:
+    """
+    Feeds a capture file back as a raw byte source with its original timing.
+
+    Args:
+        path(str): the capture file to replay
+        speed(float): playback speed multiplier, 1.0 is real time. 0 replays as fast as possible.
+    """
+
+    def __init__(self, path: str, speed: float = 1.0):
+        if speed < 0:
+            raise CaptureError(f"Replay speed must not be negative, got {speed}")
+        _, self._chunks = read_capture(path)
+        self._speed = speed
+        self._next = next(self._chunks, None)
+        self._start_ns: int | None = None
+
+    @property
+    def exhausted(self) -> bool:
+        """True once every chunk of the capture has been returned."""
+        return self._next is None
+
+    def time_until_next(self) -> float | None:
+        """
+        Seconds until the next chunk is due, or None when the capture is exhausted.
+        """
+        if self._next is None:
+            return None
+        if self._speed == 0:
+            return 0.0
+        if self._start_ns is None:
+            self._start_ns = time.monotonic_ns() - int(self._next[0] / self._speed)
+        due_ns = self._start_ns + self._next[0] / self._speed
+        return max(0.0, (due_ns - time.monotonic_ns()) / 1e9)
+
+    def read(self) -> bytes:
+        """
+        Return every chunk that is due by now, joined together.
+
+        When replaying as fast as possible, a single chunk is returned per call so the
+        consumer sees the same read boundaries as during capture.
+        """
+        if self._next is None:
+            return b""
+        if self._speed == 0:
+            chunk = self._next[1]
+            self._next = next(self._chunks, None)
+            return chunk
+
+        due = []
+        while self._next is not None and self.time_until_next() == 0:
+            due.append(self._next[1])
+            self._next = next(self._chunks, None)
+        return b"".join(due)
@@ -0,0 +1,145 @@
+"""
+Framing for the Arduino serial protocol.
+
+Each packet on the wire is wrapped as:
+
+    SYNC (2 bytes, 0xAA 0x55) | LENGTH (1 byte) | PAYLOAD (LENGTH bytes) | CRC (2 bytes, LE)
+
+The CRC is CRC-16/CCITT-FALSE computed over the length byte and the payload. Because the
+length is inside the checksum, a corrupted length can never make the decoder swallow a
+valid frame that follows it.
+"""
+
+from binascii import crc_hqx
+
+SYNC_WORD = b"\xaa\x55"
+HEADER_SIZE = len(SYNC_WORD) + 1
+CRC_SIZE = 2
+MAX_PAYLOAD_SIZE = 255
+CRC_INIT = 0xFFFF
+
+
+def frame_crc(data: bytes) -> int:
+    """Compute the frame checksum for the given bytes (length byte + payload)."""
+    return crc_hqx(data, CRC_INIT)
+
+
+def encode_frame(payload: bytes) -> bytes:
+    """
+    Wrap a payload in a sync header, length byte and CRC.
+
+    Args:
+        payload(bytes): the packet to frame, 1 to 255 bytes long.
+
+    Returns:
+        bytes: the framed packet, ready to be written to the wire.
+
+    Raises:
+        ValueError: If the payload is empty or too long to be framed.
+    """
+    length = len(payload)
+    if not 0 < length <= MAX_PAYLOAD_SIZE:
+        raise ValueError(
+            f"Frame payload must be 1-{MAX_PAYLOAD_SIZE} bytes, got {length}"
+        )
+    body = bytes((length,)) + bytes(payload)
+    return SYNC_WORD + body + frame_crc(body).to_bytes(CRC_SIZE, "little")
+
+
+class FrameDecoder:
+    """
+    Streaming decoder that finds frames in an arbitrary byte stream.
+
+    Bytes can be fed in chunks of any size; partial frames are held until the rest
+    arrives. When a header or checksum is invalid the decoder slides forward one byte
+    and searches for the next sync word, so a single corrupted or dropped byte costs at
+    most the frame it landed in.
+
+    Attributes:
+        frames_decoded(int): number of valid frames returned so far
+        crc_failures(int): number of complete frames rejected by the checksum
+        resync_events(int): number of times the decoder lost lock and had to search for a sync word
+        bytes_discarded(int): number of bytes thrown away while searching for a sync word
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._in_sync = True
+        self.frames_decoded = 0
+        self.crc_failures = 0
+        self.resync_events = 0
+        self.bytes_discarded = 0
+
+    def feed(self, data: bytes) -> list[bytes]:
+        """
+        Add bytes to the stream and return every frame they complete.
+
+        Args:
+            data(bytes): the next chunk of raw bytes from the wire.
+
+        Returns:
+            list[bytes]: the payloads of all valid frames completed by this chunk, in order.
+        """
+        buffer = self._buffer
+        buffer += data
+        end = len(buffer)
+        frames = []
+        pos = 0
+
+        while True:
+            start = buffer.find(SYNC_WORD, pos)
+            if start < 0:
+                # Keep a trailing first sync byte, the second may be in the next chunk
+                keep_from = end - 1 if buffer.endswith(SYNC_WORD[:1]) else end
+                pos = self._discard(pos, keep_from)
+                break
+            pos = self._discard(pos, start)
+
+            if end - start < HEADER_SIZE:
+                break
+            length = buffer[start + 2]
+            if length == 0:
+                pos = self._discard(start, start + 1)
+                continue
+            frame_end = start + HEADER_SIZE + length + CRC_SIZE
+            if frame_end > end:
+                break
+
+            crc_start = frame_end - CRC_SIZE
+            expected_crc = int.from_bytes(buffer[crc_start:frame_end], "little")
+            if frame_crc(buffer[start + 2 : crc_start]) != expected_crc:
+                self.crc_failures += 1
+                pos = self._discard(start, start + 1)
+                continue
+
+            frames.append(bytes(buffer[start + HEADER_SIZE : crc_start]))
+            self.frames_decoded += 1
+            self._in_sync = True
+            pos = frame_end
+
+        del buffer[:pos]
+        return frames
+
+    def reset(self):
+        """Drop any partially received frame, e.g. after a reconnect."""
+        self._buffer.clear()
+        self._in_sync = True
+
+    def stats(self) -> dict:
+        """Return the decoder counters as a dictionary."""
+        return {
+            "frames_decoded": self.frames_decoded,
+            "crc_failures": self.crc_failures,
+            "resync_events": self.resync_events,
+            "bytes_discarded": self.bytes_discarded,
+        }
+
+    def _discard(self, start: int, stop: int) -> int:
+        """Account for skipping buffer[start:stop] and return the new read position."""
+        if stop > start:
+            self.bytes_discarded += stop - start
+            if self._in_sync:
+                self.resync_events += 1
+                self._in_sync = False
+            return stop
+        return start
@@ -0,0 +1,282 @@
+"""
+Compression and disk quota for the local session files.
+
+Local transmitters can rotate a session into numbered segments:
+
+    Data/<session>_car_data.csv, Data/<session>_car_data.1.csv, Data/<session>_car_data.2.csv, ...
+
+where <session> is the start timestamp of the session, and a segment may have a time index
+next to it, named after the uncompressed segment with an .idx suffix. A SessionArchiver
+compresses closed segments on its own thread, so a rotation never stalls the ingest path,
+and deletes the oldest sessions once the files in the data directory go over a size quota.
+Segments left uncompressed by a previous run, e.g. the last segment of each session, are
+compressed when a new session begins.
+
+gzip is always available, zstd needs the optional zstandard package
+(`uv sync --extra zstd`).
+"""
+
+import gzip
+import os
+import re
+import shutil
+import struct
+import threading
+from collections import deque
+from typing import NamedTuple
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+# Sparse time index entry: record time (ms since epoch) | byte offset of the record
+INDEX_ENTRY = struct.Struct("<dQ")
+INDEX_SUFFIX = ".idx"
+SEGMENT_PATTERN = re.compile(
+    r"(?P<session>.+)_car_data(?:\.(?P<segment>\d+))?\.(?P<format>csv|smlog)"
+    r"(?:(?P<compression>\.gz|\.zst)|(?P<index>\.idx))?"
+)
+
+
+class SegmentName(NamedTuple):
+    """The parts of a session segment file name"""
+
+    session: str
+    segment: int
+    format: str
+    compression: str | None
+    index: bool = False
+
+
+def parse_segment_name(name: str) -> SegmentName | None:
+    """
+    Split a session file name into its parts.
+
+    Args:
+        name(str): a file name, without its directory
+
+    Returns:
+        SegmentName | None: the session, segment number, format ("csv" or "smlog"),
+            compression ("gzip", "zstd" or None) and whether it is the time index of the
+            segment, or None if it is not a session file
+    """
+    match = SEGMENT_PATTERN.fullmatch(name)
+    if match is None:
+        return None
+    suffix = match["compression"]
+    compression = next(
+        (kind for kind, value in COMPRESSION_SUFFIXES.items() if value == suffix), None
+    )
+    return SegmentName(
+        match["session"],
+        int(match["segment"] or 0),
+        match["format"],
+        compression,
+        match["index"] is not None,
+    )
+
+
+def segment_file_name(session: str, segment: int, extension: str) -> str:
+    """
+    Name of a session segment file, the first segment has no number.
+
+    Args:
+        session(str): the session, i.e. its start timestamp
+        segment(int): the segment number, from 0
+        extension(str): the file format extension, e.g. "csv"
+
+    Returns:
+        str: the file name, without its directory
+    """
+    number = f".{segment}" if segment else ""
+    return f"{session}_car_data{number}.{extension}"
+
+
+class SessionArchiver:
+    """
+    Compresses closed session segments and enforces a disk quota on a background thread.
+
+    Args:
+        data_dir(str): the directory holding the session files
+        compression(str | None): "gzip", "zstd" or None to keep segments uncompressed
+        max_bytes(int | None): size quota of the session files in the directory. The
+            oldest sessions are deleted until they fit, except the active ones. None for
+            no quota.
+
+    Raises:
+        ValueError: If the compression is unknown or not available, or the quota is not positive.
+    """
+
+    def __init__(
+        self,
+        data_dir: str = "Data",
+        compression: str | None = "gzip",
+        max_bytes: int | None = None,
+    ):
+        if compression is not None and compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"Invalid compression: {compression}")
+        if compression == "zstd" and zstandard is None:  # pragma: no cover
+            raise ValueError("zstd compression needs the zstandard package")
+        if max_bytes is not None and max_bytes <= 0:
+            raise ValueError(f"Disk quota must be positive, got {max_bytes}")
+        self._data_dir = data_dir
+        self._compression = compression
+        self._max_bytes = max_bytes
+
+        self._active: set[str] = set()
+        self._jobs: deque[str | None] = deque()
+        self._condition = threading.Condition()
+        self._closing = False
+        self._compressed = 0
+        self._evicted = 0
+
+        self._thread = threading.Thread(
+            target=self._run, name="session-archiver", daemon=True
+        )
+        self._thread.start()
+
+    def begin_session(self, session: str):
+        """
+        Mark a session as active, and tidy up after the previous ones.
+
+        Active sessions are never deleted and only their submitted segments are
+        compressed. Uncompressed segments of other sessions are queued for compression.
+
+        Args:
+            session(str): the session, i.e. its start timestamp
+        """
+        with self._condition:
+            self._active.add(session)
+            self._jobs.append(None)
+            self._condition.notify_all()
+
+    def submit(self, path: str):
+        """
+        Queue a closed segment for compression, then enforce the quota.
+
+        Args:
+            path(str): the segment file, which must not be written anymore
+        """
+        with self._condition:
+            self._jobs.append(path)
+            self._condition.notify_all()
+
+    def stats(self) -> dict[str, int]:
+        """
+        Archiving metrics.
+
+        Returns:
+            dict[str, int]: the segments waiting, the segments compressed and the sessions
+                deleted to keep the quota
+        """
+        with self._condition:
+            return {
+                "pending": len(self._jobs),
+                "compressed": self._compressed,
+                "evicted": self._evicted,
+            }
+
+    def close(self, timeout: float | None = 10.0):
+        """
+        Stop the archiver thread once the segment being compressed is done.
+
+        Segments still queued stay uncompressed, and are compressed when the next session
+        begins.
+
+        Args:
+            timeout(float | None): longest time in seconds to wait for the thread
+        """
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+
+    def _run(self):
+        """Archiver thread, handles the queued jobs until closed."""
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._jobs or self._closing)
+                if self._closing:
+                    return
+                job = self._jobs.popleft()
+            try:
+                if job is None:
+                    self._sweep()
+                else:
+                    self._compress(job)
+                self._enforce_quota()
+            except OSError as exc:  # retried by the next sweep
+                print(f"Error archiving local data: {exc}")
+
+    def _sessions(self) -> dict[str, list[tuple[str, SegmentName, int]]]:
+        """The session files of the data directory with their size, by session."""
+        sessions: dict[str, list[tuple[str, SegmentName, int]]] = {}
+        with os.scandir(self._data_dir) as entries:
+            for entry in entries:
+                name = parse_segment_name(entry.name)
+                if name is not None and entry.is_file():
+                    sessions.setdefault(name.session, []).append(
+                        (entry.path, name, entry.stat().st_size)
+                    )
+        return sessions
+
+    def _sweep(self):
+        """Remove unfinished compressions and compress the segments of past sessions."""
+        with os.scandir(self._data_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith(".tmp") and "_car_data" in entry.name:
+                    os.remove(entry.path)
+        if self._compression is None:
+            return
+        with self._condition:
+            active = set(self._active)
+        for session, files in self._sessions().items():
+            if session in active:
+                continue
+            for path, name, _ in files:
+                # Time indexes are small and must stay seekable
+                if name.compression is None and not name.index:
+                    self._compress(path)
+
+    def _compress(self, path: str):
+        """Compress a segment next to it, then delete the original."""
+        if self._compression is None:
+            return
+        target = path + COMPRESSION_SUFFIXES[self._compression]
+        # Written under a temporary name, so a power cut never leaves a partial archive
+        with open(path, "rb") as source, open(target + ".tmp", "wb") as destination:
+            if self._compression == "zstd":
+                zstandard.ZstdCompressor().copy_stream(source, destination)
+            else:
+                with gzip.GzipFile(
+                    fileobj=destination, mode="wb", compresslevel=6
+                ) as compressed:
+                    shutil.copyfileobj(source, compressed)
+            destination.flush()
+            os.fsync(destination.fileno())
+        os.replace(target + ".tmp", target)
+        os.remove(path)
+        with self._condition:
+            self._compressed += 1
+
+    def _enforce_quota(self):
+        """Delete the oldest inactive sessions until the session files fit the quota."""
+        if self._max_bytes is None:
+            return
+        sessions = self._sessions()
+        total = sum(size for files in sessions.values() for _, _, size in files)
+        with self._condition:
+            active = set(self._active)
+        # Session names are timestamps, so they sort oldest first
+        for session in sorted(sessions):
+            if total <= self._max_bytes:
+                return
+            if session in active:
+                continue
+            for path, _, size in sessions[session]:
+                os.remove(path)
+                total -= size
+            with self._condition:
+                self._evicted += 1
@@ -0,0 +1,365 @@
+"""
+A catalog of the recorded sessions, for listing them without opening their files.
+
+The catalog is a small SQLite database with one row per session: its car name and
+configuration hash, where its records are stored, its first and last record time, its
+record count, the link quality counters of the serial connection (null when the link
+is not framed, the counters do not apply) and the min, max and mean of every channel. A SessionSummary keeps these up to date while the session runs,
+rewriting its row every few seconds, so a session cut by a power cut is still listed
+with nearly all of its records.
+
+Sessions are listed and filtered by car, configuration hash or time range from the
+catalog alone:
+
+    python src/session_catalog.py --car car1 --start 2024-06-01 --end 2024-06-02
+
+Sessions deleted to keep the disk quota stay in the catalog.
+
+A SessionSummary can wrap the local cache, so it summarizes exactly the records the
+cache accepted. Wrapped in turn by a BackgroundWriter, the catalog is written on the
+writer thread, and the records the writer drops are not counted.
+"""
+
+import argparse
+import json
+import math
+import sqlite3
+import time
+from typing import Callable, Mapping, Sequence
+
+from data_transmitter import DataTransmitter, TransmitterError
+from session_query import parse_time
+
+TIME_FIELD = "time"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session TEXT PRIMARY KEY,
+    location TEXT,
+    car TEXT,
+    config_hash TEXT,
+    start_time REAL,
+    end_time REAL,
+    records INTEGER NOT NULL,
+    counters TEXT NOT NULL,
+    channels TEXT NOT NULL,
+    closed INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_start_time ON sessions (start_time);
+"""
+COLUMNS = (
+    "session",
+    "location",
+    "car",
+    "config_hash",
+    "start_time",
+    "end_time",
+    "records",
+    "counters",
+    "channels",
+    "closed",
+)
+
+
+def connect(catalog: str) -> sqlite3.Connection:
+    """
+    Open a session catalog, creating it if needed.
+
+    Args:
+        catalog(str): path of the catalog database
+
+    Returns:
+        sqlite3.Connection: a connection in WAL mode, usable from any one thread at a time
+    """
+    connection = sqlite3.connect(catalog, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+class SessionSummary(DataTransmitter):
+    """
+    A transmitter summarizing the records of a session into the catalog.
+
+    Give it the same records as the local cache, or give it the local cache as its sink.
+    The summary is written to the catalog once update_interval seconds have passed since
+    the last write, when a record arrives or flush_if_due is called, and on close.
+
+    Args:
+        catalog(str): path of the catalog database
+        session(str): the session name, e.g. the start timestamp of the local session files
+        fields(Sequence[str]): the record fields, in record order, e.g. DataReader.fields
+        location(str, optional): where the records are stored, e.g. the first session file
+        car(str, optional): the name of the car
+        config_hash(str, optional): the car's configuration hash
+        counters(Callable[[], dict], optional): returns the packet loss counters to store,
+            e.g. SmSerial.stats of a framed link. Without it the counters are stored as null,
+            not applicable, rather than as zeros.
+        update_interval(float, optional): seconds between catalog writes. Defaults to 10.
+        sink(DataTransmitter, optional): the local cache, records are passed on to it and
+            summarized once it accepted them. Its flush_if_due, flush and close are called
+            first by those of the summary.
+
+    Raises:
+        TransmitterError: If the catalog cannot be opened.
+    """
+
+    def __init__(
+        self,
+        catalog: str,
+        session: str,
+        fields: Sequence[str],
+        location: str | None = None,
+        car: str | None = None,
+        config_hash: str | None = None,
+        counters: Callable[[], dict] | None = None,
+        update_interval: float = 10.0,
+        sink: DataTransmitter | None = None,
+    ):
+        self._sink = sink
+        self._session = session
+        self._fields = list(fields)
+        self._location = location
+        self._car = car
+        self._config_hash = config_hash
+        self._counters = counters
+        self._update_interval = update_interval
+
+        self._time_position = (
+            self._fields.index(TIME_FIELD) if TIME_FIELD in self._fields else None
+        )
+        self._records = 0
+        self._start_time: float | None = None
+        self._end_time: float | None = None
+        self._count = [0] * len(self._fields)
+        self._minimum = [math.inf] * len(self._fields)
+        self._maximum = [-math.inf] * len(self._fields)
+        self._sum = [0.0] * len(self._fields)
+        self._last_update = time.monotonic()
+        try:
+            self._connection = connect(catalog)
+        except sqlite3.Error as exc:
+            raise TransmitterError(f"Cannot open catalog {catalog}: {exc}") from exc
+        self._write(closed=False)
+
+    def handle_record(self, data: Mapping):
+        """
+        Add the data record to the summary, writing it to the catalog when due.
+
+        Values that are not numbers, or are NaN, are left out of the channel statistics.
+
+        Args:
+            data(Mapping): the data record, e.g. a TelemetryRecord, with its values in
+                the order of the session fields
+
+        Raises:
+            TransmitterError: If the sink rejects the record, which is then not
+                summarized, or the catalog cannot be written.
+        """
+        if self._sink is not None:
+            self._sink.handle_record(data)
+        values = list(data.values())
+        for position, value in enumerate(values[: len(self._fields)]):
+            if not isinstance(value, (int, float)) or value != value:
+                continue
+            self._count[position] += 1
+            self._sum[position] += value
+            if value < self._minimum[position]:
+                self._minimum[position] = value
+            if value > self._maximum[position]:
+                self._maximum[position] = value
+        self._records += 1
+        if self._time_position is not None and self._time_position < len(values):
+            record_time = values[self._time_position]
+        else:
+            record_time = time.time_ns() / 1e6
+        if self._start_time is None:
+            self._start_time = record_time
+        self._end_time = record_time
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        """
+        Write the summary if update_interval seconds have passed since the last write.
+
+        Raises:
+            TransmitterError: If the sink or the catalog cannot be written.
+        """
+        try:
+            if self._sink is not None:
+                self._sink.flush_if_due()
+        finally:
+            if time.monotonic() - self._last_update >= self._update_interval:
+                self._write(closed=False)
+
+    def flush(self):
+        """
+        Write the summary to the catalog.
+
+        Raises:
+            TransmitterError: If the sink or the catalog cannot be written.
+        """
+        try:
+            if self._sink is not None:
+                self._sink.flush()
+        finally:
+            self._write(closed=False)
+
+    def close(self):
+        """
+        Close the sink, then write the final summary and close the catalog.
+
+        Raises:
+            TransmitterError: If the sink or the catalog cannot be written.
+        """
+        try:
+            if self._sink is not None:
+                self._sink.close()
+        finally:
+            try:
+                self._write(closed=True)
+            finally:
+                self._connection.close()
+
+    def summary(self) -> dict:
+        """
+        The current summary of the session.
+
+        Returns:
+            dict: the catalog entry, see list_sessions
+        """
+        channels = {
+            field: {
+                "min": self._minimum[position],
+                "max": self._maximum[position],
+                "mean": self._sum[position] / self._count[position],
+            }
+            for position, field in enumerate(self._fields)
+            if self._count[position]
+        }
+        return {
+            "session": self._session,
+            "location": self._location,
+            "car": self._car,
+            "config_hash": self._config_hash,
+            "start_time": self._start_time,
+            "end_time": self._end_time,
+            "records": self._records,
+            "counters": self._counters() if self._counters is not None else None,
+            "channels": channels,
+        }
+
+    def _write(self, closed: bool):
+        """Replace the catalog row of the session with the current summary."""
+        self._last_update = time.monotonic()
+        summary = self.summary()
+        summary["counters"] = json.dumps(summary["counters"])
+        summary["channels"] = json.dumps(summary["channels"])
+        summary["closed"] = closed
+        try:
+            with self._connection:
+                self._connection.execute(
+                    f"INSERT OR REPLACE INTO sessions ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                    [summary[column] for column in COLUMNS],
+                )
+        except sqlite3.Error as exc:
+            raise TransmitterError(f"Problem writing to catalog: {exc}") from exc
+
+
+def list_sessions(
+    catalog: str,
+    car: str | None = None,
+    config_hash: str | None = None,
+    start: float | None = None,
+    end: float | None = None,
+) -> list[dict]:
+    """
+    List the sessions of a catalog, optionally filtered.
+
+    Args:
+        catalog(str): path of the catalog database
+        car(str, optional): only the sessions of this car
+        config_hash(str, optional): only the sessions recorded with this configuration
+        start(float, optional): only the sessions with records at or after this time, in ms
+            since epoch
+        end(float, optional): only the sessions with records at or before this time, in ms
+            since epoch
+
+    Returns:
+        list[dict]: the session, location, car, config_hash, start_time, end_time (ms since
+            epoch), records, counters (None when not applicable), channels ({field: {"min",
+            "max", "mean"}}) and whether the session was closed cleanly, oldest first
+    """
+    conditions, parameters = [], []
+    for column, value in (("car", car), ("config_hash", config_hash)):
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            parameters.append(value)
+    if start is not None:
+        conditions.append("end_time >= ?")
+        parameters.append(start)
+    if end is not None:
+        conditions.append("start_time <= ?")
+        parameters.append(end)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    connection = connect(catalog)
+    try:
+        rows = connection.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM sessions{where} ORDER BY start_time",
+            parameters,
+        ).fetchall()
+    finally:
+        connection.close()
+    sessions = []
+    for row in rows:
+        session = dict(zip(COLUMNS, row))
+        session["counters"] = json.loads(session["counters"])
+        session["channels"] = json.loads(session["channels"])
+        session["closed"] = bool(session["closed"])
+        sessions.append(session)
+    return sessions
+
+
+def main(argv: Sequence[str] | None = None):
+    """Command line entry point, printing the sessions of a catalog."""
+    parser = argparse.ArgumentParser(description="List the recorded sessions.")
+    parser.add_argument(
+        "--catalog", default="Data/catalog.db", help="the catalog database"
+    )
+    parser.add_argument("--car", help="only the sessions of this car")
+    parser.add_argument("--config-hash", help="only this configuration")
+    parser.add_argument(
+        "--start", type=parse_time, help="only sessions after this time"
+    )
+    parser.add_argument("--end", type=parse_time, help="only sessions before this time")
+    parser.add_argument(
+        "--json", action="store_true", help="print every summary as a JSON line"
+    )
+    args = parser.parse_args(argv)
+    try:
+        sessions = list_sessions(
+            args.catalog, args.car, args.config_hash, args.start, args.end
+        )
+    except sqlite3.Error as exc:
+        parser.exit(1, f"{exc}\n")
+
+    for session in sessions:
+        if args.json:
+            print(json.dumps(session))
+            continue
+        minutes = (
+            (session["end_time"] - session["start_time"]) / 60000
+            if session["start_time"] is not None
+            else 0.0
+        )
+        counters = session["counters"]
+        crc_failures = "n/a" if counters is None else counters.get("crc_failures", 0)
+        print(
+            f"{session['session']}  {session['car'] or '-'}  {session['records']} records"
+            f"  {minutes:.1f} min  CRC failures {crc_failures}  {session['location'] or ''}"
+        )
+
+
+if __name__ == "__main__":
+    main()
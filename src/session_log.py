@@ -0,0 +1,352 @@
+"""
+Compact binary session logs.
+
+A session log stores every record of a session as a fixed-width frame, behind a
+self-describing header:
+
+    MAGIC:   b"SMLOG1\\0\\0" (8 bytes)
+    HEADER:  length (uint32) | JSON object, space padded so the records start 8-byte aligned
+    RECORD:  payload length (uint32) | CRC-32 of the payload (uint32) |
+             payload: one little-endian float64 per field, in the order of the header "fields"
+
+The JSON header holds the format version, the car name and configuration hash, the start
+time in ms since epoch and number of the segment, the field names and the record size in
+bytes. Version 1 logs have no frame around the payload, they are still readable.
+
+The frames let session_recovery find where the valid data of a log cut by a power cut
+ends. Logs are read with mmap, so a whole session becomes a NumPy structured array without
+parsing any text. Readers ignore a truncated last record, but only check the frames when
+reading record by record, so recover logs that were not closed cleanly before loading them.
+
+NumPy is only needed to read logs into arrays. Logs can be converted to CSV without it:
+
+    python src/session_log.py LOG [CSV]
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+from csv import writer
+from typing import BinaryIO, Iterator, Mapping, Sequence
+
+from data_transmitter import SegmentedFileTransmitter, TransmitterError
+from session_archive import SessionArchiver
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+LOG_MAGIC = b"SMLOG1\0\0"
+LOG_VERSION = 2
+SUPPORTED_VERSIONS = (1, 2)
+HEADER_LENGTH = struct.Struct("<I")
+# Payload length | CRC-32 of the payload, before every record since version 2
+FRAME = struct.Struct("<II")
+
+
+class SessionLogError(Exception):
+    """Session log error class"""
+
+
+class SessionLogWriter(SegmentedFileTransmitter):
+    """
+    A transmitter saving data records to a binary session log, see the module documentation.
+
+    A drop-in alternative to LocalTransmitter, with the same buffering and rotation, see
+    SegmentedFileTransmitter. Every segment starts with its own header, whose start_time is
+    the time the segment was opened, and a "segment" number.
+
+    Args:
+        fields(Sequence[str]): the record fields, in record order, e.g. DataReader.fields
+        data_dir(str, optional): the directory to write the log to. Defaults to "Data".
+        car(str, optional): the name of the car, stored in the header
+        config_hash(str, optional): the car's configuration hash, stored in the header
+        flush_interval(float, optional): age in seconds of the oldest record that triggers a flush. Defaults to 1.
+        flush_bytes(int, optional): buffer size that triggers a flush. Defaults to 64 KiB.
+        rotate_bytes(int, optional): segment size that triggers a rotation. Defaults to no limit.
+        rotate_seconds(float, optional): segment age that triggers a rotation. Defaults to no limit.
+        archiver(SessionArchiver, optional): compresses closed segments and keeps the disk quota.
+        index_every(int, optional): records between time index entries. Defaults to 100.
+
+    Raises:
+        TransmitterError: If the log file cannot be created.
+    """
+
+    _extension = "smlog"
+    _mode = "xb"
+
+    def __init__(
+        self,
+        fields: Sequence[str],
+        data_dir: str = "Data",
+        car: str | None = None,
+        config_hash: str | None = None,
+        flush_interval: float = 1.0,
+        flush_bytes: int = 64 * 1024,
+        rotate_bytes: int | None = None,
+        rotate_seconds: float | None = None,
+        archiver: SessionArchiver | None = None,
+        index_every: int | None = 100,
+    ):
+        super().__init__(
+            data_dir,
+            flush_interval,
+            flush_bytes,
+            rotate_bytes,
+            rotate_seconds,
+            archiver,
+            index_every,
+        )
+        self._record = struct.Struct(f"<{len(fields)}d")
+        self._fields = list(fields)
+        self._car = car
+        self._config_hash = config_hash
+        self._open_segment()
+        self.flush()
+
+    def handle_record(self, data: Mapping):
+        """
+        Buffer the data record for the session log, flushing when due.
+
+        Args:
+            data(Mapping): the data record to be saved, e.g. a TelemetryRecord, with its
+                values in the order of the log fields
+
+        Raises:
+            TransmitterError: If the record does not match the log fields or has
+                non-numeric values, or the file cannot be written.
+        """
+        try:
+            payload = self._record.pack(*data.values())
+            time_ms = data.get("time")
+        except (AttributeError, TypeError, struct.error) as exc:
+            raise TransmitterError(
+                f"Invalid data being written, received: {data}\n{exc}"
+            ) from exc
+        self._append(FRAME.pack(len(payload), zlib.crc32(payload)) + payload, time_ms)
+        self.flush_if_due()
+
+    def _segment_header(self) -> list:
+        header = {
+            "version": LOG_VERSION,
+            "car": self._car,
+            "config_hash": self._config_hash,
+            "start_time": time.time_ns() / 1e6,
+            "segment": self._segment,
+            "fields": self._fields,
+            "record_size": FRAME.size + self._record.size,
+        }
+        return [_encode_header(header)]
+
+
+def _encode_header(header: dict) -> bytes:
+    """Encode the magic and JSON header, padded so the records start 8-byte aligned."""
+    encoded = json.dumps(header).encode()
+    unpadded = len(LOG_MAGIC) + HEADER_LENGTH.size + len(encoded)
+    encoded += b" " * (-unpadded % 8)
+    return LOG_MAGIC + HEADER_LENGTH.pack(len(encoded)) + encoded
+
+
+def parse_header(file: BinaryIO, path: str) -> tuple[dict, int]:
+    """
+    Read the header of a session log opened at its start.
+
+    Args:
+        file(BinaryIO): the open log, e.g. a decompressing reader of an archived log
+        path(str): the path of the log, for error messages
+
+    Returns:
+        tuple[dict, int]: the header, see read_header, and the offset of the first record
+
+    Raises:
+        SessionLogError: If the file is not a supported session log.
+    """
+    size = len(LOG_MAGIC) + HEADER_LENGTH.size
+    prefix = file.read(size)
+    if len(prefix) < size or not prefix.startswith(LOG_MAGIC):
+        raise SessionLogError(f"{path} is not a session log")
+    (length,) = HEADER_LENGTH.unpack_from(prefix, len(LOG_MAGIC))
+    encoded = file.read(length)
+    try:
+        header = json.loads(encoded)
+    except ValueError as exc:
+        raise SessionLogError(f"{path} has a corrupt header: {exc}") from exc
+    if header.get("version") not in SUPPORTED_VERSIONS:
+        raise SessionLogError(f"{path} has unsupported version {header.get('version')}")
+    return header, size + length
+
+
+def record_layout(header: dict) -> tuple[struct.Struct, int]:
+    """
+    The record encoding of a session log.
+
+    Args:
+        header(dict): the header of the log
+
+    Returns:
+        tuple[struct.Struct, int]: the struct of the record payload, and the size of the
+            frame before it, 0 for version 1 logs
+    """
+    frame_size = FRAME.size if header["version"] >= 2 else 0
+    return struct.Struct(f"<{len(header['fields'])}d"), frame_size
+
+
+def check_frame(record: bytes | memoryview, frame_size: int, payload_size: int) -> bool:
+    """
+    Check the frame of a record.
+
+    Args:
+        record(bytes | memoryview): the whole record, frame and payload
+        frame_size(int): the frame size, see record_layout
+        payload_size(int): the payload size, see record_layout
+
+    Returns:
+        bool: True if the record is complete and its payload matches its checksum
+    """
+    if len(record) < frame_size + payload_size:
+        return False
+    if not frame_size:
+        return True
+    length, checksum = FRAME.unpack_from(record)
+    return length == payload_size and checksum == zlib.crc32(record[frame_size:])
+
+
+def read_header(path: str) -> dict:
+    """
+    Read the header of a session log.
+
+    Args:
+        path(str): the session log to read
+
+    Returns:
+        dict: the header, with the version, car, config_hash, start_time (ms since epoch),
+            segment, fields and record_size
+
+    Raises:
+        SessionLogError: If the file is not a supported session log.
+    """
+    with open(path, "rb") as file:
+        return parse_header(file, path)[0]
+
+
+def read_session_log(path: str) -> tuple[dict, "np.ndarray"]:
+    """
+    Load a session log as a NumPy structured array, without copying it.
+
+    The array is a read-only view of the memory mapped file, with one float64 field per
+    log field, e.g. records["speed"]. It keeps the mapping open for as long as it is used.
+
+    Args:
+        path(str): the session log to read
+
+    Returns:
+        tuple[dict, np.ndarray]: the header, see read_header, and the records
+
+    Raises:
+        SessionLogError: If the file is not a supported session log.
+    """
+    if np is None:
+        raise SessionLogError("NumPy is needed to read session logs into arrays")
+    with open(path, "rb") as file:
+        header, offset = parse_header(file, path)
+        record, frame_size = record_layout(header)
+        # Field offsets skip the frame of each record
+        dtype = np.dtype(
+            {
+                "names": header["fields"],
+                "formats": ["<f8"] * len(header["fields"]),
+                "offsets": [frame_size + 8 * i for i in range(len(header["fields"]))],
+                "itemsize": frame_size + record.size,
+            }
+        )
+        count = (os.fstat(file.fileno()).st_size - offset) // dtype.itemsize
+        if count <= 0:
+            return header, np.empty(0, dtype=dtype)
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return header, np.frombuffer(mapped, dtype=dtype, count=count, offset=offset)
+
+
+def iter_records(path: str) -> tuple[dict, Iterator[tuple[float, ...]]]:
+    """
+    Read the records of a session log one at a time, without NumPy.
+
+    Reading stops at the first record with an invalid frame.
+
+    Args:
+        path(str): the session log to read
+
+    Returns:
+        tuple[dict, Iterator[tuple[float, ...]]]: the header, see read_header, and an
+            iterator of the record values in field order
+
+    Raises:
+        SessionLogError: If the file is not a supported session log.
+    """
+    file = open(path, "rb")
+    try:
+        header, _ = parse_header(file, path)
+    except BaseException:
+        file.close()
+        raise
+    record, frame_size = record_layout(header)
+
+    def records() -> Iterator[tuple[float, ...]]:
+        with file:
+            while True:
+                data = file.read(frame_size + record.size)
+                if not check_frame(data, frame_size, record.size):
+                    return  # log was cut off or torn by a power cut
+                yield record.unpack_from(data, frame_size)
+
+    return header, records()
+
+
+def export_csv(path: str, csv_path: str | None = None) -> str:
+    """
+    Convert a session log to a CSV file with the LocalTransmitter columns.
+
+    The frames were already checked, so the rows get no checksum column. Every value is
+    stored as a float, so integer sensors are exported as e.g. "12.0".
+
+    Args:
+        path(str): the session log to convert
+        csv_path(str, optional): the CSV file to write, defaults to the log path with a
+            .csv suffix
+
+    Returns:
+        str: the path of the CSV file
+
+    Raises:
+        SessionLogError: If the file is not a supported session log.
+    """
+    if csv_path is None:
+        csv_path = os.path.splitext(path)[0] + ".csv"
+    header, records = iter_records(path)
+    with open(csv_path, "w", newline="") as file:
+        csv_writer = writer(file)
+        csv_writer.writerow(header["fields"])
+        csv_writer.writerows(records)
+    return csv_path
+
+
+def main(argv: Sequence[str] | None = None):
+    """Command line entry point, converting a session log to CSV."""
+    parser = argparse.ArgumentParser(description="Convert a session log to CSV.")
+    parser.add_argument("log", help="the session log to convert")
+    parser.add_argument(
+        "csv", nargs="?", help="the CSV file to write, defaults to LOG with .csv"
+    )
+    args = parser.parse_args(argv)
+    try:
+        print(export_csv(args.log, args.csv))
+    except (OSError, SessionLogError) as exc:
+        parser.exit(1, f"{exc}\n")
+
+
+if __name__ == "__main__":
+    main()
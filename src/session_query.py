@@ -0,0 +1,416 @@
+"""
+Time range queries over recorded sessions.
+
+A query returns the records of a session between two times, optionally only some of its
+channels, without scanning whole files:
+
+- CSV segments are searched with their sparse time index, then read from the last indexed
+  row before the start time until the end time. Without an index, or past its last entry,
+  rows are scanned instead.
+- Binary session logs have fixed-width records, so they are binary searched directly.
+  Their frames are not checked, see session_recovery.
+
+Archived (compressed) segments are decompressed as they are read, skipping ahead to the
+indexed offset, and binary logs are read forward from it. Times are in ms since epoch, and
+records are assumed to be in time order within a segment.
+
+From the command line, the records are printed as CSV:
+
+    python src/session_query.py Data/2024-06-01_10-00-00_car_data.csv --around 1717236042000 --seconds 30 --fields time,speed,engine_temp
+"""
+
+import argparse
+import csv
+import datetime
+import gzip
+import io
+import mmap
+import os
+import struct
+import sys
+import warnings
+from bisect import bisect_left, bisect_right
+from typing import BinaryIO, Iterator, Sequence
+
+from data_transmitter import CHECKSUM_FIELD
+from session_archive import (
+    COMPRESSION_SUFFIXES,
+    INDEX_ENTRY,
+    INDEX_SUFFIX,
+    parse_segment_name,
+)
+from session_log import SessionLogError, parse_header, record_layout
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+TIME_FIELD = "time"
+
+
+class QueryError(Exception):
+    """Session query error class"""
+
+
+class _ZstdReader(io.RawIOBase):
+    """A zstd segment decompressed as it is read, it can only seek forward."""
+
+    def __init__(self, file: BinaryIO):
+        self._reader = zstandard.ZstdDecompressor().stream_reader(file)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        return self._reader.readinto(buffer)
+
+    def tell(self) -> int:
+        return self._reader.tell()
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self._reader.seek(offset, whence)
+
+    def close(self):
+        self._reader.close()
+        super().close()
+
+
+def open_segment(path: str) -> BinaryIO:
+    """
+    Open a session segment for reading, decompressing it if it is archived.
+
+    Args:
+        path(str): the segment file
+
+    Returns:
+        BinaryIO: a binary reader of the uncompressed segment. Archived segments are
+            decompressed as they are read, and only seek forward efficiently (gzip) or
+            at all (zstd).
+
+    Raises:
+        QueryError: If the segment needs the zstandard package.
+    """
+    if path.endswith(COMPRESSION_SUFFIXES["gzip"]):
+        return gzip.open(path, "rb")
+    if path.endswith(COMPRESSION_SUFFIXES["zstd"]):
+        if zstandard is None:  # pragma: no cover
+            raise QueryError(f"{path} needs the zstandard package to be read")
+        return io.BufferedReader(_ZstdReader(open(path, "rb")))
+    return open(path, "rb")
+
+
+def read_index(path: str) -> list[tuple[float, int]]:
+    """
+    Read the sparse time index of a segment.
+
+    Args:
+        path(str): the segment file, compressed or not
+
+    Returns:
+        list[tuple[float, int]]: (time, byte offset in the uncompressed segment) pairs of
+            the indexed records, empty if the segment has no index
+    """
+    for suffix in COMPRESSION_SUFFIXES.values():
+        path = path.removesuffix(suffix)
+    try:
+        with open(path + INDEX_SUFFIX, "rb") as file:
+            data = file.read()
+    except FileNotFoundError:
+        return []
+    # A torn last entry is ignored
+    usable = len(data) - len(data) % INDEX_ENTRY.size
+    return list(INDEX_ENTRY.iter_unpack(data[:usable]))
+
+
+def session_segments(path: str) -> list[str]:
+    """
+    Find every segment of the session a file belongs to.
+
+    Args:
+        path(str): any segment of the session
+
+    Returns:
+        list[str]: the paths of the session's segments, in order
+
+    Raises:
+        QueryError: If the file is not a session file.
+    """
+    directory, file_name = os.path.split(path)
+    name = parse_segment_name(file_name)
+    if name is None:
+        raise QueryError(f"{path} is not a session file")
+    segments = []
+    for entry in os.scandir(directory or "."):
+        other = parse_segment_name(entry.name)
+        if other is not None and other.session == name.session and not other.index:
+            segments.append((other.segment, entry.path))
+    return [segment_path for _, segment_path in sorted(segments)]
+
+
+def query_segment(
+    path: str,
+    start: float | None = None,
+    end: float | None = None,
+    fields: Sequence[str] | None = None,
+) -> dict[str, list]:
+    """
+    Return the records of a segment with start <= time <= end.
+
+    Args:
+        path(str): the segment file, CSV or binary, compressed or not
+        start(float, optional): earliest time in ms since epoch, defaults to the first record
+        end(float, optional): latest time in ms since epoch, defaults to the last record
+        fields(Sequence[str], optional): the channels to return, defaults to all of them
+
+    Returns:
+        dict[str, list]: one list of values per field, in the order of fields
+
+    Raises:
+        QueryError: If the file is not a session file or a field does not exist.
+    """
+    name = parse_segment_name(os.path.basename(path))
+    if name is None or name.index:
+        raise QueryError(f"{path} is not a session segment")
+    start = float("-inf") if start is None else start
+    end = float("inf") if end is None else end
+    with open_segment(path) as file:
+        if name.format == "smlog":
+            return _query_log(file, path, start, end, fields)
+        return _query_csv(file, path, start, end, fields)
+
+
+def query_session(
+    path: str,
+    start: float | None = None,
+    end: float | None = None,
+    fields: Sequence[str] | None = None,
+) -> dict[str, list]:
+    """
+    Return the records with start <= time <= end of every segment of a session.
+
+    Args:
+        path(str): any segment of the session
+        start(float, optional): earliest time in ms since epoch, defaults to the first record
+        end(float, optional): latest time in ms since epoch, defaults to the last record
+        fields(Sequence[str], optional): the channels to return, defaults to all of them
+
+    Returns:
+        dict[str, list]: one list of values per field, in the order of fields
+
+    Raises:
+        QueryError: If the file is not a session file or a field does not exist.
+    """
+    columns: dict[str, list] | None = None
+    for segment in session_segments(path):
+        result = query_segment(segment, start, end, fields)
+        if columns is None:
+            columns = result
+        else:
+            for field, values in result.items():
+                columns[field].extend(values)
+    return columns or {}
+
+
+def _select(
+    available: Sequence[str], fields: Sequence[str] | None, path: str
+) -> tuple[list[str], list[int], int]:
+    """Resolve the queried fields to their positions, and find the time field."""
+    if TIME_FIELD not in available:
+        raise QueryError(f"{path} has no {TIME_FIELD} field")
+    names = list(available) if fields is None else list(fields)
+    missing = [field for field in names if field not in available]
+    if missing:
+        raise QueryError(f"Unknown fields in {path}: {', '.join(missing)}")
+    positions = [list(available).index(field) for field in names]
+    return names, positions, list(available).index(TIME_FIELD)
+
+
+def _to_number(value: str) -> float | str:
+    """Parse a CSV cell, keeping non-numeric cells as text."""
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def _query_csv(
+    file: BinaryIO,
+    path: str,
+    start: float,
+    end: float,
+    fields: Sequence[str] | None,
+) -> dict[str, list]:
+    """Read the rows in the time range of a CSV segment, starting from its index."""
+    header = next(csv.reader([file.readline().decode()]), [])
+    # The checksum column is only for recovery, it is not a field
+    available = header[:-1] if header[-1:] == [CHECKSUM_FIELD] else header
+    names, positions, time_position = _select(available, fields, path)
+    columns = {name: [] for name in names}
+
+    index = read_index(path)
+    # The last indexed row before the start, every later row may be in range
+    first = bisect_left([time for time, _ in index], start)
+    if first:
+        file.seek(index[first - 1][1])
+
+    malformed = 0
+    for row in csv.reader(io.TextIOWrapper(file, newline="")):
+        if len(row) != len(header):
+            malformed += 1  # e.g. a row torn by a power cut
+            continue
+        try:
+            time = float(row[time_position])
+        except ValueError:
+            continue
+        if time < start:
+            continue
+        if time > end:
+            break
+        for name, position in zip(names, positions):
+            columns[name].append(_to_number(row[position]))
+    if malformed:
+        warnings.warn(
+            f"Skipped {malformed} rows of {path} that do not match its header",
+            stacklevel=3,
+        )
+    return columns
+
+
+class _LogTimes:
+    """The time column of a binary session log, as a sequence for bisect."""
+
+    def __init__(self, data, offset: int, record_size: int, time_offset: int):
+        self._data = data
+        self._offset = offset + time_offset
+        self._record_size = record_size
+        self._count = (len(data) - offset) // record_size
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, position: int) -> float:
+        return struct.unpack_from(
+            "<d", self._data, self._offset + position * self._record_size
+        )[0]
+
+
+def _query_log(
+    file: BinaryIO,
+    path: str,
+    start: float,
+    end: float,
+    fields: Sequence[str] | None,
+) -> dict[str, list]:
+    """Binary search, or scan if archived, the records in the time range of a binary log."""
+    try:
+        header, offset = parse_header(file, path)
+    except SessionLogError as exc:
+        raise QueryError(str(exc)) from exc
+    names, positions, time_position = _select(header["fields"], fields, path)
+    columns = {name: [] for name in names}
+
+    record, frame_size = record_layout(header)
+    record_size = frame_size + record.size
+    if path.endswith(tuple(COMPRESSION_SUFFIXES.values())):
+        # Archived logs cannot be mapped, they are read forward from the index
+        rows = _scan_log(file, path, offset, record, frame_size, start, time_position)
+    else:
+        if os.fstat(file.fileno()).st_size <= offset:
+            return columns
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        times = _LogTimes(data, offset, record_size, frame_size + 8 * time_position)
+        rows = (
+            record.unpack_from(data, offset + position * record_size + frame_size)
+            for position in range(bisect_left(times, start), bisect_right(times, end))
+        )
+    for values in rows:
+        if values[time_position] > end:
+            break
+        for name, field_position in zip(names, positions):
+            columns[name].append(values[field_position])
+    return columns
+
+
+def _scan_log(
+    file: BinaryIO,
+    path: str,
+    offset: int,
+    record: struct.Struct,
+    frame_size: int,
+    start: float,
+    time_position: int,
+    chunk_records: int = 4096,
+) -> Iterator[tuple[float, ...]]:
+    """Read the records of a log from the last indexed one before start, in chunks."""
+    index = read_index(path)
+    first = bisect_left([time for time, _ in index], start)
+    file.seek(index[first - 1][1] if first else offset)
+    record_size = frame_size + record.size
+    pending = b""
+    while chunk := file.read(chunk_records * record_size):
+        data = pending + chunk
+        usable = len(data) - len(data) % record_size
+        pending = data[usable:]
+        for position in range(0, usable, record_size):
+            values = record.unpack_from(data, position + frame_size)
+            if values[time_position] >= start:
+                yield values
+
+
+def parse_time(text: str) -> float:
+    """
+    Parse a query time, in ms since epoch or as an ISO 8601 date and time.
+
+    Args:
+        text(str): e.g. "1717236042000" or "2024-06-01T10:00:42", naive times are local
+
+    Returns:
+        float: the time in ms since epoch
+
+    Raises:
+        ValueError: If the time cannot be parsed.
+    """
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.datetime.fromisoformat(text).timestamp() * 1000
+
+
+def main(argv: Sequence[str] | None = None):
+    """Command line entry point, printing the queried records as CSV."""
+    parser = argparse.ArgumentParser(
+        description="Print the records of a session in a time range as CSV."
+    )
+    parser.add_argument("session", help="any segment file of the session")
+    parser.add_argument("--start", type=parse_time, help="earliest record time")
+    parser.add_argument("--end", type=parse_time, help="latest record time")
+    parser.add_argument(
+        "--around", type=parse_time, help="center of the range, with --seconds"
+    )
+    parser.add_argument(
+        "--seconds", type=float, default=30, help="length of the --around range"
+    )
+    parser.add_argument("--fields", help="comma separated channels, defaults to all")
+    args = parser.parse_args(argv)
+
+    start, end = args.start, args.end
+    if args.around is not None:
+        start = args.around - args.seconds * 500
+        end = args.around + args.seconds * 500
+    fields = args.fields.split(",") if args.fields else None
+    try:
+        columns = query_session(args.session, start, end, fields)
+    except (OSError, QueryError) as exc:
+        parser.exit(1, f"{exc}\n")
+
+    csv_writer = csv.writer(sys.stdout)
+    csv_writer.writerow(columns)
+    csv_writer.writerows(zip(*columns.values()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Startup recovery of the local session files after a power cut.
+
+A power cut can leave the last segment of a session with a torn tail: a partial record, or
+blocks of garbage the file system had allocated but not written. Recovery finds where the
+valid data ends in a single sequential pass, truncates the rest and reports how many
+records were kept, and how many complete records were dropped from the first one failing
+its checksum on. Binary session logs are checked frame by frame, CSV files row by row
+against their checksum column. Sparse time indexes are trimmed to match.
+"""
+
+import os
+from dataclasses import dataclass
+
+from data_transmitter import CHECKSUM_FIELD, check_csv_row
+from session_archive import INDEX_ENTRY, INDEX_SUFFIX, parse_segment_name
+from session_log import check_frame, parse_header, record_layout
+
+# Records checked per read, keeps the pass sequential without loading the whole file
+RECORDS_PER_READ = 4096
+
+
+@dataclass
+class RecoveryReport:
+    """Class representing the result of recovering a session file
+
+    Attributes:
+        path(str): the recovered file
+        records(int): the valid records kept
+        truncated_bytes(int): the bytes cut from the end of the file
+        dropped_records(int): the complete records cut from the first one failing its
+            checksum on, a torn last record is not counted
+    """
+
+    path: str
+    records: int
+    truncated_bytes: int
+    dropped_records: int = 0
+
+
+def recover_session_log(path: str) -> RecoveryReport:
+    """
+    Truncate a binary session log after its last valid record.
+
+    Args:
+        path(str): the session log
+
+    Returns:
+        RecoveryReport: the records kept, the bytes truncated and the records dropped
+
+    Raises:
+        SessionLogError: If the file is not a supported session log, e.g. its header was
+            never fully written.
+    """
+    with open(path, "r+b") as file:
+        header, offset = parse_header(file, path)
+        record, frame_size = record_layout(header)
+        record_size = frame_size + record.size
+        records = 0
+        valid_end = offset
+        while True:
+            block = memoryview(file.read(record_size * RECORDS_PER_READ))
+            for start in range(0, len(block), record_size):
+                frame = block[start : start + record_size]
+                if not check_frame(frame, frame_size, record.size):
+                    dropped = 0
+                    if len(frame) == record_size:
+                        size = os.fstat(file.fileno()).st_size
+                        dropped = (size - valid_end) // record_size
+                    return _truncate(file, path, records, valid_end, dropped)
+                records += 1
+                valid_end += record_size
+            if len(block) < record_size * RECORDS_PER_READ:
+                return _truncate(file, path, records, valid_end)
+
+
+def recover_csv(path: str) -> RecoveryReport:
+    """
+    Truncate a CSV session file after its last valid row.
+
+    A row is valid when it is complete and its checksum column matches, files written
+    before the checksum column was added are cut after their last complete row.
+
+    Args:
+        path(str): the CSV file
+
+    Returns:
+        RecoveryReport: the rows kept, without the header row, the bytes truncated and
+            the rows dropped
+    """
+    with open(path, "r+b") as file:
+        header = file.readline()
+        if not header.endswith(b"\n"):
+            return _truncate(file, path, 0, 0)
+        checked = header.rstrip(b"\r\n").endswith(b"," + CHECKSUM_FIELD.encode())
+        rows = 0
+        dropped = 0
+        valid_end = len(header)
+        for row in file:
+            if not row.endswith(b"\n"):
+                break
+            if checked and not check_csv_row(row):
+                # Count the complete rows cut with it, the last one may be torn
+                dropped = 1 + sum(1 for rest in file if rest.endswith(b"\n"))
+                break
+            rows += 1
+            valid_end += len(row)
+        return _truncate(file, path, rows, valid_end, dropped)
+
+
+def recover_last_session(data_dir: str = "Data") -> RecoveryReport | None:
+    """
+    Recover the last segment of the most recent session, see the module documentation.
+
+    Call it on startup before a new session begins. Archived segments are skipped, they
+    were closed cleanly.
+
+    Args:
+        data_dir(str): the directory holding the session files
+
+    Returns:
+        RecoveryReport | None: the result, or None if there is no uncompressed session file
+
+    Raises:
+        SessionLogError: If the last segment is an unreadable session log.
+    """
+    if not os.path.isdir(data_dir):
+        return None
+    latest = None
+    with os.scandir(data_dir) as entries:
+        for entry in entries:
+            name = parse_segment_name(entry.name)
+            if name is None or name.index or name.compression is not None:
+                continue
+            key = (name.session, name.segment)
+            if latest is None or key > latest[0]:
+                latest = (key, entry.path, name.format)
+    if latest is None:
+        return None
+    _, path, file_format = latest
+    if file_format == "smlog":
+        return recover_session_log(path)
+    return recover_csv(path)
+
+
+def _truncate(
+    file, path: str, records: int, valid_end: int, dropped: int = 0
+) -> RecoveryReport:
+    """Cut an open file and its time index at the end of the valid data."""
+    size = file.seek(0, os.SEEK_END)
+    if size > valid_end:
+        file.truncate(valid_end)
+        file.flush()
+        os.fsync(file.fileno())
+        _trim_index(path + INDEX_SUFFIX, valid_end)
+    return RecoveryReport(path, records, size - valid_end, dropped)
+
+
+def _trim_index(path: str, valid_end: int):
+    """Drop the index entries of records that were truncated."""
+    try:
+        with open(path, "r+b") as file:
+            data = file.read()
+            kept = 0
+            for _, offset in INDEX_ENTRY.iter_unpack(
+                data[: len(data) - len(data) % INDEX_ENTRY.size]
+            ):
+                if offset >= valid_end:
+                    break
+                kept += 1
+            file.truncate(kept * INDEX_ENTRY.size)
+    except FileNotFoundError:
+        return
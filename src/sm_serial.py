@@ -1,11 +1,17 @@
+import asyncio
 import glob
-import struct
+import select
 from os import getenv
 from time import sleep
-from typing import Optional
+from typing import AsyncIterator, Optional
 
 import serial
 
+from configuration_generator import DEFAULT_PACKET_LAYOUT, PacketLayout
+from serial_capture import CaptureWriter, ReplaySource
+from serial_framing import FrameDecoder
+from synthetic_telemetry import SyntheticTelemetry
+
 
 class SmSerialError(Exception):
     """SM Serial error class"""
@@ -15,11 +21,19 @@ class SmSerial:
     """
     Encapsulates and maintains a serial connection with an Arduino.
 
+    Every raw chunk read from the port can be recorded to a capture file by setting
+    SERIAL_CAPTURE_FILE. Setting SERIAL_REPLAY_FILE replaces the serial port with a
+    recorded capture, played back at SERIAL_REPLAY_SPEED times real time (0 plays it
+    back as fast as possible). In testing mode, SYNTHETIC_TELEMETRY replaces the fixed
+    mock packet with a configurable synthetic packet stream.
+
     Args:
         port: Serial port name (e.g., 'COM6' or '/dev/ttyUSB0')
         baudrate: Communication speed (default: 9600)
         timeout: Read timeout in seconds (default: 1)
         crashloop: Enable crashloop retry behavior (default: False)
+        framed: Expect packets wrapped in sync/length/CRC frames (default: False)
+        layout: Layout of the packets mocked in testing mode (default: original firmware layout)
     """
 
     def __init__(
@@ -28,14 +42,37 @@ class SmSerial:
         baudrate: int = 9600,
         timeout: float = 1,
         crashloop: bool = False,
+        framed: bool = False,
+        layout: PacketLayout = DEFAULT_PACKET_LAYOUT,
     ):
         self._port: str = ""
         self._baudrate: int = baudrate
         self._timeout: float = timeout
         self._testing: bool = getenv("TESTING", "False") == "True"
         self._test_data_sent: bool = False
+        self._layout: PacketLayout = layout
         self._ser: Optional[serial.Serial] = None
         self._crashloop: bool = crashloop
+        self._decoder: Optional[FrameDecoder] = FrameDecoder() if framed else None
+        self._remainder: bytes = b""
+        self._reconnect_task: Optional[asyncio.Task] = None
+        replay_path = getenv("SERIAL_REPLAY_FILE")
+        synthetic_spec = getenv("SYNTHETIC_TELEMETRY")
+        self._source: Optional[ReplaySource | SyntheticTelemetry] = None
+        if replay_path:
+            self._source = ReplaySource(
+                replay_path, float(getenv("SERIAL_REPLAY_SPEED", "1"))
+            )
+        elif self._testing and synthetic_spec:
+            self._source = SyntheticTelemetry.from_spec(
+                synthetic_spec, framed=framed, layout=layout
+            )
+        capture_path = getenv("SERIAL_CAPTURE_FILE")
+        self._capture: Optional[CaptureWriter] = (
+            CaptureWriter(capture_path)
+            if capture_path and self._source is None
+            else None
+        )
 
         # Determine port if not provided
         if port:
@@ -47,38 +84,48 @@ class SmSerial:
             else:
                 self._port = "/dev/ttyUSB1"
 
-        # Initialize serial connection or mock for testing
-        if self._testing:
+        # Initialize serial connection, or replay/mock for testing
+        if isinstance(self._source, ReplaySource):
+            print(
+                f"Replaying serial capture {replay_path}, no serial connection will be made."
+            )
+        elif self._source is not None:
+            print(
+                f"Running in testing mode with synthetic telemetry ({synthetic_spec}), "
+                "no serial connection will be made."
+            )
+        elif self._testing:
             print("Running in testing mode, no serial connection will be made.")
         else:
             self._initialize_connection()
 
     def _initialize_connection(self):
-        """Initialize the serial connection with optional crashloop retry."""
-        while True:
-            try:
-                self._ser = serial.Serial(
-                    self._port, self._baudrate, timeout=self._timeout
-                )
-                print(
-                    f"Serial connection established on {self._port} at {self._baudrate} baud"
-                )
-                break
-            except serial.SerialException as exc:
-                print(f"Failed to open serial port {self._port}: {exc}")
-                error_msg = ""
-                if "PermissionError" in str(exc):
-                    error_msg = (
-                        "Permission Error, try unplugging and replugging arduino."
-                    )
-                else:
-                    error_msg = f"Arduino is missing, please connect the arduino. {exc}"
+        """
+        Initialize the serial connection.
 
-                if self._crashloop:
-                    print(f"{error_msg} Retrying in 3 seconds...")
-                    sleep(3)
-                else:
-                    raise SmSerialError(f"{error_msg}") from exc
+        With crashloop, a port that cannot be opened is left closed instead of failing, and
+        the background reconnect task of iter_packets keeps retrying it, so the constructor
+        never blocks the event loop.
+        """
+        try:
+            self._ser = serial.Serial(self._port, self._baudrate, timeout=self._timeout)
+            print(
+                f"Serial connection established on {self._port} at {self._baudrate} baud"
+            )
+        except serial.SerialException as exc:
+            print(f"Failed to open serial port {self._port}: {exc}")
+            error_msg = ""
+            if "PermissionError" in str(exc):
+                error_msg = "Permission Error, try unplugging and replugging arduino."
+            else:
+                error_msg = f"Arduino is missing, please connect the arduino. {exc}"
+
+            if not self._crashloop:
+                raise SmSerialError(f"{error_msg}") from exc
+            print(f"{error_msg} Retrying in the background every 3 seconds...")
+            # A port given after construction is only opened by reconnect
+            self._ser = serial.Serial(baudrate=self._baudrate, timeout=self._timeout)
+            self._ser.port = self._port
 
     def reconnect(self):
         """
@@ -87,6 +134,9 @@ class SmSerial:
         if not self.is_open():
             try:
                 self._ser.open()
+                self._remainder = b""
+                if self._decoder is not None:
+                    self._decoder.reset()
                 print(f"Connection to {self._port} re-established.")
             except serial.SerialException as exc:
                 print(f"Failed to reconnect to serial. {exc}")
@@ -101,51 +151,228 @@ class SmSerial:
         Returns:
             bytes: data packet from Arduino
         """
+        if self._source is not None:
+            packets = self.read_packets(size)
+            return bytes(packets[-1]) if packets else b""
+
         response = b""
         # Mock a response if in testing mode
         # Responses alternate between valid data and an empty string, since the arduino will not have data on every read.
         if self._testing:
             if not self._test_data_sent:
                 self._test_data_sent = True
-                response = struct.pack(
-                    "<ffffBBBBBH",
-                    25.3,  # speed
-                    5.1,  # airspeed
-                    78.2,  # engineTemp
-                    65.4,  # radTemp
-                    0,
-                    1,
-                    0,
-                    1,
-                    0,  # digital channels
-                    100,
-                )  # analog channel
+                response = self._layout.pack(
+                    {
+                        "speed": 25.3,
+                        "airspeed": 5.1,
+                        "engine_temp": 78.2,
+                        "rad_temp": 65.4,
+                        "channel1": 1,  # digital channels
+                        "channel3": 1,
+                        "channelA0": 100,  # analog channel
+                    }
+                )
                 return response
             else:
                 self._test_data_sent = False
                 return response
 
         # Actual read from serial port
+        if self._decoder is not None:
+            return self._read_framed_response()
         try:
             last_line = self._ser.read(size)
             next_line = self._ser.read(size)
+            self._record(last_line + next_line)
             # read until end of data buffer
             while next_line != b"":
                 last_line = next_line
                 next_line = self._ser.read(size)
+                self._record(next_line)
             return last_line
         except serial.SerialException as exc:
             raise SmSerialError(
                 "Error reading from serial, most likely a disconnect."
             ) from exc
 
+    def read_packets(
+        self, size: int = 32, block: bool = True
+    ) -> list[memoryview | bytes]:
+        """
+        Read every complete packet currently buffered from the Arduino.
+
+        All waiting bytes are pulled in with a single read and split into packets without
+        copying each one. Bytes belonging to a packet that has not fully arrived yet are
+        kept and prepended to the next read.
+
+        Args:
+            size(int): Size of a single packet in bytes, ignored in framed mode.
+            block(bool): If nothing is waiting, wait up to the read timeout for data.
+
+        Returns:
+            list[memoryview | bytes]: every complete packet in the order it was received,
+                or an empty list if no full packet is available.
+        """
+        if self._testing and self._source is None:
+            response = self.read_response(size)
+            return [response] if response else []
+
+        chunk = self._read_available(size, block)
+        if self._decoder is not None:
+            return self._decoder.feed(chunk)
+
+        if self._remainder:
+            chunk = self._remainder + chunk
+        complete = len(chunk) - len(chunk) % size
+        self._remainder = chunk[complete:]
+        view = memoryview(chunk)
+        return [view[offset : offset + size] for offset in range(0, complete, size)]
+
+    async def iter_packets(self, size: int = 32) -> AsyncIterator[list]:
+        """
+        Asynchronously yield batches of packets as they arrive from the Arduino.
+
+        The serial file descriptor is registered with the running event loop, so the
+        caller only wakes up when bytes are available and never blocks the loop on a
+        read timeout. Disconnects are handled by a background reconnect task that
+        retries every 3 seconds while the rest of the server keeps running.
+
+        Args:
+            size(int): Size of a single packet in bytes, ignored in framed mode.
+
+        Yields:
+            list[memoryview | bytes]: every complete packet received since the last batch.
+        """
+        if self._source is not None:
+            while (delay := self._source.time_until_next()) is not None:
+                await asyncio.sleep(delay)
+                packets = self.read_packets(size, block=False)
+                if packets:
+                    yield packets
+            print("Serial replay finished.")
+            return
+
+        if self._testing:
+            while True:
+                await asyncio.sleep(self._timeout)
+                packets = self.read_packets(size)
+                if packets:
+                    yield packets
+
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        fd: Optional[int] = None
+        try:
+            while True:
+                if not self.is_open():
+                    await self._start_reconnect()
+                    continue
+                try:
+                    if fd is None:
+                        fd = self._ser.fileno()
+                        loop.add_reader(fd, readable.set)
+                    await readable.wait()
+                    readable.clear()
+                    packets = self.read_packets(size, block=False)
+                except NotImplementedError:
+                    # Event loop cannot watch this handle (e.g. Windows), read in a thread
+                    fd = None
+                    packets = await asyncio.to_thread(self.read_packets, size)
+                except SmSerialError as exc:
+                    print(exc)
+                    if fd is not None:
+                        loop.remove_reader(fd)
+                        fd = None
+                    self._ser.close()
+                    continue
+                if packets:
+                    yield packets
+        finally:
+            if fd is not None:
+                loop.remove_reader(fd)
+
+    def _start_reconnect(self) -> asyncio.Task:
+        """Start the background reconnect task if it is not already running."""
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnect_task = asyncio.create_task(self._reconnect_loop())
+        return self._reconnect_task
+
+    async def _reconnect_loop(self):
+        """Retry the serial connection every 3 seconds without blocking the event loop."""
+        while not self.is_open():
+            await asyncio.to_thread(self.reconnect)
+            if not self.is_open():
+                await asyncio.sleep(3)
+
+    def _read_available(self, size: int, block: bool = True) -> bytes:
+        """
+        Read everything waiting in the serial buffer in one call. If nothing is waiting,
+        block for up to the read timeout for one packet's worth of bytes, or without block
+        return no bytes, raising SmSerialError only if the port hung up.
+        """
+        if self._source is not None:
+            delay = self._source.time_until_next()
+            if block and delay:
+                sleep(min(delay, self._timeout))
+            return self._source.read()
+
+        try:
+            waiting = self._ser.in_waiting
+            if not waiting and not block:
+                # The event loop reports readiness while the fd stays readable, so a wakeup
+                # after the buffer was drained is spurious unless the port hung up
+                if self._hung_up():
+                    raise SmSerialError(
+                        "Serial port hung up, most likely a disconnect."
+                    )
+                return b""
+            chunk = self._ser.read(waiting if waiting else size)
+        except (serial.SerialException, OSError) as exc:
+            raise SmSerialError(
+                "Error reading from serial, most likely a disconnect."
+            ) from exc
+        self._record(chunk)
+        return chunk
+
+    def _hung_up(self) -> bool:
+        """Check whether the serial file descriptor reports a hangup or an error."""
+        poller = select.poll()
+        poller.register(self._ser.fileno(), select.POLLIN)
+        return any(
+            event & (select.POLLHUP | select.POLLERR | select.POLLNVAL)
+            for _, event in poller.poll(0)
+        )
+
+    def _record(self, chunk: bytes):
+        """Write a raw chunk to the capture file, if capturing."""
+        if self._capture is not None:
+            self._capture.write(chunk)
+
+    def _read_framed_response(self) -> bytes:
+        """Read all buffered bytes through the frame decoder and return the newest frame."""
+        frames = self._decoder.feed(self._read_available(1))
+        return frames[-1] if frames else b""
+
+    def stats(self) -> dict:
+        """
+        Return link quality counters for the serial connection.
+
+        Returns:
+            dict: frame decoder counters (CRC failures, resync events, ...). Empty when
+                framing is disabled.
+        """
+        return self._decoder.stats() if self._decoder is not None else {}
+
     def is_open(self) -> bool:
         """Check if the serial connection is open."""
-        if self._testing:
+        if self._testing or self._source is not None:
             return True
         return self._ser.is_open if self._ser else False
 
     def close(self) -> None:
-        """Close the serial connection."""
-        if not self._testing:
+        """Close the serial connection and any open capture file."""
+        if self._capture is not None:
+            self._capture.close()
+            self._capture = None
+        if not self._testing and self._source is None:
             self._ser.close()
@@ -0,0 +1,327 @@
+"""
+Local telemetry storage in a SQLite database.
+
+Every session is a row of the sessions table, with the car name, configuration hash, start
+time and fields of its records. Records of every session share the records table, with a
+session column and one column per field, added as new fields appear. Records are indexed on
+(session, time), so a time range of a session is an indexed lookup.
+
+The database runs in WAL mode, and records are inserted in batched transactions, so a
+power cut loses at most the current batch and never corrupts the database.
+"""
+
+import datetime
+import json
+import sqlite3
+import time
+from collections import deque
+from typing import Mapping, Sequence
+
+from data_transmitter import DataTransmitter, TransmitterError
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    car TEXT,
+    config_hash TEXT,
+    start_time REAL NOT NULL,
+    fields TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS records (
+    session INTEGER NOT NULL REFERENCES sessions (id),
+    time REAL
+);
+CREATE INDEX IF NOT EXISTS records_session_time ON records (session, time);
+"""
+
+
+def _quote(name: str) -> str:
+    """Quote a field name as an SQL identifier."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def connect(database: str) -> sqlite3.Connection:
+    """
+    Open a telemetry database, creating its tables if needed.
+
+    Args:
+        database(str): path of the database file
+
+    Returns:
+        sqlite3.Connection: a connection in WAL mode, usable from any one thread at a time
+    """
+    connection = sqlite3.connect(database, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    # Every commit reaches the disk, batching keeps the number of commits low
+    connection.execute("PRAGMA synchronous=FULL")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+class SQLiteTransmitter(DataTransmitter):
+    """
+    A transmitter saving data records to a SQLite database, see the module documentation.
+
+    A drop-in alternative to LocalTransmitter. Records are buffered and inserted in one
+    transaction once batch_size are buffered, or once the oldest is flush_interval seconds
+    old. The age is only checked when a record arrives or flush_if_due is called, so call
+    flush_if_due periodically while the stream is idle, and close on shutdown.
+
+    While the database is busy or the disk is full, the records stay buffered and the
+    insert is retried every retry_interval seconds. At most max_buffered records are kept,
+    the oldest are dropped first and counted in dropped.
+
+    Args:
+        fields(Sequence[str]): the record fields, in record order, e.g. DataReader.fields
+        database(str, optional): path of the database file. Defaults to "Data/telemetry.db".
+        car(str, optional): the name of the car, stored with the session
+        config_hash(str, optional): the car's configuration hash, stored with the session
+        batch_size(int, optional): records per transaction. Defaults to 500.
+        flush_interval(float, optional): age in seconds of the oldest record that triggers a flush. Defaults to 1.
+        max_buffered(int, optional): most records kept while inserts fail. Defaults to 50000.
+        retry_interval(float, optional): seconds between inserts after a failure. Defaults to 1.
+
+    Raises:
+        TransmitterError: If the database cannot be opened or a field name is reserved.
+    """
+
+    def __init__(
+        self,
+        fields: Sequence[str],
+        database: str = "Data/telemetry.db",
+        car: str | None = None,
+        config_hash: str | None = None,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        max_buffered: int = 50_000,
+        retry_interval: float = 1.0,
+    ):
+        if "session" in fields:
+            raise TransmitterError("The session field name is reserved")
+        self._fields = list(fields)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._rows: deque[tuple] = deque(maxlen=max_buffered)
+        self._first_buffered: float | None = None
+        self._retry_interval = retry_interval
+        self._retry_at: float | None = None
+        self._dropped = 0
+        self._name = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        try:
+            self._connection = connect(database)
+            with self._connection:
+                self._add_columns()
+                self._session = self._connection.execute(
+                    "INSERT INTO sessions (name, car, config_hash, start_time, fields) VALUES (?, ?, ?, ?, ?)",
+                    (
+                        self._name,
+                        car,
+                        config_hash,
+                        time.time_ns() / 1e6,
+                        json.dumps(self._fields),
+                    ),
+                ).lastrowid
+        except sqlite3.Error as exc:
+            raise TransmitterError(f"Cannot open database {database}: {exc}") from exc
+        columns = ", ".join(_quote(field) for field in ["session"] + self._fields)
+        placeholders = ", ".join("?" * (len(self._fields) + 1))
+        self._insert = f"INSERT INTO records ({columns}) VALUES ({placeholders})"
+
+    @property
+    def session(self) -> int:
+        """The id of the session in the sessions table."""
+        return self._session
+
+    @property
+    def name(self) -> str:
+        """The name of the session, its start timestamp."""
+        return self._name
+
+    @property
+    def dropped(self) -> int:
+        """The records dropped because the database could not be written for too long."""
+        return self._dropped
+
+    def handle_record(self, data: Mapping):
+        """
+        Buffer the data record for the database, inserting the batch when due.
+
+        Args:
+            data(Mapping): the data record to be saved, e.g. a TelemetryRecord, with its
+                values in the order of the session fields
+
+        Raises:
+            TransmitterError: If the record does not match the session fields, or the
+                batch cannot be inserted.
+        """
+        try:
+            row = (self._session, *data.values())
+        except (AttributeError, TypeError) as exc:
+            raise TransmitterError(
+                f"Invalid data being written, received: {data}\n{exc}"
+            ) from exc
+        if len(row) != len(self._fields) + 1:
+            raise TransmitterError(
+                f"Invalid data being written, expected {len(self._fields)} fields, received: {data}"
+            )
+        if len(self._rows) == self._rows.maxlen:
+            self._dropped += 1
+        self._rows.append(row)
+        if self._first_buffered is None:
+            self._first_buffered = time.monotonic()
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        """
+        Insert the batch if it is full or its oldest record is too old.
+
+        After a failed insert, nothing is tried until retry_interval seconds have passed.
+
+        Raises:
+            TransmitterError: If the batch cannot be inserted.
+        """
+        if self._first_buffered is None:
+            return
+        if self._retry_at is not None and time.monotonic() < self._retry_at:
+            return
+        if (
+            len(self._rows) >= self._batch_size
+            or time.monotonic() - self._first_buffered >= self._flush_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        """
+        Insert the buffered records in a single transaction.
+
+        The batch is kept for a later flush if the database is busy or the disk is full,
+        see max_buffered and retry_interval, and dropped if it holds values SQLite cannot
+        store.
+
+        Raises:
+            TransmitterError: If the batch cannot be inserted.
+        """
+        if self._first_buffered is None:
+            return
+        try:
+            with self._connection:
+                self._connection.executemany(self._insert, self._rows)
+        except sqlite3.OperationalError as exc:
+            self._retry_at = time.monotonic() + self._retry_interval
+            raise TransmitterError(
+                f"Problem writing to database, {len(self._rows)} records kept and {self._dropped} dropped: {exc}"
+            ) from exc
+        except sqlite3.Error as exc:
+            self._rows.clear()
+            self._first_buffered = None
+            self._retry_at = None
+            raise TransmitterError(
+                f"Invalid data dropped from database: {exc}"
+            ) from exc
+        self._rows.clear()
+        self._first_buffered = None
+        self._retry_at = None
+
+    def close(self):
+        """
+        Insert the remaining records and close the database.
+
+        Raises:
+            TransmitterError: If the batch cannot be inserted.
+        """
+        try:
+            self.flush()
+        finally:
+            self._connection.close()
+
+    def _add_columns(self):
+        """Add a column for each field the records table does not have yet."""
+        existing = {
+            row[1] for row in self._connection.execute("PRAGMA table_info(records)")
+        }
+        for field in self._fields:
+            if field not in existing:
+                self._connection.execute(
+                    f"ALTER TABLE records ADD COLUMN {_quote(field)} REAL"
+                )
+
+
+def list_sessions(database: str) -> list[dict]:
+    """
+    List the sessions of a telemetry database.
+
+    Args:
+        database(str): path of the database file
+
+    Returns:
+        list[dict]: the id, name, car, config_hash, start_time and fields of each session,
+            oldest first
+    """
+    connection = connect(database)
+    try:
+        rows = connection.execute(
+            "SELECT id, name, car, config_hash, start_time, fields FROM sessions ORDER BY id"
+        ).fetchall()
+    finally:
+        connection.close()
+    return [
+        {
+            "id": row[0],
+            "name": row[1],
+            "car": row[2],
+            "config_hash": row[3],
+            "start_time": row[4],
+            "fields": json.loads(row[5]),
+        }
+        for row in rows
+    ]
+
+
+def query_records(
+    database: str,
+    session: int,
+    start: float | None = None,
+    end: float | None = None,
+    fields: Sequence[str] | None = None,
+) -> dict[str, list]:
+    """
+    Return the records of a session with start <= time <= end, using the time index.
+
+    Args:
+        database(str): path of the database file
+        session(int): the session id, see list_sessions
+        start(float, optional): earliest time in ms since epoch, defaults to the first record
+        end(float, optional): latest time in ms since epoch, defaults to the last record
+        fields(Sequence[str], optional): the fields to return, defaults to the session fields
+
+    Returns:
+        dict[str, list]: one list of values per field, in the order of fields
+
+    Raises:
+        ValueError: If the session or a field does not exist.
+    """
+    connection = connect(database)
+    try:
+        row = connection.execute(
+            "SELECT fields FROM sessions WHERE id = ?", (session,)
+        ).fetchone()
+        if row is None:
+            raise ValueError(f"Session not found: {session}")
+        available = json.loads(row[0])
+        names = available if fields is None else list(fields)
+        missing = [field for field in names if field not in available]
+        if missing:
+            raise ValueError(f"Unknown fields: {', '.join(missing)}")
+        columns = ", ".join(_quote(field) for field in names)
+        rows = connection.execute(
+            f"SELECT {columns} FROM records WHERE session = ? AND time BETWEEN ? AND ? ORDER BY time",
+            (
+                session,
+                float("-inf") if start is None else start,
+                float("inf") if end is None else end,
+            ),
+        ).fetchall()
+    finally:
+        connection.close()
+    return {name: [row[i] for row in rows] for i, name in enumerate(names)}
@@ -0,0 +1,229 @@
+"""
+Synthetic telemetry source for testing mode.
+
+Generates a realistic, deterministic stream of Arduino packets at a configurable rate so
+the whole pipeline can be exercised without a car. The car follows a burn-and-coast cycle:
+the engine runs for part of each cycle while speed climbs, then coasts down with the
+engine off. Temperatures follow the engine with first-order lag.
+
+The stream can be made to misbehave like a real link with injected corruption (flipped or
+dropped bytes), gaps (runs of packets that never arrive) and bursts (runs of packets that
+are held back and delivered all at once).
+"""
+
+import math
+import random
+import time
+
+from configuration_generator import DEFAULT_PACKET_LAYOUT, PacketLayout
+from serial_framing import encode_frame
+
+BURN_CYCLE_SECONDS = 60.0
+BURN_SECONDS = 20.0
+LAP_SECONDS = 120.0
+
+
+class SyntheticTelemetry:
+    """
+    A raw byte source producing synthetic packets in real time.
+
+    Packet contents depend only on the seed and the packet index, so two sources with
+    the same settings always produce the same byte stream, regardless of read timing.
+
+    Args:
+        rate_hz(float): packets generated per second of wall time
+        seed(int): seed for all randomness in the stream
+        corruption_rate(float): probability that a packet has a byte flipped or dropped
+        gap_rate(float): probability that a packet starts a gap of lost packets
+        gap_length(int): number of packets lost in each gap
+        burst_rate(float): probability that a packet starts a burst
+        burst_length(int): number of packets held back and delivered together in each burst
+        framed(bool): wrap each packet in a sync/length/CRC frame
+        layout(PacketLayout): layout of the generated packets, fields the simulation does
+            not know about are sent as zero
+    """
+
+    def __init__(
+        self,
+        rate_hz: float = 20.0,
+        seed: int = 0,
+        corruption_rate: float = 0.0,
+        gap_rate: float = 0.0,
+        gap_length: int = 10,
+        burst_rate: float = 0.0,
+        burst_length: int = 10,
+        framed: bool = False,
+        layout: PacketLayout = DEFAULT_PACKET_LAYOUT,
+    ):
+        if rate_hz <= 0:
+            raise ValueError(f"Synthetic packet rate must be positive, got {rate_hz}")
+        self._rate_hz = rate_hz
+        self._dt = 1.0 / rate_hz
+        self._random = random.Random(seed)
+        self._corruption_rate = corruption_rate
+        self._gap_rate = gap_rate
+        self._gap_length = gap_length
+        self._burst_rate = burst_rate
+        self._burst_length = burst_length
+        self._framed = framed
+        self._layout = layout
+
+        self._index = 0
+        self._gap_remaining = 0
+        self._burst_remaining = 0
+        self._held: list[bytes] = []
+        self._engine_temp = 120.0
+        self._rad_temp = 100.0
+        self._start_ns: int | None = None
+
+    @classmethod
+    def from_spec(
+        cls,
+        spec: str,
+        framed: bool = False,
+        layout: PacketLayout = DEFAULT_PACKET_LAYOUT,
+    ) -> "SyntheticTelemetry":
+        """
+        Create a source from a comma separated settings string.
+
+        Args:
+            spec(str): settings such as "rate=1000,seed=7,corruption=0.01,gaps=0.001,bursts=0.01".
+                Recognized keys are rate, seed, corruption, gaps, gap_length, bursts and burst_length.
+            framed(bool): wrap each packet in a sync/length/CRC frame
+            layout(PacketLayout): layout of the generated packets
+
+        Raises:
+            ValueError: If the string contains an unknown key or an invalid value.
+        """
+        keys = {
+            "rate": ("rate_hz", float),
+            "seed": ("seed", int),
+            "corruption": ("corruption_rate", float),
+            "gaps": ("gap_rate", float),
+            "gap_length": ("gap_length", int),
+            "bursts": ("burst_rate", float),
+            "burst_length": ("burst_length", int),
+        }
+        kwargs = {}
+        for item in filter(None, (part.strip() for part in spec.split(","))):
+            key, _, value = item.partition("=")
+            if key not in keys:
+                raise ValueError(f"Unknown synthetic telemetry setting: {key}")
+            name, cast = keys[key]
+            kwargs[name] = cast(value)
+        return cls(framed=framed, layout=layout, **kwargs)
+
+    @property
+    def exhausted(self) -> bool:
+        """A synthetic source never runs out of data."""
+        return False
+
+    def time_until_next(self) -> float:
+        """Seconds until the next packet is due."""
+        if self._start_ns is None:
+            return 0.0
+        elapsed = (time.monotonic_ns() - self._start_ns) / 1e9
+        return max(0.0, self._index * self._dt - elapsed)
+
+    def read(self) -> bytes:
+        """
+        Return the bytes of every packet that is due by now.
+
+        At most one second of packets is generated per call, so a stalled consumer does
+        not get a single enormous catch-up read.
+        """
+        now_ns = time.monotonic_ns()
+        if self._start_ns is None:
+            self._start_ns = now_ns
+        due_index = int((now_ns - self._start_ns) / 1e9 * self._rate_hz) + 1
+        count = min(due_index - self._index, math.ceil(self._rate_hz))
+        return self.generate(count) if count > 0 else b""
+
+    def generate(self, count: int) -> bytes:
+        """
+        Generate the next packets of the stream, ignoring wall time.
+
+        Args:
+            count(int): number of packets to generate, including ones lost to gaps
+
+        Returns:
+            bytes: the raw bytes as they would arrive on the wire
+        """
+        out = []
+        for _ in range(count):
+            packet = self._next_packet()
+            rng = self._random
+
+            if self._gap_remaining == 0 and rng.random() < self._gap_rate:
+                self._gap_remaining = self._gap_length
+            if self._gap_remaining:
+                self._gap_remaining -= 1
+                continue
+
+            if self._framed:
+                packet = encode_frame(packet)
+            if rng.random() < self._corruption_rate:
+                packet = self._corrupt(packet)
+
+            if self._burst_remaining == 0 and rng.random() < self._burst_rate:
+                self._burst_remaining = self._burst_length
+            if self._burst_remaining:
+                self._held.append(packet)
+                self._burst_remaining -= 1
+                if self._burst_remaining == 0:
+                    out.extend(self._held)
+                    self._held.clear()
+                continue
+            out.append(packet)
+        return b"".join(out)
+
+    def _next_packet(self) -> bytes:
+        """Build the packet for the current index and advance the simulation one step."""
+        rng = self._random
+        t = self._index * self._dt
+        self._index += 1
+
+        phase = t % BURN_CYCLE_SECONDS
+        burning = phase < BURN_SECONDS
+        if burning:
+            speed = 15.0 + 10.0 * phase / BURN_SECONDS
+        else:
+            coast = (phase - BURN_SECONDS) / (BURN_CYCLE_SECONDS - BURN_SECONDS)
+            speed = 25.0 - 10.0 * coast
+        speed += rng.gauss(0.0, 0.2)
+        airspeed = speed + 3.0 * math.sin(2 * math.pi * t / 45.0) + rng.gauss(0, 0.5)
+
+        # First-order lag towards the running/idle temperature
+        target = 190.0 if burning else 120.0
+        self._engine_temp += (target - self._engine_temp) * min(1.0, self._dt / 30.0)
+        self._rad_temp += (self._engine_temp * 0.85 - self._rad_temp) * min(
+            1.0, self._dt / 60.0
+        )
+
+        lap_pulse = 1 if t % LAP_SECONDS < 0.5 else 0
+        brake = 1 if not burning and rng.random() < 0.02 else 0
+        battery = 700 + 50 * math.sin(2 * math.pi * t / 300.0) + rng.gauss(0, 3)
+
+        return self._layout.pack(
+            {
+                "speed": speed,
+                "airspeed": airspeed,
+                "engine_temp": self._engine_temp + rng.gauss(0, 0.3),
+                "rad_temp": self._rad_temp + rng.gauss(0, 0.3),
+                "channel0": int(burning),
+                "channel1": 1,
+                "channel2": brake,
+                "channel3": 0,
+                "channel4": lap_pulse,
+                "channelA0": min(1023, max(0, int(battery))),
+            }
+        )
+
+    def _corrupt(self, packet: bytes) -> bytes:
+        """Flip or drop a random byte of the packet."""
+        rng = self._random
+        position = rng.randrange(len(packet))
+        if rng.random() < 0.5:
+            return packet[:position] + packet[position + 1 :]
+        flipped = packet[position] ^ (1 << rng.randrange(8))
+        return packet[:position] + bytes((flipped,)) + packet[position + 1 :]
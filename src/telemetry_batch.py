@@ -0,0 +1,175 @@
+"""
+Compact columnar encoding of record batches for the cloud upload.
+
+A batch message carries many records of one car configuration without repeating their
+field names:
+
+    HEADER:  b"SMB" | version (uint8) | dictionary id (8 bytes) | records (uint32) | fields (uint16)
+    SEQUENCE: sequence number (uint64), version 2 only
+    BODY:    zlib compressed columns, for every field one little-endian float64 per record
+
+The field names are published once per field dictionary, as a retained JSON message
+{"dictionary": ..., "config_hash": ..., "fields": [...]}. Its id is a hash of the car's
+configuration hash and the field names, so it changes whenever the records change shape,
+e.g. after a configuration update. The first 8 bytes of the id are in every batch header,
+so a receiver looks the dictionary up and decodes the columns with decode_batch.
+
+Batches sent through an outbox (see remote_outbox) are version 2 and carry a sequence
+number, so a receiver can drop the batches it already has, see batch_sequence.
+"""
+
+import hashlib
+import json
+import struct
+import zlib
+from typing import Mapping, Sequence
+
+BATCH_MAGIC = b"SMB"
+BATCH_VERSION = 2
+SUPPORTED_VERSIONS = (1, 2)
+BATCH_HEADER = struct.Struct("<3sB8sIH")
+BATCH_SEQUENCE = struct.Struct("<Q")
+
+
+def dictionary_id(fields: Sequence[str], config_hash: str | None = None) -> str:
+    """
+    Id of the field dictionary of a record shape.
+
+    Args:
+        fields(Sequence[str]): the record fields, in record order
+        config_hash(str, optional): the car's configuration hash
+
+    Returns:
+        str: a sha256 hex digest
+    """
+    encoded = json.dumps({"config_hash": config_hash, "fields": list(fields)})
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def encode_dictionary(fields: Sequence[str], config_hash: str | None = None) -> str:
+    """
+    Encode the field dictionary message of a record shape.
+
+    Args:
+        fields(Sequence[str]): the record fields, in record order
+        config_hash(str, optional): the car's configuration hash
+
+    Returns:
+        str: the JSON message
+    """
+    return json.dumps(
+        {
+            "dictionary": dictionary_id(fields, config_hash),
+            "config_hash": config_hash,
+            "fields": list(fields),
+        }
+    )
+
+
+def encode_batch(
+    dictionary: str, rows: Sequence[Sequence[float]], sequence: int | None = None
+) -> bytes:
+    """
+    Encode a batch of records as columns.
+
+    Args:
+        dictionary(str): the id of the field dictionary of the records, see dictionary_id
+        rows(Sequence[Sequence[float]]): the record values, one sequence per record in
+            field order
+        sequence(int, optional): the sequence number of the batch, the batch is encoded
+            as version 1 without it
+
+    Returns:
+        bytes: the batch message
+
+    Raises:
+        ValueError: If the records have different lengths or non-numeric values.
+    """
+    field_count = len(rows[0]) if rows else 0
+    if any(len(row) != field_count for row in rows):
+        raise ValueError("Every record of a batch needs the same fields")
+    column = struct.Struct(f"<{len(rows)}d")
+    try:
+        body = b"".join(column.pack(*values) for values in zip(*rows))
+    except struct.error as exc:
+        raise ValueError(f"Batch records must be numeric: {exc}") from exc
+    header = BATCH_HEADER.pack(
+        BATCH_MAGIC,
+        1 if sequence is None else BATCH_VERSION,
+        bytes.fromhex(dictionary[:16]),
+        len(rows),
+        field_count,
+    )
+    if sequence is not None:
+        header += BATCH_SEQUENCE.pack(sequence)
+    return header + zlib.compress(body)
+
+
+def _parse_header(payload: bytes) -> tuple[bytes, int, int, int | None, int]:
+    """Split a batch header into its key, counts and sequence, and find the body."""
+    if len(payload) < BATCH_HEADER.size:
+        raise ValueError("Batch message is too short")
+    magic, version, key, records, field_count = BATCH_HEADER.unpack_from(payload)
+    if magic != BATCH_MAGIC or version not in SUPPORTED_VERSIONS:
+        raise ValueError("Not a supported batch message")
+    if version == 1:
+        return key, records, field_count, None, BATCH_HEADER.size
+    if len(payload) < BATCH_HEADER.size + BATCH_SEQUENCE.size:
+        raise ValueError("Batch message is too short")
+    (sequence,) = BATCH_SEQUENCE.unpack_from(payload, BATCH_HEADER.size)
+    return key, records, field_count, sequence, BATCH_HEADER.size + BATCH_SEQUENCE.size
+
+
+def batch_sequence(payload: bytes) -> int | None:
+    """
+    Read the sequence number of a batch message, without decoding it.
+
+    Args:
+        payload(bytes): the batch message
+
+    Returns:
+        int | None: the sequence number, or None for batches sent without one
+
+    Raises:
+        ValueError: If the message is invalid.
+    """
+    return _parse_header(payload)[3]
+
+
+def decode_batch(
+    payload: bytes, dictionaries: Mapping[str, Sequence[str]]
+) -> tuple[str, dict[str, list[float]]]:
+    """
+    Decode a batch message.
+
+    Args:
+        payload(bytes): the batch message
+        dictionaries(Mapping[str, Sequence[str]]): the known field dictionaries, fields by
+            dictionary id
+
+    Returns:
+        tuple[str, dict[str, list[float]]]: the dictionary id, and one list of values per field
+
+    Raises:
+        ValueError: If the message is invalid or its dictionary is unknown.
+    """
+    key, records, field_count, _, body_offset = _parse_header(payload)
+    dictionary = next((name for name in dictionaries if name[:16] == key.hex()), None)
+    if dictionary is None:
+        raise ValueError(f"Unknown field dictionary {key.hex()}")
+    fields = list(dictionaries[dictionary])
+    if len(fields) != field_count:
+        raise ValueError(
+            f"Batch has {field_count} fields, its dictionary has {len(fields)}"
+        )
+    try:
+        body = zlib.decompress(payload[body_offset:])
+    except zlib.error as exc:
+        raise ValueError(f"Corrupt batch message: {exc}") from exc
+    if len(body) != 8 * records * field_count:
+        raise ValueError("Batch body does not match its header")
+    column = struct.Struct(f"<{records}d")
+    return dictionary, {
+        field: list(column.unpack_from(body, position * column.size))
+        for position, field in enumerate(fields)
+    }
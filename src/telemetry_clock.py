@@ -0,0 +1,161 @@
+"""
+Timestamping and odometry for decoded packets.
+
+Packets are stamped with the monotonic nanosecond clock, which never jumps, and converted
+to wall clock epoch time only for output. Distance is integrated from those monotonic
+stamps, so NTP corrections or manual clock changes on the Pi cannot corrupt it.
+"""
+
+import math
+import time
+
+NS_PER_MS = 1_000_000
+# mph -> ft/ns
+MPH_TO_FT_PER_NS = 5280 / 3600 / 1e9
+
+
+class TelemetryClock:
+    """
+    Monotonic clock anchored once to the wall clock, with gradual drift correction.
+
+    Every resync_interval seconds the mapping is compared against the wall clock. Small
+    differences (normal oscillator drift, NTP slewing) are corrected by running the mapping
+    slightly fast or slow, at most max_slew, so output timestamps never go backwards.
+    Differences larger than step_threshold seconds mean the wall clock was stepped (e.g. the
+    Pi has no RTC and NTP sets the time after boot) and the mapping is re-anchored at once.
+
+    Args:
+        resync_interval(float): seconds between comparisons with the wall clock
+        max_slew(float): largest rate correction, as a fraction (0.0005 = 500 ppm)
+        step_threshold(float): error in seconds above which the mapping is re-anchored
+        max_spacing(float): longest spacing in seconds between the packets of a batch,
+            about the nominal packet interval, see spread
+    """
+
+    def __init__(
+        self,
+        resync_interval: float = 60.0,
+        max_slew: float = 0.0005,
+        step_threshold: float = 1.0,
+        max_spacing: float = 0.1,
+    ):
+        self._interval_ns = int(resync_interval * 1e9)
+        self._max_slew = max_slew
+        self._step_threshold_ns = int(step_threshold * 1e9)
+        self._max_spacing_ns = int(max_spacing * 1e9)
+
+        mono = time.monotonic_ns()
+        self._offset_ns = time.time_ns() - mono
+        self._rate = 0.0
+        self._check_mono = mono
+        self._last_stamp = mono
+        self.steps = 0
+
+    def now_ns(self) -> int:
+        """Return the current monotonic time in ns, correcting drift when due."""
+        mono = time.monotonic_ns()
+        if mono - self._check_mono >= self._interval_ns:
+            self._discipline(mono)
+        self._last_stamp = mono
+        return mono
+
+    def spread(self, count: int) -> list[int]:
+        """
+        Stamp a batch of packets that arrived together.
+
+        The newest packet is stamped now and the others are spaced evenly across the
+        interval since the previous stamp, at most max_spacing apart. After an idle
+        period, e.g. a reconnect, the packets are recent, so they are not back-dated
+        across the whole gap.
+
+        Args:
+            count(int): number of packets in the batch
+
+        Returns:
+            list[int]: monotonic time in ns for each packet, oldest first
+        """
+        previous = self._last_stamp
+        now = self.now_ns()
+        step = min((now - previous) / count, self._max_spacing_ns) if count else 0
+        return [now - int(step * (count - 1 - i)) for i in range(count)]
+
+    @property
+    def mapping(self) -> tuple[int, int, float]:
+        """
+        The current monotonic to wall clock mapping as (offset_ns, check_mono_ns, rate).
+
+        wall_ns = mono_ns + offset_ns + int((mono_ns - check_mono_ns) * rate)
+        """
+        return self._offset_ns, self._check_mono, self._rate
+
+    def to_wall_ns(self, mono_ns: int) -> int:
+        """Convert a monotonic timestamp to wall clock ns since epoch."""
+        return (
+            mono_ns + self._offset_ns + int((mono_ns - self._check_mono) * self._rate)
+        )
+
+    def to_wall_ms(self, mono_ns: int) -> float:
+        """Convert a monotonic timestamp to wall clock ms since epoch, with µs resolution."""
+        return (self.to_wall_ns(mono_ns) // 1000) / 1000
+
+    def _discipline(self, mono: int):
+        """Compare the mapping with the wall clock and pick a new correction."""
+        # Fold the running correction into the offset, keeping the mapping continuous
+        self._offset_ns += int((mono - self._check_mono) * self._rate)
+        self._check_mono = mono
+        error = time.time_ns() - (mono + self._offset_ns)
+        if abs(error) > self._step_threshold_ns:
+            self._offset_ns += error
+            self._rate = 0.0
+            self.steps += 1
+        else:
+            rate = error / self._interval_ns
+            self._rate = max(-self._max_slew, min(self._max_slew, rate))
+
+
+class Odometer:
+    """
+    Integrates distance from speed samples stamped with a monotonic clock.
+
+    Distance is integrated with the trapezoidal rule between consecutive valid samples.
+    Samples that cannot be a real speed (NaN, negative or above max_speed, usually a
+    corrupted packet) are ignored, and nothing is integrated across gaps longer than
+    max_gap, e.g. while the serial connection was down.
+
+    Args:
+        max_speed(float): fastest plausible speed in mph
+        max_gap(float): longest interval in seconds to integrate across
+    """
+
+    def __init__(self, max_speed: float = 200.0, max_gap: float = 2.0):
+        self.max_speed = max_speed
+        self.max_gap_ns = int(max_gap * 1e9)
+        self.distance = 0.0
+        self.last_speed: float | None = None
+        self.last_ns: int | None = None
+
+    def update(self, speed: float, mono_ns: int) -> float:
+        """
+        Add a speed sample and return the total distance traveled in feet.
+
+        Args:
+            speed(float): speed in mph
+            mono_ns(int): monotonic time of the sample in ns
+        """
+        if not (math.isfinite(speed) and 0 <= speed <= self.max_speed):
+            return self.distance
+        if self.last_ns is not None:
+            delta = mono_ns - self.last_ns
+            if 0 < delta <= self.max_gap_ns:
+                self.distance += (
+                    (self.last_speed + speed) / 2 * MPH_TO_FT_PER_NS * delta
+                )
+        self.last_speed = speed
+        self.last_ns = mono_ns
+        return self.distance
+
+    def reset(self):
+        """Reset the distance traveled to zero."""
+        self.distance = 0.0
+        self.last_speed = None
+        self.last_ns = None
@@ -0,0 +1,139 @@
+"""
+In-memory history of recent telemetry.
+
+Records are stored column by column in preallocated arrays of doubles. Every value is
+written twice, at its slot and at its slot plus the capacity, so the newest `capacity`
+records are always one contiguous run of each array. Appending is O(1), and any window of
+the history is a zero-copy memoryview slice, found by binary search on the time column.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Iterable
+
+from telemetry_record import RecordSchema, TelemetryRecord
+
+
+class TelemetryHistory:
+    """
+    A bounded columnar ring buffer holding the most recent records.
+
+    Values are stored as floats. Windows are views into the buffer and are overwritten
+    as new records arrive, copy them (e.g. with .tolist()) if they must be kept.
+
+    Args:
+        schema(RecordSchema): the schema of the records, it must contain a "time" field
+        capacity(int): the number of records kept, the oldest are dropped first
+    """
+
+    def __init__(self, schema: RecordSchema, capacity: int):
+        if capacity <= 0:
+            raise ValueError(f"History capacity must be positive, got {capacity}")
+        if "time" not in schema.index:
+            raise ValueError("History schema must contain a time field")
+        self._schema = schema
+        self._capacity = capacity
+        self._columns = tuple(array("d", bytes(16 * capacity)) for _ in schema.fields)
+        self._time = self._columns[schema.index["time"]]
+        self._head = 0
+        self._count = 0
+
+    @property
+    def schema(self) -> RecordSchema:
+        """The schema of the stored records."""
+        return self._schema
+
+    @property
+    def capacity(self) -> int:
+        """The maximum number of records kept."""
+        return self._capacity
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, record: TelemetryRecord):
+        """
+        Add a record as the newest entry, dropping the oldest one when full.
+
+        A record older than the newest entry means the wall clock was stepped back, the
+        history is cleared so it stays ordered by time.
+
+        Args:
+            record(TelemetryRecord): a record with the same schema as the history
+
+        Raises:
+            ValueError: If the record has a different schema.
+        """
+        if record.schema != self._schema:
+            raise ValueError("Record schema does not match the history schema")
+        values = record.values()
+        if self._count and values[self._schema.index["time"]] < self.newest_time():
+            self.clear()
+
+        head = self._head
+        mirror = head + self._capacity
+        for column, value in zip(self._columns, values):
+            column[head] = value
+            column[mirror] = value
+        self._head = head + 1 if head + 1 < self._capacity else 0
+        if self._count < self._capacity:
+            self._count += 1
+
+    def extend(self, records: Iterable[TelemetryRecord]):
+        """Append several records, oldest first."""
+        for record in records:
+            self.append(record)
+
+    def clear(self):
+        """Drop every record."""
+        self._head = 0
+        self._count = 0
+
+    def oldest_time(self) -> float | None:
+        """Time of the oldest record in ms since epoch, None when empty."""
+        return self._time[self._start()] if self._count else None
+
+    def newest_time(self) -> float | None:
+        """Time of the newest record in ms since epoch, None when empty."""
+        return self._time[self._start() + self._count - 1] if self._count else None
+
+    def window(
+        self, start: float | None = None, end: float | None = None
+    ) -> dict[str, memoryview]:
+        """
+        Return the records with start <= time <= end as zero-copy column views.
+
+        Args:
+            start(float, optional): earliest time in ms since epoch, defaults to the oldest record
+            end(float, optional): latest time in ms since epoch, defaults to the newest record
+
+        Returns:
+            dict[str, memoryview]: one view of doubles per field, in schema order
+        """
+        first = self._start()
+        last = first + self._count
+        times = memoryview(self._time)[first:last]
+        lower = first + (bisect_left(times, start) if start is not None else 0)
+        upper = first + (bisect_right(times, end) if end is not None else self._count)
+        return {
+            name: memoryview(column)[lower:upper]
+            for name, column in zip(self._schema.fields, self._columns)
+        }
+
+    def last(self, seconds: float) -> dict[str, memoryview]:
+        """
+        Return the records of the last `seconds` before the newest record.
+
+        Args:
+            seconds(float): length of the window
+
+        Returns:
+            dict[str, memoryview]: one view of doubles per field, in schema order
+        """
+        if not self._count:
+            return self.window()
+        return self.window(start=self.newest_time() - seconds * 1000)
+
+    def _start(self) -> int:
+        """Position of the oldest record in the contiguous run of the arrays."""
+        return (self._head - self._count) % self._capacity
@@ -0,0 +1,95 @@
+"""
+Fixed-schema telemetry records.
+
+A record stores its values in a flat list and shares one RecordSchema (the field names
+and their positions) with every other record of the same car configuration, instead of
+carrying its own hash table of keys like a dict. Records behave as read-only mappings, so
+`record["speed"]` and iteration work as before, and convert to a dict or JSON only at the
+edges that need one.
+"""
+
+import json
+from collections.abc import Mapping
+from typing import Iterable, Iterator
+
+
+class RecordSchema:
+    """
+    The ordered field names shared by every record of a car configuration.
+
+    Args:
+        fields(Iterable[str]): the field names, in record order
+    """
+
+    __slots__ = ("fields", "index")
+
+    def __init__(self, fields: Iterable[str]):
+        self.fields = tuple(fields)
+        self.index = {name: position for position, name in enumerate(self.fields)}
+        if len(self.index) != len(self.fields):
+            raise ValueError(f"Duplicate field names in record schema: {self.fields}")
+
+    def __len__(self) -> int:
+        return len(self.fields)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, RecordSchema) and self.fields == other.fields
+
+    def __hash__(self) -> int:
+        return hash(self.fields)
+
+    def __repr__(self) -> str:
+        return f"RecordSchema({list(self.fields)})"
+
+
+class TelemetryRecord(Mapping):
+    """
+    One decoded data record, stored as a list of values in schema order.
+
+    Args:
+        schema(RecordSchema): the schema of the record
+        values(list): one value per schema field, in order. The list is used as is.
+    """
+
+    __slots__ = ("_schema", "_values")
+
+    def __init__(self, schema: RecordSchema, values: list):
+        if len(values) != len(schema.fields):
+            raise ValueError(
+                f"Expected {len(schema.fields)} values for the record, got {len(values)}"
+            )
+        self._schema = schema
+        self._values = values
+
+    @property
+    def schema(self) -> RecordSchema:
+        """The schema of the record."""
+        return self._schema
+
+    def __getitem__(self, key: str):
+        return self._values[self._schema.index[key]]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._schema.fields)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __contains__(self, key) -> bool:
+        return key in self._schema.index
+
+    def values(self) -> list:
+        """The values of the record in schema order. Do not modify the returned list."""
+        return self._values
+
+    def to_dict(self) -> dict:
+        """Convert the record to a plain dictionary."""
+        return dict(zip(self._schema.fields, self._values))
+
+    def to_json(self) -> str:
+        """Serialize the record as a JSON object."""
+        return json.dumps(self.to_dict())
+
+    def __repr__(self) -> str:
+        # Same text as the equivalent dict, which is what the remote server receives
+        return repr(self.to_dict())
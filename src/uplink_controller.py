@@ -0,0 +1,230 @@
+"""
+Adaptive rate control of the cloud upload.
+
+The cellular link around the track goes from fast to nearly dead and back. A fixed
+decimation either wastes the good stretches or queues up minutes of data on the bad ones.
+An UplinkController measures how long published messages take to complete, i.e. their
+on_publish callback, and how many are still in flight, and adjusts the upload with
+additive increase, multiplicative decrease. Every update looks at the mean latency of the
+messages completed since the previous one and the age of the oldest message in flight:
+
+- While the latency, the oldest age and the in-flight count are under their targets, the
+  record rate grows by a fixed step every update, and the batch interval shrinks back
+  towards its base.
+- When either goes over, the record rate is cut by a factor and the batch interval
+  doubles, so fewer, larger messages are sent until the queue drains.
+
+Records over the rate are dropped before they are batched, with a token bucket, so the
+records that are sent are spread evenly.
+"""
+
+import math
+import threading
+import time
+from collections import deque
+
+
+class UplinkController:
+    """
+    Feedback controller of the remote record rate and batch size, see the module documentation.
+
+    Call sent and acknowledged with the message ids of the published messages, and admit
+    for every record that could be sent. Safe to use from the main loop and the MQTT thread.
+
+    Args:
+        target_latency(float): highest acceptable mean completion latency in seconds.
+            Defaults to 1.
+        max_in_flight(int): highest acceptable number of messages in flight. Defaults to 10.
+        initial_rate(float): records per second to start with. Defaults to 5.
+        min_rate(float): lowest record rate. Defaults to 0.5.
+        max_rate(float): highest record rate. Defaults to 100.
+        increase(float): records per second added by a good update. Defaults to 2.
+        decrease(float): factor of the record rate after a congested update. Defaults to 0.5.
+        batch_interval(float): base seconds of records per batch. Defaults to 1.
+        max_batch_interval(float): longest seconds of records per batch. Defaults to 8.
+        update_interval(float): seconds between rate updates. Defaults to 1.
+
+    Raises:
+        ValueError: If the rates, targets or intervals are not positive, or decrease is not
+            between 0 and 1.
+    """
+
+    def __init__(
+        self,
+        target_latency: float = 1.0,
+        max_in_flight: int = 10,
+        initial_rate: float = 5.0,
+        min_rate: float = 0.5,
+        max_rate: float = 100.0,
+        increase: float = 2.0,
+        decrease: float = 0.5,
+        batch_interval: float = 1.0,
+        max_batch_interval: float = 8.0,
+        update_interval: float = 1.0,
+    ):
+        if min(target_latency, max_in_flight, min_rate, batch_interval) <= 0:
+            raise ValueError("Uplink targets, rates and intervals must be positive")
+        if not min_rate <= initial_rate <= max_rate:
+            raise ValueError(
+                f"Initial rate {initial_rate} is not between {min_rate} and {max_rate}"
+            )
+        if not 0 < decrease < 1:
+            raise ValueError(f"Rate decrease must be between 0 and 1, got {decrease}")
+        self._target_latency = target_latency
+        self._max_in_flight = max_in_flight
+        self._min_rate = min_rate
+        self._max_rate = max_rate
+        self._increase = increase
+        self._decrease = decrease
+        self._base_interval = batch_interval
+        self._max_interval = max(batch_interval, max_batch_interval)
+        self._update_interval = update_interval
+
+        self._lock = threading.Lock()
+        self._rate = initial_rate
+        self._batch_interval = batch_interval
+        self._latency: float | None = None
+        # Completion latencies since the last update
+        self._window_total = 0.0
+        self._window_count = 0
+        # Publish times of the messages in flight, by message id
+        self._sent: dict[int, float] = {}
+        # Completions that may arrive before publish returns the message id
+        self._unmatched: deque[int] = deque(maxlen=64)
+        self._tokens = 1.0
+        self._last_admit = time.monotonic()
+        self._last_update = time.monotonic()
+        self._admitted = 0
+        self._dropped = 0
+        self._timeouts = 0
+        self._congested_updates = 0
+
+    @property
+    def rate(self) -> float:
+        """The current record rate, in records per second."""
+        return self._rate
+
+    @property
+    def batch_interval(self) -> float:
+        """The current seconds of records per batch."""
+        return self._batch_interval
+
+    @property
+    def batch_size(self) -> int:
+        """The current records per batch, the records of a batch interval at the current rate."""
+        return max(1, math.ceil(self._rate * self._batch_interval))
+
+    def admit(self) -> bool:
+        """
+        Decide whether to send a record, updating the rate when due.
+
+        Returns:
+            bool: True if the record fits the current rate, False if it should be dropped
+        """
+        now = time.monotonic()
+        if now - self._last_update >= self._update_interval:
+            self.update()
+        with self._lock:
+            self._tokens = min(
+                max(self._rate, 1.0),
+                self._tokens + (now - self._last_admit) * self._rate,
+            )
+            self._last_admit = now
+            if self._tokens < 1:
+                self._dropped += 1
+                return False
+            self._tokens -= 1
+            self._admitted += 1
+            return True
+
+    def sent(self, mid: int):
+        """
+        Record that a message was handed to the MQTT client.
+
+        Args:
+            mid(int): the message id returned by publish
+        """
+        with self._lock:
+            if mid in self._unmatched:
+                self._unmatched.remove(mid)
+                self._add_sample(0.0)
+            else:
+                self._sent[mid] = time.monotonic()
+
+    def acknowledged(self, mid: int):
+        """
+        Record that a message completed, from the client's on_publish callback.
+
+        Args:
+            mid(int): the message id of the callback
+        """
+        with self._lock:
+            sent_at = self._sent.pop(mid, None)
+            if sent_at is None:
+                self._unmatched.append(mid)
+                return
+            self._add_sample(time.monotonic() - sent_at)
+
+    def update(self):
+        """Adjust the rate and batch interval to the latency and in-flight count."""
+        now = time.monotonic()
+        with self._lock:
+            self._last_update = now
+            # Messages far past the target are counted as lost, e.g. dropped with the connection
+            timeout = 10 * self._target_latency
+            for mid, sent_at in list(self._sent.items()):
+                if now - sent_at > timeout:
+                    del self._sent[mid]
+                    self._timeouts += 1
+                    self._add_sample(now - sent_at)
+            oldest = min(self._sent.values(), default=now)
+            window_latency = (
+                self._window_total / self._window_count if self._window_count else 0.0
+            )
+            self._window_total = 0.0
+            self._window_count = 0
+            congested = (
+                window_latency > self._target_latency
+                or now - oldest > self._target_latency
+                or len(self._sent) > self._max_in_flight
+            )
+            if congested:
+                self._congested_updates += 1
+                self._rate = max(self._min_rate, self._rate * self._decrease)
+                self._batch_interval = min(self._max_interval, self._batch_interval * 2)
+            else:
+                self._rate = min(self._max_rate, self._rate + self._increase)
+                self._batch_interval = max(
+                    self._base_interval, self._batch_interval / 2
+                )
+
+    def stats(self) -> dict[str, float]:
+        """
+        Uplink metrics.
+
+        Returns:
+            dict[str, float]: the record rate, batch size and interval, mean completion
+                latency in ms, messages in flight, records admitted and dropped, messages
+                timed out and congested updates
+        """
+        with self._lock:
+            return {
+                "rate": self._rate,
+                "batch_size": max(1, math.ceil(self._rate * self._batch_interval)),
+                "batch_interval": self._batch_interval,
+                "latency_ms": (self._latency or 0.0) * 1000,
+                "in_flight": len(self._sent),
+                "admitted": self._admitted,
+                "dropped": self._dropped,
+                "timeouts": self._timeouts,
+                "congested_updates": self._congested_updates,
+            }
+
+    def _add_sample(self, latency: float):
+        """Add a completion latency to the update window and average, with the lock held."""
+        self._window_total += latency
+        self._window_count += 1
+        if self._latency is None:
+            self._latency = latency
+        else:
+            self._latency += 0.2 * (latency - self._latency)
@@ -8,4 +8,7 @@ def get_env_flags():
         "DISABLE_LOCAL": getenv("DISABLE_LOCAL", "False") == "True",
         "DISABLE_DISPLAY": getenv("DISABLE_DISPLAY", "False") == "True",
         "TESTING": getenv("TESTING", "False") == "True",
+        "SERIAL_FRAMED": getenv("SERIAL_FRAMED", "False") == "True",
+        "LOCAL_BACKGROUND": getenv("LOCAL_BACKGROUND", "False") == "True",
+        "REMOTE_ADAPTIVE": getenv("REMOTE_ADAPTIVE", "False") == "True",
     }
@@ -0,0 +1,89 @@
+import math
+
+import pytest
+
+from alarm_engine import AlarmEngine, AlarmEvent
+
+
+def feed(engine, values, field="engine_temp"):
+    """Check one record per value, returning every event raised"""
+    events = []
+    for time, value in enumerate(values):
+        events.extend(engine.check({field: value, "time": float(time)}))
+    return events
+
+
+def test_raise_and_clear_with_debounce():
+    engine = AlarmEngine(
+        {"engine_temp": (None, 200.0)}, hysteresis=0.05, debounce=2, clear_debounce=2
+    )
+    events = feed(engine, [190, 205, 195, 205, 206, 199])
+    # A single sample over the limit is not enough, two in a row are
+    assert events == [AlarmEvent("engine_temp", "high", 206, 200.0, 4.0)]
+    assert engine.active == {"engine_temp": "high"}
+
+    # Clearing needs two samples below 200 - 5% of 200 = 190
+    events = engine.check({"engine_temp": 189, "time": 6.0})
+    assert events == []
+    events = engine.check({"engine_temp": 185, "time": 7.0})
+    assert events == [AlarmEvent("engine_temp", "ok", 185, None, 7.0)]
+    assert engine.active == {}
+
+
+def test_raised_on_first_breach_by_default():
+    engine = AlarmEngine({"engine_temp": (None, 200.0)})
+    events = feed(engine, [190, 205])
+    assert events == [AlarmEvent("engine_temp", "high", 205, 200.0, 1.0)]
+
+    # Clearing is still debounced
+    assert feed(engine, [180, 180]) == []
+    assert [event.state for event in feed(engine, [180])] == ["ok"]
+
+
+def test_hysteresis_prevents_flapping():
+    engine = AlarmEngine(
+        {"volts": (10.0, 20.0)}, hysteresis=0.1, debounce=1, clear_debounce=1
+    )
+    # Noise around the upper limit raises once and never clears above 19
+    events = feed(engine, [20.5, 19.5, 20.2, 19.1, 20.1], field="volts")
+    assert [event.state for event in events] == ["high"]
+    events = feed(engine, [18.9], field="volts")
+    assert [event.state for event in events] == ["ok"]
+
+
+def test_low_limit_and_direct_switch():
+    engine = AlarmEngine({"volts": (10.0, 20.0)}, clear_debounce=1)
+    events = feed(engine, [9.0, 25.0, 15.0], field="volts")
+    assert [(event.state, event.limit) for event in events] == [
+        ("low", 10.0),
+        ("high", 20.0),
+        ("ok", None),
+    ]
+
+
+def test_ignores_missing_and_invalid_values():
+    engine = AlarmEngine({"engine_temp": (None, 200.0)}, debounce=1)
+    assert engine.check({"time": 0.0}) == []
+    assert feed(engine, [math.nan, math.inf, -math.inf]) == []
+    assert engine.active == {}
+
+
+def test_invalid_settings():
+    with pytest.raises(ValueError, match="inverted"):
+        AlarmEngine({"volts": (20.0, 10.0)})
+    with pytest.raises(ValueError, match="debounce"):
+        AlarmEngine({}, debounce=0)
+    with pytest.raises(ValueError, match="debounce"):
+        AlarmEngine({}, clear_debounce=0)
+    assert AlarmEngine({"volts": (None, None)}).active == {}
+
+
+def test_event_to_dict():
+    event = AlarmEvent("engine_temp", "high", 210.0, 200.0, 5.0)
+    assert event.to_dict() == {
+        "field": "engine_temp",
+        "state": "high",
+        "value": 210.0,
+        "limit": 200.0,
+        "time": 5.0,
+    }
@@ -0,0 +1,150 @@
+import threading
+import time
+
+import pytest
+
+from background_writer import BackgroundWriter
+from data_transmitter import TransmitterError
+
+
+class FakeSink:
+    """A sink that records what it receives and can be made to stall or fail"""
+
+    def __init__(self):
+        self.records = []
+        self.flushes = 0
+        self.closed = False
+        self.closed_by = None
+        self.gate = threading.Event()
+        self.gate.set()
+        self.fail = False
+
+    def handle_record(self, data):
+        self.gate.wait()
+        if self.fail:
+            raise TransmitterError("Disk full")
+        self.records.append(data)
+
+    def flush_if_due(self):
+        self.flushes += 1
+
+    def close(self):
+        self.closed = True
+        self.closed_by = threading.current_thread().name
+
+
+def test_records_written_in_order():
+    sink = FakeSink()
+    writer = BackgroundWriter(sink, flush_interval=0.01)
+    for i in range(100):
+        writer.handle_record({"time": i})
+    writer.close()
+    assert sink.records == [{"time": i} for i in range(100)]
+    assert sink.closed
+    assert sink.flushes > 0
+    stats = writer.stats()
+    assert stats["written"] == 100 and stats["queue_depth"] == 0
+    assert stats["dropped"] == 0 and stats["errors"] == 0
+    with pytest.raises(TransmitterError, match="closed"):
+        writer.handle_record({"time": 100})
+
+
+def test_stall_does_not_block_producer():
+    sink = FakeSink()
+    sink.gate.clear()
+    writer = BackgroundWriter(sink, max_queue=1000)
+    start = time.perf_counter()
+    for i in range(500):
+        writer.handle_record({"time": i})
+    assert time.perf_counter() - start < 0.5
+    assert writer.stats()["max_queue_depth"] >= 499
+    sink.gate.set()
+    writer.close()
+    assert len(sink.records) == 500
+    assert writer.stats()["max_write_ms"] > 0
+
+
+@pytest.mark.parametrize(
+    "overflow, expected",
+    [("drop_oldest", [0, 3, 4]), ("drop_newest", [0, 1, 2])],
+)
+def test_drop_policies(overflow, expected):
+    sink = FakeSink()
+    sink.gate.clear()
+    writer = BackgroundWriter(sink, max_queue=2, overflow=overflow)
+    writer.handle_record({"time": 0})
+    # Wait until the writer thread holds the first record, stalled in the sink
+    while writer.stats()["queue_depth"]:
+        time.sleep(0.001)
+    for i in range(1, 5):
+        writer.handle_record({"time": i})
+    assert writer.stats()["dropped"] == 2
+    sink.gate.set()
+    writer.close()
+    assert [record["time"] for record in sink.records] == expected
+
+
+def test_block_policy_waits_for_room():
+    sink = FakeSink()
+    sink.gate.clear()
+    writer = BackgroundWriter(sink, max_queue=1, overflow="block")
+    writer.handle_record({"time": 0})
+    while writer.stats()["queue_depth"]:
+        time.sleep(0.001)
+    writer.handle_record({"time": 1})
+
+    producer = threading.Thread(target=writer.handle_record, args=({"time": 2},))
+    producer.start()
+    producer.join(0.05)
+    assert producer.is_alive()
+    sink.gate.set()
+    producer.join(1)
+    assert not producer.is_alive()
+    writer.close()
+    assert [record["time"] for record in sink.records] == [0, 1, 2]
+    assert writer.stats()["dropped"] == 0
+
+
+def test_errors_reported_to_producer():
+    sink = FakeSink()
+    sink.fail = True
+    writer = BackgroundWriter(sink)
+    writer.handle_record({"time": 0})
+    while writer.stats()["errors"] == 0:
+        time.sleep(0.001)
+    with pytest.raises(TransmitterError, match="Disk full"):
+        writer.handle_record({"time": 1})
+    sink.fail = False
+    writer.close()
+    assert sink.records == [{"time": 1}]
+
+
+def test_sink_closed_by_writer_thread():
+    sink = FakeSink()
+    sink.gate.clear()
+    writer = BackgroundWriter(sink)
+    writer.handle_record({"time": 0})
+    # Still stalled after the timeout, the sink is left to the writer thread
+    writer.close(timeout=0.01)
+    assert not sink.closed
+    sink.gate.set()
+    writer._thread.join(1)
+    assert sink.records == [{"time": 0}]
+    assert sink.closed_by == "background-writer"
+
+
+def test_close_failure_reported():
+    class ReadOnlySink(FakeSink):
+        def close(self):
+            raise TransmitterError("Read-only")
+
+    writer = BackgroundWriter(ReadOnlySink())
+    with pytest.raises(TransmitterError, match="Read-only"):
+        writer.close()
+
+
+def test_invalid_settings():
+    with pytest.raises(ValueError, match="Queue size"):
+        BackgroundWriter(FakeSink(), max_queue=0)
+    with pytest.raises(ValueError, match="overflow"):
+        BackgroundWriter(FakeSink(), overflow="spill")
@@ -1,14 +1,19 @@
 import json
 import shutil
+import struct
 from unittest.mock import patch
 
 import pytest
 
 from configuration_generator import (
+    DEFAULT_PACKET_LAYOUT,
     Car,
     ConfigurationGenerator,
     ConfigurationGeneratorError,
+    DerivedField,
     Metadata,
+    PacketField,
+    PacketLayout,
     Sensor,
 )
 
@@ -73,6 +78,76 @@ class TestSensor:
             Sensor(name="temp", input_type="analog", unit="F", conversion_factor=None)
 
 
+class TestPacketLayout:
+    """Test PacketField and PacketLayout dataclasses"""
+
+    def test_default_layout(self):
+        assert DEFAULT_PACKET_LAYOUT.format == "<ffffBBBBBH"
+        assert DEFAULT_PACKET_LAYOUT.size == 23
+
+    def test_from_list(self):
+        layout = PacketLayout.from_list(
+            [
+                {"name": "speed", "type": "f", "round": 1},
+                {"name": "rpm", "type": "H", "scale": 10},
+                {"channel": "channelA0", "type": "I"},
+            ]
+        )
+        assert layout.format == "<fHI"
+        assert layout.fields[1] == PacketField(type="H", name="rpm", scale=10)
+        assert layout.pack({"speed": 1.5, "channelA0": 7}) == struct.pack(
+            "<fHI", 1.5, 0, 7
+        )
+
+    @pytest.mark.parametrize(
+        "fields",
+        [
+            [{"name": "speed", "type": "x"}],
+            [{"name": "speed", "channel": "channel0", "type": "f"}],
+            [{"type": "f"}],
+            [{"name": "speed", "type": "f"}, {"name": "speed", "type": "f"}],
+            [{"name": "airspeed", "type": "f"}],
+        ],
+    )
+    def test_invalid_layouts(self, fields):
+        with pytest.raises(ValueError):
+            PacketLayout.from_list(fields)
+
+
+class TestDerivedField:
+    """Test DerivedField dataclass"""
+
+    def test_from_dict(self):
+        derived = DerivedField.from_dict(
+            {
+                "name": "speed_avg",
+                "type": "rolling_mean",
+                "source": "speed",
+                "window": 5,
+            }
+        )
+        assert derived == DerivedField(
+            name="speed_avg", type="rolling_mean", sources=["speed"], window=5
+        )
+
+    def test_default_sources(self):
+        derived = DerivedField.from_dict({"name": "accel", "type": "acceleration"})
+        assert derived.sources == ["speed"]
+
+    @pytest.mark.parametrize(
+        "data",
+        [
+            {"name": "x", "type": "unknown"},
+            {"type": "acceleration"},
+            {"name": "x", "type": "rolling_mean"},
+            {"name": "x", "type": "acceleration", "window": 0},
+        ],
+    )
+    def test_invalid(self, data):
+        with pytest.raises(ValueError):
+            DerivedField.from_dict(data)
+
+
 class TestConfigurationGenerator:
     """Test ConfigurationGenerator class"""
 
@@ -126,6 +201,92 @@ class TestConfigurationGenerator:
         with pytest.raises(ConfigurationGeneratorError):
             config_gen.get_metadata()
 
+    def test_get_packet_layout(self, config_gen, tmp_path):
+        assert config_gen.get_packet_layout() == DEFAULT_PACKET_LAYOUT
+        with pytest.raises(ConfigurationGeneratorError):
+            config_gen.get_packet_layout("nonexistent_car")
+
+        config = json.load(open("test/testfiles/car_config.json"))
+        config["cars"]["car2"]["packet_layout"] = [
+            {"name": "speed", "type": "f", "round": 2},
+            {"channel": "channelA0", "type": "H"},
+            {"channel": "channelA1", "type": "H"},
+        ]
+        path = tmp_path / "layout_config.json"
+        path.write_text(json.dumps(config))
+        layout = ConfigurationGenerator(str(path)).get_packet_layout("car2")
+        assert layout.format == "<fHH"
+
+    def test_get_derived(self, config_gen, tmp_path):
+        assert config_gen.get_derived() == []
+        with pytest.raises(ConfigurationGeneratorError):
+            config_gen.get_derived("nonexistent_car")
+
+        config = json.load(open("test/testfiles/car_config.json"))
+        config["cars"]["car2"]["derived"] = [
+            {"name": "accel", "type": "acceleration"},
+            {"name": "accel_avg", "type": "rolling_mean", "source": "accel"},
+        ]
+        path = tmp_path / "derived_config.json"
+        path.write_text(json.dumps(config))
+        derived = ConfigurationGenerator(str(path)).get_derived("car2")
+        assert [d.name for d in derived] == ["accel", "accel_avg"]
+
+    def test_get_limits(self, config_gen, tmp_path):
+        # Sensors without limits are left out
+        assert config_gen.get_limits() == {"voltage": (0.0, 36.0)}
+        with pytest.raises(ConfigurationGeneratorError):
+            config_gen.get_limits("nonexistent_car")
+
+        config = json.load(open("test/testfiles/car_config.json"))
+        config["cars"]["car1"]["limits"] = {
+            "engine_temp": {"max": 220},
+            "voltage": {"min": 10, "max": 30},
+        }
+        path = tmp_path / "limits_config.json"
+        path.write_text(json.dumps(config))
+        assert ConfigurationGenerator(str(path)).get_limits("car1") == {
+            "voltage": (10, 30),
+            "engine_temp": (None, 220),
+        }
+
+    def test_get_car_name(self, config_gen):
+        assert config_gen.get_car_name() == "car1"
+        assert config_gen.get_car_name("car2") == "car2"
+        with pytest.raises(ConfigurationGeneratorError):
+            config_gen.get_car_name("nonexistent_car")
+
+    def test_get_config_hash(self, config_gen, tmp_path):
+        config_hash = config_gen.get_config_hash()
+        assert len(config_hash) == 64
+        assert config_gen.get_config_hash("car2") != config_hash
+
+        # Only a change to the car itself changes its hash
+        config = json.load(open("test/testfiles/car_config.json"))
+        config["cars"]["car2"]["active"] = True
+        path = tmp_path / "hash_config.json"
+        path.write_text(json.dumps(config, indent=2))
+        assert ConfigurationGenerator(str(path)).get_config_hash("car1") == config_hash
+        config["cars"]["car1"]["metadata"]["weight"] = 210
+        path.write_text(json.dumps(config))
+        assert ConfigurationGenerator(str(path)).get_config_hash("car1") != config_hash
+
+    def test_invalid_derived(self, tmp_path):
+        config = json.load(open("test/testfiles/car_config.json"))
+        config["cars"]["car2"]["derived"] = [{"name": "x", "type": "magic"}]
+        path = tmp_path / "derived_config.json"
+        path.write_text(json.dumps(config))
+        with pytest.raises(ConfigurationGeneratorError, match="derived channel"):
+            ConfigurationGenerator(str(path))
+
+    def test_invalid_packet_layout(self, tmp_path):
+        config = json.load(open("test/testfiles/car_config.json"))
+        config["cars"]["car2"]["packet_layout"] = [{"name": "speed", "type": "z"}]
+        path = tmp_path / "layout_config.json"
+        path.write_text(json.dumps(config))
+        with pytest.raises(ConfigurationGeneratorError, match="packet layout"):
+            ConfigurationGenerator(str(path))
+
     @pytest.fixture
     def tmp_config_gen(self, tmp_path):
         tmp_config = tmp_path / "car_config.json"
@@ -133,6 +294,8 @@ class TestConfigurationGenerator:
         return ConfigurationGenerator(str(tmp_config))
 
     def test_update_config_success(self, tmp_config_gen):
+        updates = []
+        tmp_config_gen.add_update_callback(lambda: updates.append(True))
         tmp_config_gen.update_config(
             json.dumps(
                 {
@@ -160,10 +323,17 @@ class TestConfigurationGenerator:
         assert (
             car3.name == "car3" and car3.active is True and "channelA1" in car3.sensors
         )
+        # The updated configuration is the current one, and the callbacks were told
+        assert tmp_config_gen.get_car_name() == "car3"
+        assert "channelA1" in tmp_config_gen.get_sensors()
+        assert updates == [True]
 
     def test_update_config_invalid_json(self, tmp_config_gen):
+        updates = []
+        tmp_config_gen.add_update_callback(lambda: updates.append(True))
         with pytest.raises(ConfigurationGeneratorError):
             tmp_config_gen.update_config("invalid_json")
+        assert updates == []
 
     def test_update_config_os_error(self, tmp_config_gen):
         with patch("builtins.open", side_effect=OSError("disk full")):
@@ -1,9 +1,9 @@
 import struct
-from unittest.mock import Mock, patch
+from unittest.mock import patch
 
 import pytest
 
-from configuration_generator import Sensor
+from configuration_generator import DerivedField, PacketLayout, Sensor
 from data_reader import DataReader
 
 
@@ -57,8 +57,7 @@ def test_initialization(mock_config):
     """Test DataReader initialization"""
     reader = DataReader(mock_config)
     assert reader._sensors == mock_config
-    assert reader._distance_traveled == 0
-    assert reader._last_update == 0
+    assert reader.distance_traveled == 0
     assert reader._packet_size == struct.calcsize("<ffffBBBBBH")
 
 
@@ -125,81 +124,84 @@ def test_parse_sensor_data_unknown_channel():
     assert "unknown" not in result
 
 
-@patch("data_reader.datetime")
-def test_distance_calculation(mock_datetime, data_reader, sample_raw_data):
+def test_distance_calculation(data_reader, sample_raw_data):
     """Test distance calculation over multiple reads"""
-    # First call - no distance calculated
-    mock_dt1 = Mock()
-    mock_dt1.timestamp.return_value = 1000.0
-    mock_datetime.datetime.now.return_value = mock_dt1
-
-    result1 = data_reader.parse_sensor_data(sample_raw_data)
+    # First read - no distance calculated
+    result1 = data_reader.parse_sensor_data(sample_raw_data, 1_000_000_000)
     assert result1["distance_traveled"] == 0
-    assert result1["time"] == 1000000
-    assert data_reader._last_update == 1000000
-
-    # Second call - distance calculated
-    mock_dt2 = Mock()
-    mock_dt2.timestamp.return_value = 1001.0
-    mock_datetime.datetime.now.return_value = mock_dt2
-
-    result2 = data_reader.parse_sensor_data(sample_raw_data)
-    expected_distance = 25.5 * 0.00146667 * 1000
-    assert result2["distance_traveled"] == pytest.approx(expected_distance, rel=0.01)
-    assert data_reader._last_update == 1001000
-
-
-@patch("data_reader.datetime")
-def test_distance_reset_on_overflow(mock_datetime, data_reader, sample_raw_data):
-    """Test that distance resets when exceeding threshold"""
-    data_reader._distance_traveled = 100000001
+    assert result1["time"] == data_reader._clock.to_wall_ms(1_000_000_000)
+
+    # Second read one second later, 25.5 mph is 37.4 ft/s
+    result2 = data_reader.parse_sensor_data(sample_raw_data, 2_000_000_000)
+    assert result2["distance_traveled"] == pytest.approx(25.5 * 5280 / 3600, abs=0.01)
+    assert result2["time"] - result1["time"] == pytest.approx(1000, abs=0.001)
+
+
+def test_distance_trapezoidal(data_reader):
+    """Distance is integrated with the average speed between samples"""
+    slow = struct.pack("<ffffBBBBBH", 10.0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+    fast = struct.pack("<ffffBBBBBH", 20.0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+    data_reader.parse_sensor_data(slow, 0)
+    result = data_reader.parse_sensor_data(fast, 1_000_000_000)
+    assert result["distance_traveled"] == pytest.approx(15 * 5280 / 3600, abs=0.01)
+
+
+def test_distance_ignores_implausible_speed(data_reader, sample_raw_data):
+    """Corrupted speeds and long gaps do not add distance"""
+    data_reader.parse_sensor_data(sample_raw_data, 1_000_000_000)
+    for speed in (float("nan"), -10.0, 5000.0):
+        bad = struct.pack("<ffffBBBBBH", speed, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+        assert (
+            data_reader.parse_sensor_data(bad, 1_100_000_000)["distance_traveled"] == 0
+        )
+
+    # Serial link down for a minute
+    result = data_reader.parse_sensor_data(sample_raw_data, 61_000_000_000)
+    assert result["distance_traveled"] == 0
 
-    mock_dt = Mock()
-    mock_dt.timestamp.return_value = 1000.0
-    mock_datetime.datetime.now.return_value = mock_dt
 
-    result = data_reader.parse_sensor_data(sample_raw_data)
-    assert result["distance_traveled"] == 0
+def test_distance_has_no_overflow_reset(data_reader, sample_raw_data):
+    """Large distances keep accumulating"""
+    data_reader._odometer.distance = 100000001
+    data_reader.parse_sensor_data(sample_raw_data, 1_000_000_000)
+    result = data_reader.parse_sensor_data(sample_raw_data, 1_100_000_000)
+    assert result["distance_traveled"] > 100000001
 
 
-def test_reset_distance(data_reader):
+def test_reset_distance(data_reader, sample_raw_data):
     """Test manual distance reset"""
-    data_reader._distance_traveled = 1234.5
-    data_reader._last_update = 5678
+    data_reader.parse_sensor_data(sample_raw_data, 1_000_000_000)
+    data_reader.parse_sensor_data(sample_raw_data, 1_100_000_000)
+    assert data_reader.distance_traveled > 0
 
     data_reader.reset_distance()
 
-    assert data_reader._distance_traveled == 0
-    assert data_reader._last_update == 0
+    assert data_reader.distance_traveled == 0
 
 
-@patch("data_reader.datetime")
-def test_reset_distance_between_reads(mock_datetime, data_reader, sample_raw_data):
+def test_reset_distance_between_reads(data_reader, sample_raw_data):
     """Test that reset works correctly between reads"""
-    # First read
-    mock_dt1 = Mock()
-    mock_dt1.timestamp.return_value = 1000.0
-    mock_datetime.datetime.now.return_value = mock_dt1
-    data_reader.parse_sensor_data(sample_raw_data)
-
-    # Second read - accumulate distance
-    mock_dt2 = Mock()
-    mock_dt2.timestamp.return_value = 1001.0
-    mock_datetime.datetime.now.return_value = mock_dt2
-    result1 = data_reader.parse_sensor_data(sample_raw_data)
+    data_reader.parse_sensor_data(sample_raw_data, 1_000_000_000)
+    result1 = data_reader.parse_sensor_data(sample_raw_data, 1_500_000_000)
     assert result1["distance_traveled"] > 0
 
-    # Reset
     data_reader.reset_distance()
 
-    # Third read - distance should be 0
-    mock_dt3 = Mock()
-    mock_dt3.timestamp.return_value = 1002.0
-    mock_datetime.datetime.now.return_value = mock_dt3
-    result2 = data_reader.parse_sensor_data(sample_raw_data)
+    # The first read after a reset starts integrating again
+    result2 = data_reader.parse_sensor_data(sample_raw_data, 2_000_000_000)
     assert result2["distance_traveled"] == 0
 
 
+def test_parse_packets_spreads_timestamps(data_reader, sample_raw_data):
+    """Packets read together are stamped evenly since the previous packet"""
+    with patch.object(data_reader._clock, "spread", return_value=[10, 20, 30]):
+        results = data_reader.parse_packets([sample_raw_data] * 3)
+    assert [r["time"] for r in results] == [
+        data_reader._clock.to_wall_ms(stamp) for stamp in (10, 20, 30)
+    ]
+    assert data_reader.parse_packets([]) == []
+
+
 def test_edge_cases(data_reader):
     """Test edge cases: zero speed, negative speed, max values"""
     # Zero speed
@@ -238,3 +240,138 @@ def test_conversion_factor_zero():
 
     result = reader.parse_sensor_data(raw_data)
     assert result["zero_factor"] == 1.0  # Conversion factor set to 1.0 when 0.0
+
+
+def test_parse_many(data_reader, sample_raw_data):
+    """Test decoding a contiguous buffer matches decoding packet by packet"""
+    other = struct.pack("<ffffBBBBBH", 12.0, 13.0, 14.0, 15.0, 0, 1, 0, 1, 0, 20)
+    results = data_reader.parse_many(sample_raw_data + other + sample_raw_data)
+
+    assert len(results) == 3
+    single = DataReader(data_reader._sensors).parse_sensor_data(other)
+    for key in ["speed", "voltage", "current", "analog_sensor"]:
+        assert results[1][key] == single[key]
+    assert results[0]["time"] <= results[1]["time"] <= results[2]["time"]
+    assert list(results[0]) == list(single)
+
+
+def test_parse_many_invalid_size(data_reader, sample_raw_data):
+    """Test that a buffer with a partial packet is rejected"""
+    with pytest.raises(ValueError, match="Invalid data size"):
+        data_reader.parse_many(sample_raw_data + b"\x00")
+
+
+def test_update_sensors_recompiles(data_reader, sample_raw_data):
+    """Test that a configuration change takes effect on the next packet"""
+    data_reader.update_sensors(
+        {
+            "channelA0": Sensor(
+                name="pressure", unit="psi", conversion_factor=2, input_type="analog"
+            )
+        }
+    )
+    result = data_reader.parse_sensor_data(sample_raw_data)
+    assert result["pressure"] == 2000
+    assert "voltage" not in result
+
+
+def test_conversion_factor_not_mutated():
+    """Test that compiling the decode plan leaves the configuration untouched"""
+    sensor = Sensor(
+        name="button", unit=None, conversion_factor=None, input_type="digital"
+    )
+    reader = DataReader({"channel2": sensor})
+    raw_data = struct.pack("<ffffBBBBBH", 0.0, 0.0, 0.0, 0.0, 0, 0, 1, 0, 0, 0)
+
+    assert reader.parse_sensor_data(raw_data)["button"] == 1.0
+    assert sensor.conversion_factor is None
+
+
+def test_custom_packet_layout():
+    """Test decoding a config-defined packet layout with wider channels"""
+    layout = PacketLayout.from_list(
+        [
+            {"name": "speed", "type": "f", "round": 1},
+            {"name": "rpm", "type": "H", "scale": 10},
+            {"channel": "channelA0", "type": "I"},
+            {"channel": "channelA1", "type": "h"},
+            {"channel": "channel0", "type": "b"},
+        ]
+    )
+    sensors = {
+        "channelA1": Sensor(
+            name="current", unit="A", conversion_factor=0.5, input_type="analog"
+        ),
+        "channelA0": Sensor(
+            name="pressure", unit="psi", conversion_factor=0.25, input_type="analog"
+        ),
+        "channel0": Sensor(
+            name="trim", unit="", conversion_factor=2, input_type="digital"
+        ),
+    }
+    reader = DataReader(sensors, layout)
+    raw_data = struct.pack(layout.format, 12.345, 250, 100000, -40, -3)
+
+    result = reader.parse_sensor_data(raw_data)
+    assert reader._packet_size == layout.size
+    assert list(result) == reader.fields
+    assert reader.fields[:5] == ["speed", "rpm", "current", "pressure", "trim"]
+    assert result["speed"] == 12.3
+    assert result["rpm"] == 2500
+    assert result["pressure"] == 25000.0
+    assert result["current"] == -20.0
+    assert result["trim"] == -6
+
+
+def test_records_share_schema(data_reader, sample_raw_data):
+    """Records are fixed-schema objects that convert to a dict at the edges"""
+    first = data_reader.parse_sensor_data(sample_raw_data)
+    second = data_reader.parse_sensor_data(sample_raw_data)
+    assert first.schema is second.schema is data_reader.schema
+    assert list(first.to_dict()) == data_reader.fields
+
+
+def test_derived_channels(mock_config):
+    """Derived channels are computed once and added to every record"""
+    reader = DataReader(
+        mock_config,
+        derived=[
+            DerivedField(name="acceleration", type="acceleration"),
+            DerivedField(name="speed_avg", type="rolling_mean", sources=["speed"]),
+        ],
+    )
+    assert reader.fields[-2:] == ["acceleration", "speed_avg"]
+    slow = struct.pack("<ffffBBBBBH", 10.0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+    fast = struct.pack("<ffffBBBBBH", 20.0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+    reader.parse_sensor_data(slow, 1_000_000_000)
+    result = reader.parse_sensor_data(fast, 1_500_000_000)
+    assert result["acceleration"] == pytest.approx(20.0, rel=1e-3)
+    assert result["speed_avg"] == 15.0
+
+    with pytest.raises(ValueError, match="Unknown source"):
+        reader.update_sensors(
+            mock_config,
+            derived=[DerivedField(name="x", type="rolling_mean", sources=["rpm"])],
+        )
+
+
+def test_failed_update_keeps_configuration(data_reader, sample_raw_data):
+    """A rejected configuration leaves the previous one decoding packets"""
+    fields = data_reader.fields
+    with pytest.raises(ValueError, match="Unknown source"):
+        data_reader.update_sensors(
+            {
+                "channelA0": Sensor(
+                    name="pressure",
+                    unit="psi",
+                    conversion_factor=2,
+                    input_type="analog",
+                )
+            },
+            layout=PacketLayout.from_list([{"type": "f", "name": "speed"}]),
+            derived=[DerivedField(name="x", type="rolling_mean", sources=["rpm"])],
+        )
+    assert data_reader.fields == fields
+    result = data_reader.parse_sensor_data(sample_raw_data)
+    assert list(result.keys()) == fields
+    assert len(data_reader.parse_many(sample_raw_data * 2)) == 2
@@ -1,4 +1,8 @@
 import csv
+import json
+import threading
+import time
+from collections import deque
 from pathlib import Path
 from unittest.mock import MagicMock, patch
 
@@ -6,7 +10,21 @@ import freezegun
 import paho.mqtt.client as mqtt
 import pytest
 
-from data_transmitter import LocalTransmitter, RemoteTransmitter, TransmitterError
+from data_transmitter import (
+    LocalTransmitter,
+    RemoteTransmitter,
+    TransmitterError,
+    check_csv_row,
+)
+from remote_outbox import Outbox
+from telemetry_batch import (
+    batch_sequence,
+    decode_batch,
+    dictionary_id,
+    encode_dictionary,
+)
+from telemetry_record import RecordSchema, TelemetryRecord
+from uplink_controller import UplinkController
 
 DATA_RECORD = {
     "speed": 30.0,
@@ -25,28 +43,127 @@ class TestLocalTransmitter:
     """Tests for the LocalTransmitter class"""
 
     @pytest.fixture
-    def loc_transmitter(self, tmp_path, mock_config_generator):
-        return LocalTransmitter(
-            car_sensors=mock_config_generator.get_sensors(), data_dir=str(tmp_path)
-        )
+    def loc_transmitter(self, tmp_path):
+        return LocalTransmitter(fields=list(DATA_RECORD), data_dir=str(tmp_path))
 
     def test_initialization_creates_file(self, loc_transmitter, tmp_path):
         expected_file = tmp_path / "2024-01-01_12-00-00_car_data.csv"
         assert expected_file.exists()
         assert Path(loc_transmitter._data_file_name) == expected_file
 
+    def read_rows(self, transmitter):
+        with open(transmitter._data_file_name) as f:
+            return [row for row in csv.reader(f) if row]
+
     def test_handle_record_success(self, loc_transmitter):
         loc_transmitter.handle_record(DATA_RECORD)
-        with open(loc_transmitter._data_file_name) as f:
-            rows = [row for row in csv.reader(f) if row]
+        # Rows are buffered until a flush
+        assert len(self.read_rows(loc_transmitter)) == 1
+        loc_transmitter.flush()
+        rows = self.read_rows(loc_transmitter)
 
         assert len(rows) == 2
-        assert rows[1] == ["30.0", "5.0", "80.0", "70.0", "1", "12.5", "100.0", "10.0"]
+        assert rows[1][:-1] == [
+            "30.0",
+            "5.0",
+            "80.0",
+            "70.0",
+            "1",
+            "12.5",
+            "100.0",
+            "10.0",
+        ]
+        with open(loc_transmitter._data_file_name, "rb") as f:
+            row = f.readlines()[1]
+        assert check_csv_row(row)
+        assert not check_csv_row(row.replace(b"30.0", b"31.0"))
+        assert not check_csv_row(b"30.0\r\n")
+
+    def test_flush_thresholds(self, tmp_path):
+        transmitter = LocalTransmitter(
+            fields=list(DATA_RECORD),
+            data_dir=str(tmp_path),
+            flush_interval=1.0,
+            flush_bytes=60,
+        )
+        with patch("data_transmitter.os.fsync") as mock_fsync:
+            transmitter.handle_record(DATA_RECORD)
+            assert mock_fsync.call_count == 0
+            # The byte threshold is crossed by the second row
+            transmitter.handle_record(DATA_RECORD)
+            assert mock_fsync.call_count == 1
+            assert len(self.read_rows(transmitter)) == 3
+
+            # The time threshold flushes an old row even without new records
+            transmitter.handle_record(DATA_RECORD)
+            transmitter.flush_if_due()
+            assert mock_fsync.call_count == 1
+            with freezegun.freeze_time("2024-01-01 12:00:02"):
+                transmitter.flush_if_due()
+            assert mock_fsync.call_count == 2
+
+            transmitter.flush_if_due()
+            transmitter.flush()
+            assert mock_fsync.call_count == 2
+
+    def test_close_flushes(self, loc_transmitter):
+        loc_transmitter.handle_record(DATA_RECORD)
+        loc_transmitter.close()
+        assert len(self.read_rows(loc_transmitter)) == 2
+        assert loc_transmitter._file.closed
+
+    def test_header_follows_record_fields(self, tmp_path):
+        transmitter = LocalTransmitter(
+            fields=[*DATA_RECORD, "acceleration"], data_dir=str(tmp_path)
+        )
+        with open(transmitter._data_file_name) as f:
+            header = next(csv.reader(f))
+        assert header == [*DATA_RECORD, "acceleration", "crc32"]
+
+    def test_rotation_by_size(self, tmp_path):
+        archiver = MagicMock()
+        transmitter = LocalTransmitter(
+            fields=list(DATA_RECORD),
+            data_dir=str(tmp_path),
+            flush_bytes=1,
+            rotate_bytes=60,
+            archiver=archiver,
+        )
+        archiver.begin_session.assert_called_once_with("2024-01-01_12-00-00")
+        first = transmitter.path
+        for _ in range(3):
+            transmitter.handle_record(DATA_RECORD)
+        transmitter.close()
+
+        # The flush crossing the limit closes the segment, the next one gets a header
+        assert transmitter.path == str(tmp_path / "2024-01-01_12-00-00_car_data.1.csv")
+        archiver.submit.assert_called_once_with(first)
+        rows = self.read_rows(transmitter)
+        assert rows[0][0] == "speed"
+        assert len(rows) == 2
+        with open(first) as f:
+            assert len(list(csv.reader(f))) == 3
+
+    def test_rotation_by_time(self, tmp_path):
+        transmitter = LocalTransmitter(
+            fields=list(DATA_RECORD),
+            data_dir=str(tmp_path),
+            rotate_seconds=60,
+        )
+        transmitter.handle_record(DATA_RECORD)
+        transmitter.flush()
+        assert transmitter.path.endswith("_car_data.csv")
+        with freezegun.freeze_time("2024-01-01 12:01:01"):
+            transmitter.handle_record(DATA_RECORD)
+            transmitter.flush()
+        assert transmitter.path.endswith("_car_data.1.csv")
+        transmitter.close()
 
     def test_handle_record_errors(self, loc_transmitter):
-        with patch("builtins.open", side_effect=OSError("Disk full")):
+        loc_transmitter.handle_record(DATA_RECORD)
+        with patch("data_transmitter.os.fsync", side_effect=OSError("Disk full")):
             with pytest.raises(TransmitterError, match="Disk full"):
-                loc_transmitter.handle_record(DATA_RECORD)
+                loc_transmitter.flush()
         with pytest.raises(TransmitterError, match="Invalid data being written"):
             loc_transmitter.handle_record(0)
 
@@ -89,6 +206,96 @@ class TestRemoteTransmitter:
             with pytest.raises(TransmitterError, match="Topic or QoS is invalid"):
                 remote_transmitter.handle_record({"speed": 30.0})
 
+    def test_batches_records(
+        self, default_env, mock_config_generator, mock_mqtt_client
+    ):
+        schema = RecordSchema(("speed", "time"))
+        with freezegun.freeze_time("2024-01-01 12:00:00") as frozen:
+            remote = RemoteTransmitter(
+                config_gen=mock_config_generator,
+                batch_size=3,
+                batch_interval=1.0,
+                config_hash="abc",
+            )
+            publish = remote._client.publish
+            dictionary = dictionary_id(schema.fields, "abc")
+            for i in range(4):
+                remote.handle_record(TelemetryRecord(schema, [10.0 + i, 1000.0 + i]))
+
+            # The field dictionary, retained, then one message for the first three records
+            assert publish.call_count == 2
+            publish.assert_any_call(
+                f"cars/user/data/batch/fields/{dictionary}",
+                encode_dictionary(schema.fields, "abc"),
+                qos=1,
+                retain=True,
+            )
+            topic, payload = publish.call_args.args
+            assert topic == "cars/user/data/batch"
+            _, columns = decode_batch(payload, {dictionary: schema.fields})
+            assert columns == {
+                "speed": [10.0, 11.0, 12.0],
+                "time": [1000.0, 1001.0, 1002.0],
+            }
+
+            # The last record goes out once it is batch_interval old
+            remote.flush_if_due()
+            assert publish.call_count == 2
+            frozen.tick(1)
+            remote.flush_if_due()
+            _, columns = decode_batch(
+                publish.call_args.args[1], {dictionary: schema.fields}
+            )
+            assert columns["speed"] == [13.0]
+
+    def test_batch_fields_change(
+        self, default_env, mock_config_generator, mock_mqtt_client
+    ):
+        remote = RemoteTransmitter(config_gen=mock_config_generator, batch_size=10)
+        publish = remote._client.publish
+        remote.handle_record({"speed": 1.0})
+        remote.handle_record({"speed": 2.0, "time": 1000.0})
+
+        # The first batch is sent before the new dictionary
+        topics = [call.args[0] for call in publish.call_args_list]
+        assert topics == [
+            f"cars/user/data/batch/fields/{dictionary_id(('speed',))}",
+            "cars/user/data/batch",
+            f"cars/user/data/batch/fields/{dictionary_id(('speed', 'time'))}",
+        ]
+        # The dictionary is published again after a reconnect
+        publish.reset_mock()
+        remote._on_connect(remote._client, None, None, 0)
+        assert publish.call_args.args[0] == topics[-1]
+
+    def test_batch_errors(self, default_env, mock_config_generator, mock_mqtt_client):
+        remote = RemoteTransmitter(config_gen=mock_config_generator, batch_size=2)
+        remote.handle_record({"speed": 1.0})
+        with pytest.raises(TransmitterError, match="Invalid data dropped"):
+            remote.handle_record({"speed": None})
+        remote._client.publish.return_value.rc = mqtt.MQTT_ERR_NO_CONN
+        remote.handle_record({"speed": 1.0})
+        with pytest.raises(TransmitterError, match="Failed to publish batch"):
+            remote.handle_record({"speed": 2.0})
+        # Failed batches are dropped
+        remote.flush()
+        assert remote._client.publish.call_count == 2
+
+    def test_handle_alarm(self, remote_transmitter):
+        event = {"field": "engine_temp", "state": "high", "value": 210.0}
+        with patch.object(remote_transmitter._client, "publish") as mock_publish:
+            mock_publish.return_value.rc = mqtt.MQTT_ERR_SUCCESS
+            remote_transmitter.handle_alarm(event)
+            mock_publish.assert_called_once_with(
+                "cars/user/data/alarms", json.dumps(event), qos=1
+            )
+            # Kept by the client until it reconnects
+            mock_publish.return_value.rc = mqtt.MQTT_ERR_NO_CONN
+            remote_transmitter.handle_alarm(event)
+            mock_publish.return_value.rc = mqtt.MQTT_ERR_QUEUE_SIZE
+            with pytest.raises(TransmitterError, match="Failed to publish alarm"):
+                remote_transmitter.handle_alarm(event)
+
     def test_receive_message(self, remote_transmitter, mock_config_generator):
         correct_msg = MagicMock(topic="cars/user/config", payload=b'{"new": "config"}')
         wrong_msg = MagicMock(topic="wrong/topic", payload=b'{"new": "config"}')
@@ -108,3 +315,300 @@ class TestRemoteTransmitter:
         with patch.object(remote_transmitter._client, "disconnect") as mock_disconnect:
             remote_transmitter.disconnect()
             mock_disconnect.assert_called_once()
+
+
+class FakeMQTTClient:
+    """Stand-in for the paho client, the test connects, drops and acknowledges"""
+
+    def __init__(self, *args, **kwargs):
+        self.connected = False
+        self.auto_ack = False
+        self.published = []
+        # Set to an Event to hold the publishes of the backfill thread until it is set
+        self.backfill_gate = None
+        self._mid = 0
+        self._lock = threading.Lock()
+
+    def username_pw_set(self, *args):
+        pass
+
+    def tls_set(self, *args, **kwargs):
+        pass
+
+    def reconnect_delay_set(self, *args, **kwargs):
+        pass
+
+    def connect_async(self, *args):
+        pass
+
+    def loop_start(self):
+        pass
+
+    def subscribe(self, topic):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        gate = self.backfill_gate
+        if gate is not None and threading.current_thread().name == "remote-backfill":
+            gate.wait(2.0)
+        with self._lock:
+            self._mid += 1
+            info = MagicMock(mid=self._mid)
+            self.published.append((self._mid, topic, payload))
+        info.rc = mqtt.MQTT_ERR_SUCCESS if self.connected else mqtt.MQTT_ERR_NO_CONN
+        info.is_published.return_value = False
+        if self.auto_ack:
+            # The acknowledgement may arrive before publish returns
+            self.on_publish(self, None, info.mid, 0, None)
+        return info
+
+    def batches(self):
+        with self._lock:
+            return [
+                (mid, batch_sequence(payload))
+                for mid, topic, payload in self.published
+                if topic == "cars/user/data/batch"
+            ]
+
+    def connect(self):
+        self.connected = True
+        self.on_connect(self, None, None, 0)
+
+    def drop(self):
+        self.connected = False
+        self.on_disconnect(self, None, None, 0)
+
+    def ack(self, mid):
+        self.on_publish(self, None, mid, 0, None)
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+class TestRemoteOutbox:
+    """Store-and-forward of the remote batches, against a fake MQTT client"""
+
+    @pytest.fixture
+    def client(self):
+        with patch("paho.mqtt.client.Client", FakeMQTTClient):
+            yield
+
+    @pytest.fixture
+    def make_remote(self, default_env, client, mock_config_generator, tmp_path):
+        remotes = []
+
+        def make_remote(**kwargs):
+            outbox = Outbox(str(tmp_path / "outbox.db"))
+            remote = RemoteTransmitter(
+                config_gen=mock_config_generator,
+                batch_size=2,
+                outbox=outbox,
+                backfill_rate=1000,
+                max_in_flight=2,
+                **kwargs,
+            )
+            remotes.append((remote, outbox))
+            return remote, remote._client, outbox
+
+        yield make_remote
+        for remote, outbox in remotes:
+            remote.disconnect()
+            outbox.close()
+
+    def send(self, remote, count):
+        for i in range(count):
+            remote.handle_record({"speed": float(i), "time": 1000.0 + i})
+
+    def test_backfill_after_reconnect(self, make_remote):
+        remote, client, outbox = make_remote()
+        # Out of range, the batches wait in the outbox
+        self.send(remote, 6)
+        assert client.batches() == []
+        assert outbox.stats()["pending"] == 3
+
+        # Resent in order once connected, at most max_in_flight at a time
+        client.connect()
+        wait_until(lambda: len(client.batches()) == 2)
+        time.sleep(0.02)
+        assert [sequence for _, sequence in client.batches()] == [1, 2]
+        assert remote.outbox_stats()["in_flight"] == 2
+
+        # Live batches go out right away, ahead of the backfill
+        self.send(remote, 2)
+        assert client.batches()[-1][1] == 4
+
+        for mid, _ in client.batches():
+            client.ack(mid)
+        wait_until(lambda: len(client.batches()) == 4)
+        client.ack(client.batches()[-1][0])
+        assert [sequence for _, sequence in client.batches()] == [1, 2, 4, 3]
+        # The acknowledgement may come before the backfill thread tracks the batch
+        wait_until(lambda: outbox.stats()["pending"] == 0)
+        assert remote.outbox_stats() == {
+            "pending": 0,
+            "bytes": 0,
+            "dropped": 0,
+            "in_flight": 0,
+        }
+
+    def test_kept_across_restarts(self, make_remote):
+        remote, client, outbox = make_remote()
+        client.connect()
+        self.send(remote, 4)
+        client.ack(client.batches()[0][0])
+        remote.disconnect()
+        outbox.close()
+
+        # The unacknowledged batch is resent by the next run, with its sequence number
+        remote, client, outbox = make_remote()
+        assert outbox.stats()["pending"] == 1
+        client.connect()
+        wait_until(lambda: len(client.batches()) == 1)
+        assert client.batches()[0][1] == 2
+        self.send(remote, 2)
+        wait_until(lambda: len(client.batches()) == 2)
+        assert client.batches()[-1][1] == 3
+
+    def test_early_acknowledgement(self, make_remote):
+        remote, client, outbox = make_remote()
+        client.auto_ack = True
+        client.connect()
+        self.send(remote, 4)
+        # The backfill may have claimed a batch first and still be publishing it
+        wait_until(lambda: outbox.stats()["pending"] == 0)
+        assert remote.outbox_stats()["in_flight"] == 0
+
+    def test_in_flight_kept_by_client_after_drop(self, make_remote):
+        remote, client, outbox = make_remote()
+        client.connect()
+        self.send(remote, 2)
+        client.drop()
+        self.send(remote, 2)
+        assert len(client.batches()) == 1
+
+        # The client resends the batch in flight itself, only the stored one is backfilled
+        client.connect()
+        wait_until(lambda: len(client.batches()) == 2)
+        time.sleep(0.02)
+        assert [sequence for _, sequence in client.batches()] == [1, 2]
+        for mid, _ in client.batches():
+            client.ack(mid)
+        assert outbox.stats()["pending"] == 0
+
+    def test_batch_published_once(self, make_remote):
+        remote, client, outbox = make_remote()
+        self.send(remote, 2)
+        client.backfill_gate = threading.Event()
+        client.connect()
+        # The backfill has claimed the batch and is publishing it
+        wait_until(lambda: 1 in remote._claimed)
+        sequence, topic, payload = outbox.peek()
+
+        # A live flush reaching the same batch leaves it to the backfill
+        assert remote._publish_stored(sequence, topic, payload)
+        client.backfill_gate.set()
+        wait_until(lambda: remote.outbox_stats()["in_flight"] == 1)
+        time.sleep(0.02)
+        assert [sequence for _, sequence in client.batches()] == [1]
+
+        client.ack(client.batches()[0][0])
+        assert outbox.stats()["pending"] == 0
+        assert remote._claimed == set()
+
+    def test_controller_times_sent_batches(self, make_remote):
+        controller = UplinkController(initial_rate=100.0, update_interval=1000)
+        remote, client, outbox = make_remote(controller=controller)
+        client.connect()
+        # The link is gone but the drop is not noticed yet, the client keeps the batch
+        client.connected = False
+        remote.handle_record({"speed": 1.0, "time": 1000.0})
+        remote.flush()
+        # Published by the flush or the backfill, whichever claimed it
+        wait_until(lambda: remote.outbox_stats()["in_flight"] == 1)
+        assert controller.stats()["in_flight"] == 0
+
+        # Acknowledged after the reconnect, with the field dictionary, not timed
+        client.connected = True
+        for mid, _, _ in client.published:
+            client.ack(mid)
+        wait_until(lambda: outbox.stats()["pending"] == 0)
+        assert controller._unmatched == deque()
+
+        time.sleep(0.02)
+        remote.handle_record({"speed": 2.0, "time": 1020.0})
+        remote.flush()
+        wait_until(lambda: controller.stats()["in_flight"] == 1)
+        client.ack(client.batches()[-1][0])
+        wait_until(lambda: outbox.stats()["pending"] == 0)
+        assert controller.stats()["in_flight"] == 0
+        assert controller._unmatched == deque()
+
+    def test_alarm_stored_until_acknowledged(self, make_remote):
+        remote, client, outbox = make_remote()
+        # Two batches recorded out of range, then an alarm
+        self.send(remote, 4)
+        event = {"field": "engine_temp", "state": "high", "value": 210.0}
+        remote.handle_alarm(event)
+        assert outbox.stats()["pending"] == 3
+
+        # The alarm is resent ahead of the batches, numbered like them
+        client.connect()
+        wait_until(lambda: len(client.batches()) == 1)
+        stored = [
+            (mid, topic, payload)
+            for mid, topic, payload in client.published
+            if "/fields/" not in topic
+        ]
+        mid, topic, payload = stored[0]
+        assert topic == "cars/user/data/alarms"
+        assert json.loads(payload) == {"sequence": 3, **event}
+        client.ack(mid)
+        wait_until(lambda: outbox.stats()["pending"] == 2)
+        assert outbox.peek(topic="cars/user/data/alarms") is None
+
+    def test_outbox_needs_batches(self, default_env, client, tmp_path):
+        with pytest.raises(ValueError):
+            RemoteTransmitter(outbox=Outbox(str(tmp_path / "outbox.db")))
+
+
+def test_remote_follows_controller(default_env, mock_config_generator):
+    with (
+        patch("paho.mqtt.client.Client", FakeMQTTClient),
+        freezegun.freeze_time("2024-01-01 12:00:00") as frozen,
+    ):
+        controller = UplinkController(initial_rate=10.0, update_interval=1000)
+        remote = RemoteTransmitter(
+            config_gen=mock_config_generator, controller=controller
+        )
+        client = remote._client
+        client.connect()
+        # 50 Hz for a second, the controller admits 10 records per second
+        for i in range(50):
+            frozen.tick(0.02)
+            remote.handle_record({"speed": float(i), "time": 1000.0 + i * 20})
+
+        ((mid, sequence),) = client.batches()
+        assert sequence is None
+        payload = client.published[-1][2]
+        _, columns = decode_batch(
+            payload, {dictionary_id(("speed", "time")): ("speed", "time")}
+        )
+        assert len(columns["speed"]) == 10
+        stats = remote.uplink_stats()
+        assert stats["buffered"] == 1
+        assert stats["in_flight"] == 1
+        assert stats["dropped"] == 39
+
+        # Published with the 10th record, 0.1 s before the last one
+        frozen.tick(0.3)
+        client.ack(mid)
+        stats = remote.uplink_stats()
+        assert stats["in_flight"] == 0
+        assert stats["latency_ms"] == pytest.approx(400.0, abs=1)
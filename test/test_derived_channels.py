@@ -0,0 +1,134 @@
+import math
+
+import pytest
+
+from configuration_generator import DERIVED_CHANNEL_TYPES, DerivedField, Metadata
+from derived_channels import CHANNEL_TYPES, DerivedChannels
+
+FIELDS = ["speed", "voltage", "current", "distance_traveled", "time"]
+
+
+def run(channels, rows):
+    """Feed (speed, voltage, current, distance, time) rows, returning the derived values"""
+    out = []
+    for row in rows:
+        values = list(row)
+        channels.compute(values)
+        out.append(values[len(FIELDS) :])
+    return out
+
+
+def test_types_match_configuration():
+    assert set(CHANNEL_TYPES) == set(DERIVED_CHANNEL_TYPES)
+
+
+def test_acceleration():
+    channels = DerivedChannels(
+        [DerivedField(name="accel", type="acceleration", window=1.0)], FIELDS
+    )
+    # Speed climbs 2 mph per second, sampled every 100ms
+    rows = [(10 + 0.2 * i, 0, 0, 0, 1000 + 100 * i) for i in range(30)]
+    result = run(channels, rows)
+    assert result[0] == [0.0]
+    assert result[-1][0] == pytest.approx(2.0)
+    assert channels.fields == ("accel",)
+
+
+def test_rolling_mean_and_chaining():
+    channels = DerivedChannels(
+        [
+            DerivedField(name="power", type="product", sources=["voltage", "current"]),
+            DerivedField(
+                name="power_avg", type="rolling_mean", sources=["power"], window=0.25
+            ),
+        ],
+        FIELDS,
+    )
+    rows = [(0, 10.0, float(i), 0, 100 * i) for i in range(5)]
+    result = run(channels, rows)
+    assert [row[0] for row in result] == [0, 10, 20, 30, 40]
+    # The window holds the samples of the last 250ms
+    assert result[-1][1] == pytest.approx((20 + 30 + 40) / 3)
+
+
+def test_rolling_mean_skips_invalid():
+    channels = DerivedChannels(
+        [DerivedField(name="avg", type="rolling_mean", sources=["speed"])], FIELDS
+    )
+    result = run(channels, [(10.0, 0, 0, 0, 0), (math.nan, 0, 0, 0, 100)])
+    assert result == [[10.0], [10.0]]
+
+
+def test_road_load_power():
+    metadata = Metadata(weight=200, drag_coefficient=0.2)
+    channels = DerivedChannels(
+        [
+            DerivedField(
+                name="power",
+                type="road_load_power",
+                params={"frontal_area": 0.5, "rolling_resistance": 0.002},
+            )
+        ],
+        FIELDS,
+        metadata,
+    )
+    # Constant 20 mph, so only drag and rolling resistance
+    result = run(channels, [(20.0, 0, 0, 0, 100 * i) for i in range(5)])
+    speed = 20 * 0.44704
+    mass = 200 * 0.45359237
+    expected = (0.5 * 1.204 * 0.2 * 0.5 * speed**2 + 0.002 * mass * 9.80665) * speed
+    assert result[-1][0] == pytest.approx(expected)
+
+    with pytest.raises(ValueError, match="metadata"):
+        DerivedChannels(
+            [DerivedField(name="power", type="road_load_power")], FIELDS, Metadata()
+        )
+
+
+def test_energy_per_distance():
+    channels = DerivedChannels(
+        [
+            DerivedField(name="power", type="product", sources=["voltage", "current"]),
+            DerivedField(
+                name="wh_per_mile", type="energy_per_distance", sources=["power"]
+            ),
+        ],
+        FIELDS,
+    )
+    # 360W for 10 seconds (1Wh) over a tenth of a mile
+    rows = [(0, 36.0, 10.0, 52.8 * i, 1000 * i) for i in range(11)]
+    result = run(channels, rows)
+    assert result[0][1] == 0.0
+    assert result[-1][1] == pytest.approx(10.0)
+
+    channels.reset()
+    assert run(channels, rows[:1]) == [[360.0, 0.0]]
+
+
+def test_scale_and_round():
+    channels = DerivedChannels(
+        [
+            DerivedField(
+                name="accel",
+                type="acceleration",
+                scale=0.44704,
+                round=3,
+            )
+        ],
+        FIELDS,
+    )
+    result = run(channels, [(10.0, 0, 0, 0, 0), (11.0, 0, 0, 0, 500)])
+    assert result[-1] == [round(2 * 0.44704, 3)]
+
+
+def test_invalid_definitions():
+    with pytest.raises(ValueError, match="Unknown source"):
+        DerivedChannels(
+            [DerivedField(name="avg", type="rolling_mean", sources=["rpm"])], FIELDS
+        )
+    with pytest.raises(ValueError, match="existing field"):
+        DerivedChannels([DerivedField(name="speed", type="acceleration")], FIELDS)
+    with pytest.raises(ValueError, match="two sources"):
+        DerivedChannels(
+            [DerivedField(name="p", type="product", sources=["voltage"])], FIELDS
+        )
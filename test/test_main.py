@@ -1,10 +1,21 @@
+import asyncio
+import json
 import os
+import shutil
 import struct
+import threading
 from unittest.mock import AsyncMock, MagicMock, mock_open, patch
 
 import pytest
 
 import main
+from background_writer import BackgroundWriter
+from configuration_generator import ConfigurationGenerator
+from remote_outbox import Outbox
+from session_catalog import list_sessions as list_catalog
+from session_recovery import RecoveryReport
+from sqlite_store import list_sessions, query_records
+from telemetry_batch import decode_batch
 
 
 @pytest.fixture(autouse=True)
@@ -37,6 +48,18 @@ def reset_env():
             os.environ[var] = value
 
 
+def packet_batches(*batches):
+    """Build a fake SmSerial.iter_packets yielding the given batches in order"""
+
+    async def iter_packets(size):
+        for batch in batches:
+            if isinstance(batch, BaseException):
+                raise batch
+            yield batch
+
+    return iter_packets
+
+
 @pytest.fixture
 def mock_dependencies():
     """Mock all external dependencies for main loop tests"""
@@ -45,26 +68,29 @@ def mock_dependencies():
         patch("main.web.TCPSite") as mock_site,
         patch("main.SmSerial") as mock_serial,
         patch("data_transmitter.open", mock_open()) as mock_file,
+        patch("data_transmitter.os.fsync"),
     ):
         # Setup serial mock
         mock_ser = MagicMock()
-        mock_ser.read_response.side_effect = [
-            struct.pack(
-                "<ffffBBBBBH",
-                25.3,  # speed
-                5.2,  # airspeed
-                78.2,  # engineTemp
-                65.4,  # radTemp
-                0,
-                1,
-                0,
-                1,
-                0,  # digital channels
-                100,
-            ),  # analog channel
-            "",
+        mock_ser.iter_packets.side_effect = packet_batches(
+            [
+                struct.pack(
+                    "<ffffBBBBBH",
+                    25.3,  # speed
+                    5.2,  # airspeed
+                    78.2,  # engineTemp
+                    65.4,  # radTemp
+                    0,
+                    1,
+                    0,
+                    1,
+                    0,  # digital channels
+                    100,
+                )  # analog channel
+            ],
+            [],
             KeyboardInterrupt(),
-        ]
+        )
         mock_serial.return_value = mock_ser
 
         # Setup web server mocks
@@ -152,3 +178,422 @@ async def test_enable_local_allows_csv_write(
 
         # Should have called _write_to_csv at least once when DISABLE_LOCAL is False
         assert mock_write.call_count > 0
+
+
+@pytest.mark.asyncio
+async def test_every_packet_logged_newest_displayed(
+    mock_dependencies, default_env, mock_mqtt_client
+):
+    """All packets in a batch are written locally, only the newest is displayed"""
+    packet = struct.pack("<ffffBBBBBH", 25.3, 5.2, 78.2, 65.4, 0, 1, 0, 1, 0, 100)
+    newest = struct.pack("<ffffBBBBBH", 30.0, 5.2, 78.2, 65.4, 0, 1, 0, 1, 0, 100)
+    mock_dependencies["serial"].iter_packets.side_effect = packet_batches(
+        [packet, packet, newest], KeyboardInterrupt()
+    )
+    with (
+        patch("main.LocalTransmitter.handle_record") as mock_record,
+        patch("main.localDisplaySio.emit") as mock_emit,
+    ):
+        await main.main()
+
+    assert mock_record.call_count == 3
+    new_data_calls = [c for c in mock_emit.call_args_list if c[0][0] == "new_data"]
+    assert len(new_data_calls) == 1
+    assert new_data_calls[0][0][1]["speed"] == 30.0
+    # socket.io gets a plain dict it can serialize
+    assert type(new_data_calls[0][0][1]) is dict
+
+
+@pytest.mark.asyncio
+async def test_display_backfilled_on_connect(
+    mock_dependencies, default_env, mock_mqtt_client
+):
+    """A display that connects receives the recent history"""
+    with (
+        patch("main.localDisplaySio.on") as mock_on,
+        patch("main.localDisplaySio.emit") as mock_emit,
+    ):
+        await main.main()
+        event, handler = mock_on.call_args[0]
+        assert event == "connect"
+        mock_emit.reset_mock()
+        await handler("sid1", {})
+
+    calls = {c[0][0]: c for c in mock_emit.call_args_list}
+    payload = calls["history"][0][1]
+    assert calls["history"][1] == {"to": "sid1"}
+    assert payload["speed"] == [pytest.approx(25.3)]
+    assert len(payload["time"]) == 1
+    assert calls["active_alarms"][0][1] == {}
+
+
+@pytest.mark.asyncio
+async def test_alarm_sent_immediately(
+    mock_dependencies, default_env, mock_mqtt_client, monkeypatch
+):
+    """An alarm goes to the display and the cloud as soon as it is raised"""
+    monkeypatch.setenv("ALARM_DEBOUNCE", "2")
+    # car1 limits voltage (channelA0 * 0.35) to 36 volts
+    low = struct.pack("<ffffBBBBBH", 25.3, 5.2, 78.2, 65.4, 0, 1, 0, 1, 0, 10)
+    high = struct.pack("<ffffBBBBBH", 25.3, 5.2, 78.2, 65.4, 0, 1, 0, 1, 0, 200)
+    mock_dependencies["serial"].iter_packets.side_effect = packet_batches(
+        [low, high], [high], [high], KeyboardInterrupt()
+    )
+    with (
+        patch("main.localDisplaySio.emit") as mock_emit,
+        patch("main.RemoteTransmitter.handle_alarm") as mock_alarm,
+        patch("main.RemoteTransmitter.handle_record"),
+    ):
+        await main.main()
+
+    alarm_calls = [c for c in mock_emit.call_args_list if c[0][0] == "alarm"]
+    assert len(alarm_calls) == 1
+    assert alarm_calls[0][0][1]["field"] == "voltage"
+    assert alarm_calls[0][0][1]["state"] == "high"
+    mock_alarm.assert_called_once_with(alarm_calls[0][0][1])
+
+
+@pytest.mark.asyncio
+async def test_sinks_have_independent_rates(
+    mock_dependencies, default_env, mock_mqtt_client, monkeypatch
+):
+    """Each sink receives records according to its own rate policy"""
+    monkeypatch.setenv("REMOTE_RATE", "every:3")
+    monkeypatch.setenv("DISPLAY_RATE", "all")
+    packet = struct.pack("<ffffBBBBBH", 25.3, 5.2, 78.2, 65.4, 0, 1, 0, 1, 0, 10)
+    mock_dependencies["serial"].iter_packets.side_effect = packet_batches(
+        [packet] * 4, [packet] * 3, KeyboardInterrupt()
+    )
+    with (
+        patch("main.localDisplaySio.emit") as mock_emit,
+        patch("main.LocalTransmitter.handle_record") as mock_local,
+        patch(
+            "main.RemoteTransmitter.handle_record",
+            side_effect=main.TransmitterError("offline"),
+        ) as mock_remote,
+    ):
+        await main.main()
+
+    # A failing remote does not stop local logging
+    assert mock_local.call_count == 7
+    assert mock_remote.call_count == 2
+    new_data_calls = [c for c in mock_emit.call_args_list if c[0][0] == "new_data"]
+    assert len(new_data_calls) == 7
+
+
+@pytest.mark.asyncio
+async def test_local_background_writer(
+    mock_dependencies, default_env, mock_mqtt_client, monkeypatch
+):
+    """With LOCAL_BACKGROUND every record still reaches the CSV, written by a thread"""
+    monkeypatch.setenv("LOCAL_BACKGROUND", "True")
+    packet = struct.pack("<ffffBBBBBH", 25.3, 5.2, 78.2, 65.4, 0, 1, 0, 1, 0, 10)
+    mock_dependencies["serial"].iter_packets.side_effect = packet_batches(
+        [packet] * 5, KeyboardInterrupt()
+    )
+    with (
+        patch("main.LocalTransmitter.handle_record") as mock_local,
+        patch("main.localDisplaySio.emit"),
+    ):
+        await main.main()
+
+    assert mock_local.call_count == 5
+
+
+@pytest.mark.asyncio
+async def test_local_binary_format(
+    mock_dependencies, default_env, mock_mqtt_client, monkeypatch
+):
+    """LOCAL_FORMAT=binary logs every record to a session log instead of the CSV"""
+    monkeypatch.setenv("LOCAL_FORMAT", "binary")
+    packet = struct.pack("<ffffBBBBBH", 25.3, 5.2, 78.2, 65.4, 0, 1, 0, 1, 0, 10)
+    mock_dependencies["serial"].iter_packets.side_effect = packet_batches(
+        [packet] * 3, KeyboardInterrupt()
+    )
+    with (
+        patch("main.SessionLogWriter") as mock_log,
+        patch("main.LocalTransmitter") as mock_csv,
+        patch("main.localDisplaySio.emit"),
+    ):
+        await main.main()
+
+    mock_csv.assert_not_called()
+    _, kwargs = mock_log.call_args
+    assert kwargs["car"] == "car1"
+    assert len(kwargs["config_hash"]) == 64
+    assert mock_log.return_value.handle_record.call_count == 3
+
+
+@pytest.mark.asyncio
+async def test_local_csv_header_follows_records(
+    mock_dependencies, default_env, mock_mqtt_client, monkeypatch, tmp_path
+):
+    """A sensor the packet layout does not map is left out of the CSV header"""
+    with open(os.environ["CONFIG_FILE_PATH"]) as file:
+        config = json.load(file)
+    config["cars"]["car1"]["sensors"]["channel9"] = {
+        "name": "ghost",
+        "unit": "",
+        "conversion_factor": 1.0,
+        "input_type": "analog",
+        "limits": {},
+    }
+    config_path = tmp_path / "car_config.json"
+    config_path.write_text(json.dumps(config))
+    monkeypatch.setenv("CONFIG_FILE_PATH", str(config_path))
+    with (
+        patch("main.LocalTransmitter") as mock_csv,
+        patch("main.localDisplaySio.emit"),
+    ):
+        await main.main()
+
+    header = mock_csv.call_args.args[0]
+    assert "ghost" not in header
+    record = mock_csv.return_value.handle_record.call_args.args[0]
+    assert list(record.keys()) == header
+
+
+@pytest.mark.asyncio
+async def test_config_update_recompiles_reader(
+    mock_dependencies, default_env, mock_mqtt_client, monkeypatch, tmp_path
+):
+    """A configuration pushed over MQTT reaches the decode plan of the reader"""
+    config_path = tmp_path / "car_config.json"
+    shutil.copy(os.environ["CONFIG_FILE_PATH"], config_path)
+    monkeypatch.setenv("CONFIG_FILE_PATH", str(config_path))
+    config = json.loads(config_path.read_text())
+    config["cars"]["car1"]["sensors"]["channelA0"]["conversion_factor"] = 0.7
+    config_gens = []
+
+    def make_config_gen():
+        config_gens.append(ConfigurationGenerator())
+        return config_gens[-1]
+
+    packet = struct.pack("<ffffBBBBBH", 25.3, 5.2, 78.2, 65.4, 0, 1, 0, 1, 0, 100)
+
+    async def iter_packets(size):
+        yield [packet]
+        # Received by the MQTT thread, applied on the event loop
+        update = threading.Thread(
+            target=config_gens[0].update_config, args=(json.dumps(config),)
+        )
+        update.start()
+        update.join()
+        await asyncio.sleep(0)
+        yield [packet]
+        raise KeyboardInterrupt()
+
+    mock_dependencies["serial"].iter_packets.side_effect = iter_packets
+    with (
+        patch("main.ConfigurationGenerator", side_effect=make_config_gen),
+        patch("main.LocalTransmitter") as mock_csv,
+        patch("main.localDisplaySio.emit"),
+    ):
+        await main.main()
+
+    first, second = [
+        call.args[0]["voltage"]
+        for call in mock_csv.return_value.handle_record.call_args_list
+    ]
+    assert second == pytest.approx(2 * first)
+
+
+@pytest.mark.asyncio
+async def test_local_flush_interval_bound(
+    mock_dependencies, default_env, mock_mqtt_client, monkeypatch
+):
+    """The cache flushes a tick early, the writer checks it every tick"""
+    monkeypatch.setenv("LOCAL_FLUSH_INTERVAL", "2")
+    monkeypatch.setenv("LOCAL_BACKGROUND", "True")
+    with (
+        patch("main.LocalTransmitter") as mock_local,
+        patch.object(
+            BackgroundWriter,
+            "__init__",
+            autospec=True,
+            side_effect=BackgroundWriter.__init__,
+        ) as mock_writer,
+        patch("main.localDisplaySio.emit"),
+    ):
+        await main.main()
+
+    # The oldest record is at most 1.8 s old at a tick, and flushed by the next one
+    assert mock_local.call_args.kwargs["flush_interval"] == pytest.approx(1.8)
+    assert mock_writer.call_args.kwargs["flush_interval"] == pytest.approx(0.2)
+
+
+@pytest.mark.asyncio
+async def test_local_rotation_and_archiving(
+    mock_dependencies, default_env, mock_mqtt_client, monkeypatch
+):
+    """Rotation and archiving settings reach the local cache, the archiver is closed"""
+    monkeypatch.setenv("LOCAL_ROTATE_MB", "0.5")
+    monkeypatch.setenv("LOCAL_ROTATE_MINUTES", "10")
+    monkeypatch.setenv("LOCAL_COMPRESSION", "gzip")
+    monkeypatch.setenv("LOCAL_QUOTA_MB", "100")
+    with (
+        patch("main.SessionArchiver") as mock_archiver,
+        patch("main.LocalTransmitter") as mock_local,
+        patch("main.localDisplaySio.emit"),
+    ):
+        await main.main()
+
+    mock_archiver.assert_called_once_with(
+        compression="gzip", max_bytes=100 * 1024 * 1024
+    )
+    _, kwargs = mock_local.call_args
+    assert kwargs["archiver"] is mock_archiver.return_value
+    assert kwargs["rotate_bytes"] == 512 * 1024
+    assert kwargs["rotate_seconds"] == 600
+    mock_archiver.return_value.close.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_local_recovery_on_startup(
+    mock_dependencies, default_env, mock_mqtt_client, capsys
+):
+    """The last session is recovered before the local cache starts a new one"""
+    report = RecoveryReport("Data/old_car_data.smlog", 12, 0)
+    with (
+        patch("main.recover_last_session", return_value=report) as mock_recover,
+        patch("main.LocalTransmitter") as mock_local,
+        patch("main.localDisplaySio.emit"),
+    ):
+        mock_recover.side_effect = lambda: mock_local.assert_not_called() or report
+        await main.main()
+
+    mock_recover.assert_called_once()
+    # A clean shutdown is reported too, nothing was truncated or dropped
+    assert (
+        "Recovered 12 records of Data/old_car_data.smlog, truncated 0 bytes"
+        " and dropped 0 records failing their checksum" in capsys.readouterr().out
+    )
+
+
+@pytest.mark.asyncio
+async def test_local_sqlite_format(
+    mock_dependencies, default_env, mock_mqtt_client, monkeypatch, tmp_path, capsys
+):
+    """LOCAL_FORMAT=sqlite stores every record in the local database"""
+    database = str(tmp_path / "telemetry.db")
+    monkeypatch.setenv("LOCAL_FORMAT", "sqlite")
+    monkeypatch.setenv("LOCAL_DATABASE", database)
+    monkeypatch.setenv("LOCAL_QUOTA_MB", "100")
+    packet = struct.pack("<ffffBBBBBH", 25.3, 5.2, 78.2, 65.4, 0, 1, 0, 1, 0, 10)
+    mock_dependencies["serial"].iter_packets.side_effect = packet_batches(
+        [packet] * 3, KeyboardInterrupt()
+    )
+    with (
+        patch("main.localDisplaySio.emit"),
+        patch("main.SessionArchiver") as mock_archiver,
+    ):
+        await main.main()
+
+    # The quota applies to session files, not to the shared database
+    mock_archiver.assert_not_called()
+    assert "ignored by the sqlite format" in capsys.readouterr().out
+    (session,) = list_sessions(database)
+    assert session["car"] == "car1"
+    records = query_records(database, session["id"], fields=["speed"])
+    assert records["speed"] == [25.3] * 3
+
+
+@pytest.mark.asyncio
+async def test_local_catalog(
+    mock_dependencies, default_env, mock_mqtt_client, monkeypatch, tmp_path
+):
+    """LOCAL_CATALOG summarizes the local session into the catalog, off the event loop"""
+    catalog = str(tmp_path / "catalog.db")
+    monkeypatch.setenv("LOCAL_CATALOG", catalog)
+    monkeypatch.setenv("SERIAL_FRAMED", "True")
+    # Summarized on the writer thread, with the records of the local cache
+    monkeypatch.setenv("LOCAL_BACKGROUND", "True")
+    packet = struct.pack("<ffffBBBBBH", 25.3, 5.2, 78.2, 65.4, 0, 1, 0, 1, 0, 10)
+    mock_dependencies["serial"].iter_packets.side_effect = packet_batches(
+        [packet] * 3, KeyboardInterrupt()
+    )
+    mock_dependencies["serial"].stats.return_value = {"crc_failures": 1}
+    with patch("main.localDisplaySio.emit"):
+        await main.main()
+
+    (session,) = list_catalog(catalog)
+    assert session["car"] == "car1"
+    assert session["location"].endswith(f"{session['session']}_car_data.csv")
+    assert session["records"] == 3
+    assert session["counters"] == {"crc_failures": 1}
+    assert session["channels"]["speed"]["mean"] == pytest.approx(25.3)
+    assert session["closed"]
+
+
+@pytest.mark.asyncio
+async def test_remote_batches(
+    mock_dependencies, default_env, mock_mqtt_client, monkeypatch
+):
+    """With REMOTE_BATCH_SIZE every record reaches the cloud, in batch messages"""
+    monkeypatch.setenv("REMOTE_BATCH_SIZE", "4")
+    packet = struct.pack("<ffffBBBBBH", 25.3, 5.2, 78.2, 65.4, 0, 1, 0, 1, 0, 10)
+    mock_dependencies["serial"].iter_packets.side_effect = packet_batches(
+        [packet] * 6, KeyboardInterrupt()
+    )
+    with patch("main.localDisplaySio.emit"):
+        await main.main()
+
+    publish = mock_mqtt_client.return_value.publish
+    dictionaries = {
+        call.args[0].rsplit("/", 1)[1]: json.loads(call.args[1])["fields"]
+        for call in publish.call_args_list
+        if "/fields/" in call.args[0]
+    }
+    batches = [
+        decode_batch(call.args[1], dictionaries)[1]
+        for call in publish.call_args_list
+        if call.args[0] == "cars/user/data/batch"
+    ]
+    # A full batch, then the rest on shutdown
+    assert [len(batch["speed"]) for batch in batches] == [4, 2]
+
+
+@pytest.mark.asyncio
+async def test_remote_outbox(
+    mock_dependencies, default_env, mock_mqtt_client, monkeypatch, tmp_path
+):
+    """With REMOTE_OUTBOX, batches sent while offline are kept for the next run"""
+    path = str(tmp_path / "outbox.db")
+    monkeypatch.setenv("REMOTE_BATCH_SIZE", "4")
+    monkeypatch.setenv("REMOTE_OUTBOX", path)
+    packet = struct.pack("<ffffBBBBBH", 25.3, 5.2, 78.2, 65.4, 0, 1, 0, 1, 0, 10)
+    mock_dependencies["serial"].iter_packets.side_effect = packet_batches(
+        [packet] * 6, KeyboardInterrupt()
+    )
+    with patch("main.localDisplaySio.emit"):
+        await main.main()
+
+    # The broker never connected
+    outbox = Outbox(path)
+    assert outbox.stats()["pending"] == 2
+    assert outbox.peek()[0] == 1
+    outbox.close()
+
+
+@pytest.mark.asyncio
+async def test_remote_adaptive(
+    mock_dependencies, default_env, mock_mqtt_client, monkeypatch, capsys
+):
+    """With REMOTE_ADAPTIVE the controller picks the records and batches to send"""
+    monkeypatch.setenv("REMOTE_ADAPTIVE", "True")
+    packet = struct.pack("<ffffBBBBBH", 25.3, 5.2, 78.2, 65.4, 0, 1, 0, 1, 0, 10)
+    mock_dependencies["serial"].iter_packets.side_effect = packet_batches(
+        [packet] * 6, KeyboardInterrupt()
+    )
+    with patch("main.localDisplaySio.emit"):
+        await main.main()
+
+    publish = mock_mqtt_client.return_value.publish
+    batches = [
+        call
+        for call in publish.call_args_list
+        if call.args[0] == "cars/user/data/batch"
+    ]
+    # The records of a burst are over the initial rate, only the first is admitted
+    assert len(batches) == 1
+    assert "Uplink stats: {'rate': 5.0" in capsys.readouterr().out
@@ -0,0 +1,188 @@
+import random
+import struct
+from unittest.mock import patch
+
+import pytest
+
+from configuration_generator import DerivedField, PacketLayout, Sensor
+
+np = pytest.importorskip("numpy")
+
+from numpy_decoder import NumpyDataReader, round_like_python  # noqa: E402
+from telemetry_clock import TelemetryClock  # noqa: E402
+
+SENSORS = {
+    "channel0": Sensor(
+        name="voltage", unit="volts", conversion_factor=0.1, input_type="digital"
+    ),
+    "channel2": Sensor(
+        name="button", unit="", conversion_factor=0.0, input_type="digital"
+    ),
+    "channel4": Sensor(
+        name="switch", unit="", conversion_factor=3, input_type="digital"
+    ),
+    "channelA0": Sensor(
+        name="analog_sensor", unit="units", conversion_factor=0.35, input_type="analog"
+    ),
+}
+
+
+def random_packets(count, seed=0):
+    rng = random.Random(seed)
+    return b"".join(
+        struct.pack(
+            "<ffffBBBBBH",
+            rng.uniform(-5, 40),
+            rng.uniform(0, 40),
+            rng.uniform(60, 250),
+            rng.uniform(60, 200),
+            *(rng.randrange(256) for _ in range(5)),
+            rng.randrange(65536),
+        )
+        for _ in range(count)
+    )
+
+
+def test_matches_scalar_decoder():
+    """The vectorized path gives identical values to parse_sensor_data"""
+    count = 2000
+    buffer = random_packets(count)
+    # 7ms apart with jitter, and a few gaps too long to integrate across
+    timestamps = [
+        10_000_000_000 + 7_000_000 * i + 1_000 * (i % 3) + 3_000_000_000 * (i // 500)
+        for i in range(count)
+    ]
+    clock = TelemetryClock()
+
+    scalar = NumpyDataReader(SENSORS, clock=clock)
+    records = [
+        scalar.parse_sensor_data(buffer[i * 23 : (i + 1) * 23], timestamps[i])
+        for i in range(count)
+    ]
+
+    vectorized = NumpyDataReader(SENSORS, clock=clock)
+    half = count // 2 * 23
+    first = vectorized.parse_columns(buffer[:half], np.array(timestamps[: count // 2]))
+    second = vectorized.parse_columns(buffer[half:], np.array(timestamps[count // 2 :]))
+
+    assert list(first) == list(records[0])
+    for key in first:
+        column = list(first[key]) + list(second[key])
+        assert column == [record[key] for record in records], key
+    assert vectorized.distance_traveled == scalar.distance_traveled
+    assert vectorized._odometer.last_ns == scalar._odometer.last_ns
+
+
+def test_invalid_speeds_match_scalar():
+    """Rejected speed samples carry the previous distance, like the scalar path"""
+    speeds = [float("nan"), 10.0, -3.0, 12.0, 500.0, float("inf"), 14.0, -1.0]
+    buffer = b"".join(
+        struct.pack("<ffffBBBBBH", speed, 0, 0, 0, 0, 0, 0, 0, 0, 0) for speed in speeds
+    )
+    timestamps = [1_000_000_000 + 50_000_000 * i for i in range(len(speeds))]
+    clock = TelemetryClock()
+
+    scalar = NumpyDataReader(SENSORS, clock=clock)
+    expected = [
+        scalar.parse_sensor_data(buffer[i * 23 : (i + 1) * 23], timestamps[i])[
+            "distance_traveled"
+        ]
+        for i in range(len(speeds))
+    ]
+
+    vectorized = NumpyDataReader(SENSORS, clock=clock)
+    columns = vectorized.parse_columns(buffer, np.array(timestamps))
+    assert list(columns["distance_traveled"]) == expected
+    assert expected[0] == 0 and expected[-1] > 0
+
+    all_invalid = vectorized.parse_columns(buffer[:23], np.array([2_000_000_000]))
+    assert list(all_invalid["distance_traveled"]) == [expected[-1]]
+
+
+def test_default_timestamp_and_empty_buffer():
+    reader = NumpyDataReader(SENSORS)
+    stamps = [5_000_000, 6_000_000, 7_000_000]
+    with patch.object(reader._clock, "spread", return_value=stamps):
+        columns = reader.parse_columns(random_packets(3))
+    assert list(columns["time"]) == [reader._clock.to_wall_ms(s) for s in stamps]
+    assert len(reader.parse_columns(b"")["speed"]) == 0
+
+
+def test_invalid_input():
+    reader = NumpyDataReader(SENSORS)
+    with pytest.raises(ValueError, match="Invalid data size"):
+        reader.parse_columns(b"\x00" * 24)
+    with pytest.raises(ValueError, match="timestamps"):
+        reader.parse_columns(random_packets(2), np.array([1]))
+
+
+def test_round_like_python_ties():
+    values = np.array([0.285, 1.005, 2.675, -0.125, 12.345])
+    assert list(round_like_python(values, 2)) == [round(float(v), 2) for v in values]
+
+
+def test_custom_layout_matches_scalar():
+    layout = PacketLayout.from_list(
+        [
+            {"name": "speed", "type": "f", "round": 2},
+            {"name": "rpm", "type": "H", "scale": 10},
+            {"name": "volts", "type": "h", "scale": 0.01, "round": 1},
+            {"channel": "channel0", "type": "b"},
+            {"channel": "channelA0", "type": "I"},
+        ]
+    )
+    sensors = {
+        "channel0": Sensor(
+            name="trim", unit="", conversion_factor=2, input_type="digital"
+        ),
+        "channelA0": Sensor(
+            name="pressure", unit="psi", conversion_factor=0.25, input_type="analog"
+        ),
+    }
+    rng = random.Random(5)
+    buffer = b"".join(
+        struct.pack(
+            layout.format,
+            rng.uniform(0, 40),
+            rng.randrange(65536),
+            rng.randrange(-32768, 32768),
+            rng.randrange(-128, 128),
+            rng.randrange(2**32),
+        )
+        for _ in range(300)
+    )
+    timestamps = list(range(1_000_000, 301_000_000, 1_000_000))
+    clock = TelemetryClock()
+
+    scalar = NumpyDataReader(sensors, layout, clock)
+    records = [
+        scalar.parse_sensor_data(buffer[i * layout.size : (i + 1) * layout.size], stamp)
+        for i, stamp in enumerate(timestamps)
+    ]
+    columns = NumpyDataReader(sensors, layout, clock).parse_columns(
+        buffer, np.array(timestamps)
+    )
+    for key in columns:
+        assert list(columns[key]) == [record[key] for record in records], key
+
+
+def test_derived_channels_match_scalar():
+    derived = [
+        DerivedField(name="acceleration", type="acceleration", window=0.5),
+        DerivedField(name="speed_avg", type="rolling_mean", sources=["speed"]),
+    ]
+    buffer = random_packets(200, seed=3)
+    timestamps = list(range(1_000_000_000, 3_000_000_000, 10_000_000))
+    clock = TelemetryClock()
+
+    scalar = NumpyDataReader(SENSORS, clock=clock, derived=derived)
+    records = [
+        scalar.parse_sensor_data(buffer[i * 23 : (i + 1) * 23], stamp)
+        for i, stamp in enumerate(timestamps)
+    ]
+    columns = NumpyDataReader(SENSORS, clock=clock, derived=derived).parse_columns(
+        buffer, np.array(timestamps)
+    )
+    assert list(columns) == list(records[0])
+    for key in ("acceleration", "speed_avg"):
+        assert list(columns[key]) == [record[key] for record in records], key
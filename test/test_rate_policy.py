@@ -0,0 +1,107 @@
+import pytest
+
+from rate_policy import (
+    AllPolicy,
+    EveryNthPolicy,
+    IntervalPolicy,
+    LatestPolicy,
+    MinMaxPolicy,
+    parse_rate_policy,
+)
+
+
+def records(*times, speeds=None):
+    speeds = speeds or [0.0] * len(times)
+    return [{"time": float(t), "speed": s} for t, s in zip(times, speeds)]
+
+
+def test_all():
+    batch = records(0, 1, 2)
+    assert AllPolicy().select(batch) == batch
+
+
+def test_every_nth_across_batches():
+    policy = EveryNthPolicy(3)
+    batch = records(*range(10))
+    selected = (
+        policy.select(batch[:4]) + policy.select(batch[4:5]) + policy.select(batch[5:])
+    )
+    assert [r["time"] for r in selected] == [0, 3, 6, 9]
+
+
+def test_interval():
+    policy = IntervalPolicy(0.1)
+    selected = policy.select(records(0, 50, 100, 120)) + policy.select(
+        records(199, 200)
+    )
+    assert [r["time"] for r in selected] == [0, 100, 200]
+
+
+def test_latest():
+    policy = LatestPolicy(0.05)
+    assert [r["time"] for r in policy.select(records(0, 10, 20))] == [20]
+    assert policy.select(records(30, 60)) == []
+    assert [r["time"] for r in policy.select(records(70))] == [70]
+    assert policy.select([]) == []
+    # Zero interval delivers the newest record of every batch
+    policy = LatestPolicy(0)
+    assert [r["time"] for r in policy.select(records(1, 2))] == [2]
+    assert [r["time"] for r in policy.select(records(2))] == [2]
+
+
+def test_minmax_keeps_peaks_in_order():
+    policy = MinMaxPolicy(1.0)
+    batch = records(0, 200, 400, 600, 800, speeds=[10, 30, 5, 12, 11])
+    # Nothing is delivered until the interval ends
+    assert policy.select(batch) == []
+    selected = policy.select(records(1000, 1500, speeds=[20, 20]))
+    assert [(r["time"], r["speed"]) for r in selected] == [(200, 30), (400, 5)]
+    # A flat interval delivers its single extreme record once
+    selected = policy.select(records(2000, speeds=[1]))
+    assert [(r["time"], r["speed"]) for r in selected] == [(1000, 20)]
+
+
+def test_minmax_flush_releases_open_interval():
+    policy = MinMaxPolicy(1.0)
+    policy.select(records(0, 200, 400, speeds=[10, 30, 5]))
+    selected = policy.flush()
+    assert [(r["time"], r["speed"]) for r in selected] == [(200, 30), (400, 5)]
+    assert policy.flush() == []
+    # The next record opens a new interval instead of joining the flushed one
+    assert policy.select(records(500, speeds=[1])) == []
+    assert [r["time"] for r in policy.flush()] == [500]
+    assert LatestPolicy(0.05).flush() == []
+
+
+def test_minmax_other_field():
+    policy = MinMaxPolicy(1.0, "engine_temp")
+    batch = [
+        {"time": 0.0, "engine_temp": 200.0},
+        {"time": 10.0, "engine_temp": 250.0},
+        {"time": 2000.0, "engine_temp": 0.0},
+    ]
+    assert policy.select(batch) == batch[:2]
+
+
+@pytest.mark.parametrize(
+    "spec, policy_type",
+    [
+        ("all", AllPolicy),
+        ("every:10", EveryNthPolicy),
+        ("interval:0.5", IntervalPolicy),
+        (" latest:0.05 ", LatestPolicy),
+        ("minmax:1", MinMaxPolicy),
+        ("minmax:1:engine_temp", MinMaxPolicy),
+    ],
+)
+def test_parse(spec, policy_type):
+    assert isinstance(parse_rate_policy(spec), policy_type)
+
+
+@pytest.mark.parametrize(
+    "spec",
+    ["", "often", "every", "every:0", "every:x", "latest:-1", "all:1", "minmax:0"],
+)
+def test_parse_invalid(spec):
+    with pytest.raises(ValueError, match="Invalid rate policy"):
+        parse_rate_policy(spec)
@@ -0,0 +1,72 @@
+import pytest
+
+from remote_outbox import Outbox, OutboxError
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "outbox.db")
+
+
+def test_put_peek_remove(path):
+    outbox = Outbox(path)
+    for payload in (b"first", b"second", b"third"):
+        outbox.put(outbox.next_sequence(), "cars/user/data/batch", payload)
+
+    assert outbox.peek() == (1, "cars/user/data/batch", b"first")
+    assert outbox.peek(after=1) == (2, "cars/user/data/batch", b"second")
+    assert outbox.peek(skip=[1, 2]) == (3, "cars/user/data/batch", b"third")
+    assert outbox.peek(after=3) is None
+    outbox.put(outbox.next_sequence(), "cars/user/data/alarms", b"alarm")
+    assert outbox.peek(topic="cars/user/data/alarms") == (
+        4,
+        "cars/user/data/alarms",
+        b"alarm",
+    )
+    assert outbox.peek(skip=[4], topic="cars/user/data/alarms") is None
+    outbox.remove(4)
+
+    outbox.remove(2)
+    outbox.remove(2)  # already gone
+    assert outbox.peek(after=1)[0] == 3
+    assert outbox.stats() == {"pending": 2, "bytes": 10, "dropped": 0}
+    outbox.close()
+
+
+def test_kept_across_restarts(path):
+    outbox = Outbox(path)
+    outbox.put(outbox.next_sequence(), "topic", b"kept")
+    outbox.put(outbox.next_sequence(), "topic", b"acknowledged")
+    outbox.remove(2)
+    outbox.close()
+
+    outbox = Outbox(path)
+    assert outbox.stats()["pending"] == 1
+    assert outbox.peek() == (1, "topic", b"kept")
+    # Sequence numbers are never reused, even after their message is removed
+    assert outbox.next_sequence() == 3
+    outbox.close()
+
+
+def test_size_bound_drops_oldest(path):
+    outbox = Outbox(path, max_bytes=10)
+    for i in range(4):
+        outbox.put(outbox.next_sequence(), "topic", b"1234")
+
+    assert outbox.stats() == {"pending": 2, "bytes": 8, "dropped": 2}
+    assert outbox.peek()[0] == 3
+    outbox.close()
+
+
+def test_invalid(tmp_path, path):
+    with pytest.raises(ValueError):
+        Outbox(path, max_bytes=0)
+    with pytest.raises(OutboxError, match="Cannot open outbox"):
+        Outbox(str(tmp_path / "missing" / "outbox.db"))
+
+    outbox = Outbox(path)
+    outbox.put(1, "topic", b"payload")
+    with pytest.raises(OutboxError, match="Cannot store message 1"):
+        outbox.put(1, "topic", b"again")
+    assert outbox.stats() == {"pending": 1, "bytes": 7, "dropped": 0}
+    outbox.close()
@@ -0,0 +1,76 @@
+import struct
+from unittest.mock import patch
+
+import pytest
+
+from serial_capture import (
+    CaptureError,
+    CaptureWriter,
+    ReplaySource,
+    read_capture,
+)
+
+
+@pytest.fixture
+def capture_file(tmp_path):
+    """A capture with three chunks recorded 0, 10 and 30 ms after start"""
+    path = tmp_path / "session.smcap"
+    with patch(
+        "serial_capture.time.monotonic_ns", side_effect=[0, 0, 10_000_000, 30_000_000]
+    ):
+        writer = CaptureWriter(str(path))
+        writer.write(b"abc")
+        writer.write(b"")  # empty reads are not recorded
+        writer.write(b"de")
+        writer.write(b"f")
+        writer.close()
+    return str(path)
+
+
+def test_capture_roundtrip(capture_file):
+    start_time, chunks = read_capture(capture_file)
+    assert start_time > 0
+    assert list(chunks) == [(0, b"abc"), (10_000_000, b"de"), (30_000_000, b"f")]
+
+
+def test_capture_truncated_chunk(capture_file):
+    with open(capture_file, "r+b") as file:
+        file.truncate(file.seek(0, 2) - 1)
+    _, chunks = read_capture(capture_file)
+    assert [chunk for _, chunk in chunks] == [b"abc", b"de"]
+
+
+def test_not_a_capture(tmp_path):
+    path = tmp_path / "bad.smcap"
+    path.write_bytes(struct.pack("<6sQ", b"NOTCAP", 0))
+    with pytest.raises(CaptureError):
+        read_capture(str(path))
+
+
+def test_replay_as_fast_as_possible(capture_file):
+    source = ReplaySource(capture_file, speed=0)
+    chunks = []
+    while not source.exhausted:
+        assert source.time_until_next() == 0
+        chunks.append(source.read())
+    assert chunks == [b"abc", b"de", b"f"]
+    assert source.time_until_next() is None
+    assert source.read() == b""
+
+
+def test_replay_real_time(capture_file):
+    with patch("serial_capture.time.monotonic_ns") as mock_clock:
+        mock_clock.return_value = 1_000_000_000
+        source = ReplaySource(capture_file, speed=2.0)
+        assert source.read() == b"abc"
+        assert source.time_until_next() == pytest.approx(0.005)
+
+        # At 2x speed the chunks recorded at 10 and 30 ms are due at 5 and 15 ms
+        mock_clock.return_value += 16_000_000
+        assert source.read() == b"def"
+        assert source.exhausted
+
+
+def test_replay_negative_speed(capture_file):
+    with pytest.raises(CaptureError):
+        ReplaySource(capture_file, speed=-1)
@@ -0,0 +1,70 @@
+import struct
+
+import pytest
+
+from serial_framing import SYNC_WORD, FrameDecoder, encode_frame
+
+PAYLOAD = struct.pack("<ffffBBBBBH", 25.3, 5.1, 78.2, 65.4, 0, 1, 0, 1, 0, 100)
+
+
+class TestEncodeFrame:
+    """Tests for encode_frame"""
+
+    def test_frame_layout(self):
+        frame = encode_frame(PAYLOAD)
+        assert frame.startswith(SYNC_WORD)
+        assert frame[2] == len(PAYLOAD)
+        assert frame[3:-2] == PAYLOAD
+        assert len(frame) == len(PAYLOAD) + 5
+
+    def test_invalid_payload_size(self):
+        with pytest.raises(ValueError):
+            encode_frame(b"")
+        with pytest.raises(ValueError):
+            encode_frame(b"\x00" * 256)
+
+
+class TestFrameDecoder:
+    """Tests for the streaming FrameDecoder"""
+
+    def test_decode_back_to_back_frames(self):
+        decoder = FrameDecoder()
+        assert decoder.feed(encode_frame(PAYLOAD) * 3) == [PAYLOAD] * 3
+        assert decoder.frames_decoded == 3
+        assert decoder.resync_events == 0
+
+    def test_decode_split_across_chunks(self):
+        decoder = FrameDecoder()
+        stream = encode_frame(PAYLOAD) * 2
+        frames = []
+        for i in range(len(stream)):
+            frames += decoder.feed(stream[i : i + 1])
+        assert frames == [PAYLOAD] * 2
+
+    def test_recovers_after_dropped_byte(self):
+        decoder = FrameDecoder()
+        frame = encode_frame(PAYLOAD)
+        damaged = frame[:10] + frame[11:]
+        assert decoder.feed(damaged + frame + frame) == [PAYLOAD] * 2
+        assert decoder.resync_events == 1
+        assert decoder.bytes_discarded == len(damaged)
+
+    def test_crc_failure_is_counted(self):
+        decoder = FrameDecoder()
+        corrupted = bytearray(encode_frame(PAYLOAD))
+        corrupted[5] ^= 0xFF
+        assert decoder.feed(bytes(corrupted) + encode_frame(PAYLOAD)) == [PAYLOAD]
+        assert decoder.crc_failures == 1
+        assert decoder.resync_events == 1
+
+    def test_leading_garbage(self):
+        decoder = FrameDecoder()
+        assert decoder.feed(b"\x01\x02\xaa\x03" + encode_frame(PAYLOAD)) == [PAYLOAD]
+        assert decoder.stats()["bytes_discarded"] == 4
+
+    def test_reset_drops_partial_frame(self):
+        decoder = FrameDecoder()
+        frame = encode_frame(PAYLOAD)
+        decoder.feed(frame[:8])
+        decoder.reset()
+        assert decoder.feed(frame) == [PAYLOAD]
@@ -0,0 +1,134 @@
+import gzip
+import os
+import time
+
+import pytest
+
+from session_archive import (
+    SegmentName,
+    SessionArchiver,
+    parse_segment_name,
+    segment_file_name,
+)
+
+
+def wait_for(predicate, timeout=5.0):
+    """Wait for the archiver thread to reach a state"""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out waiting for the archiver"
+        time.sleep(0.01)
+
+
+def write_session(data_dir, session, segments, size=1000, extension="csv"):
+    paths = []
+    for segment in range(segments):
+        path = data_dir / segment_file_name(session, segment, extension)
+        path.write_bytes(b"x" * size)
+        paths.append(path)
+    return paths
+
+
+def test_segment_names():
+    assert segment_file_name("2024-01-01_12-00-00", 0, "csv") == (
+        "2024-01-01_12-00-00_car_data.csv"
+    )
+    assert segment_file_name("2024-01-01_12-00-00", 3, "smlog") == (
+        "2024-01-01_12-00-00_car_data.3.smlog"
+    )
+    assert parse_segment_name("2024-01-01_12-00-00_car_data.csv") == SegmentName(
+        "2024-01-01_12-00-00", 0, "csv", None
+    )
+    assert parse_segment_name("2024-01-01_12-00-00_car_data.12.smlog.zst") == (
+        SegmentName("2024-01-01_12-00-00", 12, "smlog", "zstd")
+    )
+    assert parse_segment_name("2024-01-01_12-00-00_car_data.1.csv.gz").compression == (
+        "gzip"
+    )
+    assert parse_segment_name("2024-01-01_12-00-00_car_data.2.csv.idx") == (
+        SegmentName("2024-01-01_12-00-00", 2, "csv", None, True)
+    )
+    assert parse_segment_name("notes.txt") is None
+    assert parse_segment_name("2024-01-01_12-00-00_car_data.csv.gz.tmp") is None
+
+
+def test_invalid_arguments(tmp_path):
+    with pytest.raises(ValueError):
+        SessionArchiver(str(tmp_path), compression="lzma")
+    with pytest.raises(ValueError):
+        SessionArchiver(str(tmp_path), max_bytes=0)
+
+
+def test_submit_compresses_segment(tmp_path):
+    archiver = SessionArchiver(str(tmp_path))
+    (path,) = write_session(tmp_path, "2024-01-01_12-00-00", 1)
+    archiver.submit(str(path))
+    wait_for(lambda: archiver.stats()["compressed"] == 1)
+    archiver.close()
+
+    assert not path.exists()
+    with gzip.open(f"{path}.gz") as file:
+        assert file.read() == b"x" * 1000
+
+
+def test_zstd_compression(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    archiver = SessionArchiver(str(tmp_path), compression="zstd")
+    (path,) = write_session(tmp_path, "2024-01-01_12-00-00", 1)
+    archiver.submit(str(path))
+    wait_for(lambda: archiver.stats()["compressed"] == 1)
+    archiver.close()
+
+    with open(f"{path}.zst", "rb") as file:
+        assert zstandard.ZstdDecompressor().stream_reader(file).read() == b"x" * 1000
+
+
+def test_begin_session_compresses_past_sessions(tmp_path):
+    past = write_session(tmp_path, "2024-01-01_12-00-00", 2)
+    index = tmp_path / "2024-01-01_12-00-00_car_data.csv.idx"
+    index.write_bytes(b"index")
+    current = write_session(tmp_path, "2024-01-02_12-00-00", 1)
+    leftover = tmp_path / "2024-01-01_12-00-00_car_data.1.csv.gz.tmp"
+    leftover.write_bytes(b"partial")
+
+    archiver = SessionArchiver(str(tmp_path))
+    archiver.begin_session("2024-01-02_12-00-00")
+    wait_for(lambda: archiver.stats()["compressed"] == 2)
+    archiver.close()
+
+    assert not leftover.exists()
+    assert index.exists()
+    assert all(not path.exists() and os.path.exists(f"{path}.gz") for path in past)
+    # The active session is left alone
+    assert current[0].exists()
+
+
+def test_quota_evicts_oldest_inactive_sessions(tmp_path):
+    write_session(tmp_path, "2024-01-01_12-00-00", 2)
+    write_session(tmp_path, "2024-01-02_12-00-00", 2)
+    write_session(tmp_path, "2024-01-03_12-00-00", 1)
+    (tmp_path / "notes.txt").write_bytes(b"x" * 10000)
+
+    archiver = SessionArchiver(str(tmp_path), compression=None, max_bytes=3500)
+    archiver.begin_session("2024-01-03_12-00-00")
+    wait_for(lambda: archiver.stats()["evicted"] == 1)
+    archiver.close()
+
+    assert sorted(os.listdir(tmp_path)) == [
+        "2024-01-02_12-00-00_car_data.1.csv",
+        "2024-01-02_12-00-00_car_data.csv",
+        "2024-01-03_12-00-00_car_data.csv",
+        "notes.txt",
+    ]
+
+
+def test_quota_never_evicts_active_session(tmp_path):
+    write_session(tmp_path, "2024-01-01_12-00-00", 1)
+    current = write_session(tmp_path, "2024-01-02_12-00-00", 3)
+
+    archiver = SessionArchiver(str(tmp_path), compression=None, max_bytes=500)
+    archiver.begin_session("2024-01-02_12-00-00")
+    wait_for(lambda: archiver.stats()["evicted"] == 1)
+    archiver.close()
+
+    assert all(path.exists() for path in current)
@@ -0,0 +1,202 @@
+import json
+import threading
+import time
+
+import freezegun
+import pytest
+
+from background_writer import BackgroundWriter
+from data_transmitter import TransmitterError
+from session_catalog import SessionSummary, list_sessions, main
+from telemetry_record import RecordSchema, TelemetryRecord
+
+FIELDS = ("speed", "engine_temp", "time")
+SCHEMA = RecordSchema(FIELDS)
+
+
+def record(speed, time, engine_temp=90.0):
+    return TelemetryRecord(SCHEMA, [speed, engine_temp, time])
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    return str(tmp_path / "catalog.db")
+
+
+def summarize(catalog, session, car, times, **kwargs):
+    summary = SessionSummary(
+        catalog,
+        session,
+        FIELDS,
+        location=f"Data/{session}_car_data.csv",
+        car=car,
+        **kwargs,
+    )
+    for i, record_time in enumerate(times):
+        summary.handle_record(record(10.0 + i, record_time))
+    summary.close()
+    return summary
+
+
+def test_summary(catalog):
+    summarize(
+        catalog,
+        "2024-01-01_12-00-00",
+        "car1",
+        [1000.0, 1020.0, 1040.0],
+        config_hash="abc",
+        counters=lambda: {"crc_failures": 2},
+    )
+
+    (session,) = list_sessions(catalog)
+    assert session["session"] == "2024-01-01_12-00-00"
+    assert session["location"] == "Data/2024-01-01_12-00-00_car_data.csv"
+    assert session["car"] == "car1"
+    assert session["config_hash"] == "abc"
+    assert session["start_time"] == 1000.0
+    assert session["end_time"] == 1040.0
+    assert session["records"] == 3
+    assert session["counters"] == {"crc_failures": 2}
+    assert session["channels"]["speed"] == {"min": 10.0, "max": 12.0, "mean": 11.0}
+    assert session["channels"]["engine_temp"]["mean"] == 90.0
+    assert session["closed"]
+
+
+def test_counters_not_applicable(catalog):
+    summarize(catalog, "unframed", "car1", [1000.0])
+    # Without a framed link there are no counters, rather than counters stuck at 0
+    assert list_sessions(catalog)[0]["counters"] is None
+
+
+class FakeCache:
+    """A local cache that can stall and reject records"""
+
+    def __init__(self):
+        self.records = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.closed = False
+
+    def handle_record(self, data):
+        self.gate.wait()
+        if data["speed"] < 0:
+            raise TransmitterError("Invalid data")
+        self.records.append(data)
+
+    def flush_if_due(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def test_counts_records_the_cache_accepted(catalog):
+    cache = FakeCache()
+    summary = SessionSummary(catalog, "session", FIELDS, sink=cache)
+    summary.handle_record(record(10.0, 1000.0))
+    with pytest.raises(TransmitterError):
+        summary.handle_record(record(-1.0, 1020.0))
+    summary.close()
+    assert cache.closed
+    (session,) = list_sessions(catalog)
+    assert session["records"] == 1
+    assert session["channels"]["speed"]["min"] == 10.0
+
+
+def test_records_dropped_by_background_writer_not_counted(catalog):
+    cache = FakeCache()
+    cache.gate.clear()
+    writer = BackgroundWriter(
+        SessionSummary(catalog, "session", FIELDS, sink=cache),
+        max_queue=1,
+        overflow="drop_newest",
+    )
+    writer.handle_record(record(10.0, 1000.0))
+    # Wait until the writer thread holds the first record, stalled in the cache
+    while writer.stats()["queue_depth"]:
+        time.sleep(0.001)
+    for i in range(1, 4):
+        writer.handle_record(record(10.0 + i, 1000.0 + i * 20))
+    cache.gate.set()
+    writer.close()
+    # The catalog is written on the writer thread, with the records the cache got
+    assert writer.stats()["dropped"] == 2
+    (session,) = list_sessions(catalog)
+    assert session["records"] == len(cache.records) == 2
+
+
+def test_nan_values_are_skipped(catalog):
+    summary = SessionSummary(catalog, "session", FIELDS)
+    summary.handle_record(record(float("nan"), 1000.0))
+    summary.handle_record(record(5.0, 1020.0))
+    summary.handle_record(TelemetryRecord(SCHEMA, ["n/a", 90.0, 1040.0]))
+    assert summary.summary()["channels"]["speed"] == {
+        "min": 5.0,
+        "max": 5.0,
+        "mean": 5.0,
+    }
+    summary.close()
+
+
+def test_updated_incrementally(catalog):
+    with freezegun.freeze_time("2024-01-01 12:00:00") as frozen:
+        summary = SessionSummary(catalog, "session", FIELDS, update_interval=10.0)
+        (session,) = list_sessions(catalog)
+        assert session["records"] == 0
+        assert session["start_time"] is None
+        assert not session["closed"]
+
+        summary.handle_record(record(10.0, 1000.0))
+        assert list_sessions(catalog)[0]["records"] == 0
+        frozen.tick(10)
+        summary.handle_record(record(11.0, 1020.0))
+        assert list_sessions(catalog)[0]["records"] == 2
+
+        # Also written while no records arrive
+        summary.handle_record(record(12.0, 1040.0))
+        frozen.tick(10)
+        summary.flush_if_due()
+        assert list_sessions(catalog)[0]["records"] == 3
+        summary.close()
+
+
+def test_filters(catalog):
+    summarize(catalog, "first", "car1", [1000.0, 2000.0], config_hash="abc")
+    summarize(catalog, "second", "car2", [3000.0, 4000.0], config_hash="def")
+    summarize(catalog, "third", "car1", [5000.0, 6000.0], config_hash="def")
+
+    def names(**filters):
+        return [session["session"] for session in list_sessions(catalog, **filters)]
+
+    assert names() == ["first", "second", "third"]
+    assert names(car="car1") == ["first", "third"]
+    assert names(config_hash="def") == ["second", "third"]
+    assert names(start=2000.0, end=3500.0) == ["first", "second"]
+    assert names(car="car1", start=2500.0) == ["third"]
+
+
+def test_cannot_open_catalog(tmp_path):
+    with pytest.raises(TransmitterError):
+        SessionSummary(str(tmp_path / "missing" / "catalog.db"), "session", FIELDS)
+
+
+def test_cli(catalog, capsys):
+    summarize(catalog, "first", "car1", [0.0, 90000.0])
+    summarize(catalog, "second", "car2", [100000.0])
+    summarize(
+        catalog, "third", "car1", [200000.0], counters=lambda: {"crc_failures": 3}
+    )
+
+    main(["--catalog", catalog, "--car", "car1"])
+    out = capsys.readouterr().out
+    assert out == (
+        "first  car1  2 records  1.5 min  CRC failures n/a  Data/first_car_data.csv\n"
+        "third  car1  1 records  0.0 min  CRC failures 3  Data/third_car_data.csv\n"
+    )
+
+    main(["--catalog", catalog, "--json", "--start", "95000", "--end", "150000"])
+    (line,) = capsys.readouterr().out.splitlines()
+    assert json.loads(line)["session"] == "second"
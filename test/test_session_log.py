@@ -0,0 +1,224 @@
+import csv
+import json
+import struct
+from unittest.mock import MagicMock
+
+import freezegun
+import pytest
+
+from data_transmitter import TransmitterError
+from session_log import (
+    LOG_MAGIC,
+    SessionLogError,
+    SessionLogWriter,
+    export_csv,
+    iter_records,
+    main,
+    read_header,
+    read_session_log,
+)
+from telemetry_record import RecordSchema, TelemetryRecord
+
+FIELDS = ("speed", "sensor1", "distance_traveled", "time")
+SCHEMA = RecordSchema(FIELDS)
+
+
+def record(speed, time):
+    return TelemetryRecord(SCHEMA, [speed, 1, speed * 2, time])
+
+
+@pytest.fixture
+def numpy():
+    """Reading logs into arrays needs the optional NumPy dependency"""
+    return pytest.importorskip("numpy")
+
+
+@pytest.fixture
+def writer(tmp_path):
+    with freezegun.freeze_time("2024-01-01 12:00:00"):
+        log = SessionLogWriter(
+            FIELDS, data_dir=str(tmp_path), car="car1", config_hash="abc"
+        )
+    yield log
+    log.close()
+
+
+def test_creates_log_with_header(writer, tmp_path):
+    assert writer.path == f"{tmp_path}/2024-01-01_12-00-00_car_data.smlog"
+    header = read_header(writer.path)
+    assert header["car"] == "car1"
+    assert header["config_hash"] == "abc"
+    assert header["start_time"] == 1704110400000.0
+    assert header["fields"] == list(FIELDS)
+    assert header["record_size"] == 40  # frame and four doubles
+
+    data = open(writer.path, "rb").read()
+    assert data.startswith(LOG_MAGIC)
+    # Records start 8-byte aligned
+    assert len(data) % 8 == 0
+
+
+def test_round_trip(writer, numpy):
+    for i in range(100):
+        writer.handle_record(record(i / 2, 1000.0 + i * 20))
+    writer.close()
+
+    header, records = read_session_log(writer.path)
+    assert len(records) == 100
+    assert records.dtype.names == FIELDS
+    assert records["speed"][3] == 1.5
+    assert records["time"][-1] == 1000.0 + 99 * 20
+    assert records[10].tolist() == (5.0, 1.0, 10.0, 1200.0)
+
+
+def test_readers_agree(writer, numpy):
+    for i in range(50):
+        writer.handle_record(record(i / 4, 1000.0 + i * 20))
+    writer.close()
+
+    _, records = read_session_log(writer.path)
+    _, rows = iter_records(writer.path)
+    assert list(rows) == records.tolist()
+
+
+def test_without_numpy(writer, tmp_path, monkeypatch):
+    writer.handle_record(record(10.0, 1000.0))
+    writer.close()
+    monkeypatch.setattr("session_log.np", None)
+
+    with pytest.raises(SessionLogError, match="NumPy"):
+        read_session_log(writer.path)
+    # Reading record by record and exporting only need the standard library
+    _, rows = iter_records(writer.path)
+    assert list(rows) == [(10.0, 1.0, 20.0, 1000.0)]
+    csv_path = export_csv(writer.path, str(tmp_path / "out.csv"))
+    assert open(csv_path).read().splitlines()[1] == "10.0,1.0,20.0,1000.0"
+
+
+def test_truncated_record_is_ignored(writer, numpy):
+    writer.handle_record(record(10.0, 1000.0))
+    writer.handle_record(record(11.0, 1020.0))
+    writer.close()
+    with open(writer.path, "r+b") as file:
+        file.truncate(file.seek(0, 2) - 5)
+
+    _, records = read_session_log(writer.path)
+    assert records["speed"].tolist() == [10.0]
+    _, rows = iter_records(writer.path)
+    assert list(rows) == [(10.0, 1.0, 20.0, 1000.0)]
+
+
+def test_corrupt_record_ends_iteration(writer):
+    for i in range(3):
+        writer.handle_record(record(10.0 + i, 1000.0 + i * 20))
+    writer.close()
+    with open(writer.path, "r+b") as file:
+        # Flip a payload byte of the second record, its checksum no longer matches
+        file.seek(-2 * 40 + 12, 2)
+        file.write(b"\xff")
+
+    _, rows = iter_records(writer.path)
+    assert list(rows) == [(10.0, 1.0, 20.0, 1000.0)]
+
+
+def test_empty_log(writer, numpy):
+    writer.close()
+    _, records = read_session_log(writer.path)
+    assert len(records) == 0
+    assert records.dtype.names == FIELDS
+
+
+def test_flush_thresholds(tmp_path, monkeypatch):
+    fsyncs = []
+    monkeypatch.setattr("data_transmitter.os.fsync", fsyncs.append)
+    with freezegun.freeze_time("2024-01-01 12:00:00") as frozen:
+        log = SessionLogWriter(
+            FIELDS, data_dir=str(tmp_path), flush_interval=1.0, flush_bytes=64
+        )
+        assert len(fsyncs) == 1  # the header
+        log.handle_record(record(1.0, 0.0))
+        assert len(fsyncs) == 1
+        log.handle_record(record(1.0, 0.0))
+        assert len(fsyncs) == 2  # size threshold
+        log.handle_record(record(1.0, 0.0))
+        frozen.tick(1.5)
+        log.flush_if_due()
+        assert len(fsyncs) == 3  # interval threshold
+        log.flush_if_due()
+        assert len(fsyncs) == 3
+        log.close()
+
+
+def test_rotation_writes_segment_headers(tmp_path, numpy):
+    archiver = MagicMock()
+    log = SessionLogWriter(
+        FIELDS,
+        data_dir=str(tmp_path),
+        car="car1",
+        flush_bytes=1,
+        rotate_bytes=64,
+        archiver=archiver,
+    )
+    first = log.path
+    for i in range(5):
+        log.handle_record(record(float(i), 1000.0 + i))
+    log.close()
+
+    assert archiver.submit.call_args_list[0].args == (first,)
+    header, records = read_session_log(log.path)
+    assert header["segment"] == 2
+    assert header["car"] == "car1"
+    assert records["speed"].tolist() == [4.0]
+    assert read_session_log(first)[1]["speed"].tolist() == [0.0, 1.0]
+
+
+def test_invalid_records(writer):
+    with pytest.raises(TransmitterError):
+        writer.handle_record(TelemetryRecord(RecordSchema(("time",)), [1.0]))
+    with pytest.raises(TransmitterError):
+        writer.handle_record(record("fast", 1.0))
+    with pytest.raises(TransmitterError):
+        writer.handle_record(None)
+
+
+def test_not_a_session_log(tmp_path, numpy):
+    path = tmp_path / "data.csv"
+    path.write_text("speed,time\n1,2\n")
+    with pytest.raises(SessionLogError):
+        read_header(str(path))
+    with pytest.raises(SessionLogError):
+        read_session_log(str(path))
+
+    header = json.dumps({"version": 99}).encode()
+    path.write_bytes(LOG_MAGIC + struct.pack("<I", len(header)) + header)
+    with pytest.raises(SessionLogError, match="version"):
+        read_header(str(path))
+
+
+def test_export_csv(writer, tmp_path):
+    writer.handle_record(record(10.0, 1000.0))
+    writer.handle_record(record(12.5, 1020.0))
+    writer.close()
+
+    csv_path = export_csv(writer.path)
+    assert csv_path == writer.path.removesuffix(".smlog") + ".csv"
+    with open(csv_path) as file:
+        rows = list(csv.reader(file))
+    assert rows == [
+        list(FIELDS),
+        ["10.0", "1.0", "20.0", "1000.0"],
+        ["12.5", "1.0", "25.0", "1020.0"],
+    ]
+
+
+def test_cli(writer, tmp_path, capsys):
+    writer.handle_record(record(10.0, 1000.0))
+    writer.close()
+    csv_path = str(tmp_path / "out.csv")
+
+    main([writer.path, csv_path])
+    assert capsys.readouterr().out.strip() == csv_path
+    assert open(csv_path).readline().strip() == ",".join(FIELDS)
+
+    with pytest.raises(SystemExit):
+        main([str(tmp_path / "missing.smlog")])
@@ -0,0 +1,182 @@
+import gzip
+import shutil
+
+import freezegun
+import pytest
+
+from data_transmitter import LocalTransmitter
+from session_archive import INDEX_ENTRY
+from session_log import SessionLogWriter
+from session_query import (
+    QueryError,
+    main,
+    parse_time,
+    query_segment,
+    query_session,
+    read_index,
+    session_segments,
+)
+from telemetry_record import RecordSchema, TelemetryRecord
+
+FIELDS = ("speed", "engine_temp", "distance_traveled", "time")
+SCHEMA = RecordSchema(FIELDS)
+
+
+def record(i):
+    return TelemetryRecord(SCHEMA, [i / 2, 100 + i, float(i), 1000.0 + i * 20])
+
+
+def csv_writer(data_dir):
+    return LocalTransmitter(FIELDS, data_dir=data_dir, index_every=10)
+
+
+@pytest.fixture(params=["csv", "smlog"])
+def session(request, tmp_path):
+    """A session of 100 records, every 20 ms from t=1000, in two segments"""
+    with freezegun.freeze_time("2024-01-01 12:00:00"):
+        if request.param == "csv":
+            writer = csv_writer(str(tmp_path))
+        else:
+            writer = SessionLogWriter(FIELDS, data_dir=str(tmp_path))
+    for i in range(100):
+        writer.handle_record(record(i))
+        if i == 59:
+            writer.flush()
+            writer._rotate()
+    writer.close()
+    return session_segments(writer.path)
+
+
+def test_session_segments(session):
+    assert len(session) == 2
+    assert "_car_data.1." in session[1]
+    assert session_segments(session[1]) == session
+    with pytest.raises(QueryError):
+        session_segments("notes.txt")
+
+
+def test_query_range(session):
+    columns = query_session(session[0], start=1190.0, end=1250.0)
+    assert list(columns) == list(FIELDS)
+    assert columns["time"] == [1200.0, 1220.0, 1240.0]
+    assert columns["speed"] == [5.0, 5.5, 6.0]
+
+
+def test_query_across_segments_and_fields(session):
+    columns = query_session(session[1], start=2160.0, end=2220.0, fields=["time"])
+    assert columns == {"time": [2160.0, 2180.0, 2200.0, 2220.0]}
+    assert len(query_session(session[0])["time"]) == 100
+    assert query_session(session[0], start=5000.0)["time"] == []
+
+
+def compress(path, compression):
+    """Archive a segment next to the original, returning the archived path"""
+    if compression == "gzip":
+        with open(path, "rb") as source, gzip.open(path + ".gz", "wb") as target:
+            shutil.copyfileobj(source, target)
+        return path + ".gz"
+    zstandard = pytest.importorskip("zstandard")
+    with open(path, "rb") as source, open(path + ".zst", "wb") as target:
+        zstandard.ZstdCompressor().copy_stream(source, target)
+    return path + ".zst"
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+def test_query_archived_segment(session, compression):
+    archived = compress(session[0], compression)
+    columns = query_segment(archived, start=1500.0, end=1540.0)
+    assert columns["engine_temp"] == [125.0, 126.0, 127.0]
+    assert len(query_segment(archived)["time"]) == 60
+
+
+@pytest.mark.parametrize("file_format", ["csv", "smlog"])
+def test_archived_segment_read_from_index(tmp_path, file_format):
+    with freezegun.freeze_time("2024-01-01 12:00:00"):
+        if file_format == "csv":
+            writer = csv_writer(str(tmp_path))
+        else:
+            writer = SessionLogWriter(FIELDS, data_dir=str(tmp_path), index_every=10)
+    for i in range(35):
+        writer.handle_record(record(i))
+    writer.close()
+    index = read_index(writer.path)
+    archived = compress(writer.path, "zstd")
+
+    # Decompressed as it is read, from the indexed record on
+    with open(writer.path + ".idx", "wb") as file:
+        file.write(INDEX_ENTRY.pack(1000.0, index[2][1]))
+    columns = query_segment(archived, start=1100.0, end=1420.0)
+    assert columns["time"] == [1400.0, 1420.0]
+
+
+def test_malformed_rows_counted(tmp_path):
+    with freezegun.freeze_time("2024-01-01 12:00:00"):
+        writer = LocalTransmitter(FIELDS, data_dir=str(tmp_path), index_every=None)
+    writer.handle_record(record(0))
+    writer.close()
+    with open(writer.path, "a") as file:
+        file.write("1.0,2.0\n1.0,2.0,3.0,4.0,5.0,6.0\n")
+
+    with pytest.warns(UserWarning, match="Skipped 2 rows"):
+        columns = query_segment(writer.path)
+    assert columns["time"] == [1000.0]
+
+
+def test_checksum_column_hidden(session):
+    columns = query_segment(session[0])
+    assert list(columns) == list(FIELDS)
+    with pytest.raises(QueryError, match="crc32"):
+        query_segment(session[0], fields=["crc32"])
+
+
+def test_unknown_field(session):
+    with pytest.raises(QueryError, match="nope"):
+        query_segment(session[0], fields=["speed", "nope"])
+
+
+def test_csv_index(tmp_path):
+    with freezegun.freeze_time("2024-01-01 12:00:00"):
+        writer = csv_writer(str(tmp_path))
+    for i in range(35):
+        writer.handle_record(record(i))
+    writer.close()
+
+    index = read_index(writer.path)
+    assert [time for time, _ in index] == [1000.0, 1200.0, 1400.0, 1600.0]
+    data = open(writer.path, "rb").read()
+    for time, offset in index:
+        assert data[offset:].split(b",")[3].startswith(str(time).encode())
+
+    # The query seeks to the last indexed row before the start, instead of scanning
+    with open(writer.path + ".idx", "wb") as file:
+        file.write(INDEX_ENTRY.pack(1000.0, index[2][1]))
+    assert query_segment(writer.path, start=1100.0, end=1420.0)["time"] == [
+        1400.0,
+        1420.0,
+    ]
+
+    # Without an index the whole segment is scanned
+    (tmp_path / (writer.path.rsplit("/", 1)[1] + ".idx")).unlink()
+    assert len(query_segment(writer.path, start=1100.0, end=1420.0)["time"]) == 17
+
+
+def test_parse_time():
+    assert parse_time("1717236042000") == 1717236042000.0
+    with freezegun.freeze_time(tz_offset=0):
+        assert parse_time("2024-01-01T12:00:00+00:00") == 1704110400000.0
+    with pytest.raises(ValueError):
+        parse_time("yesterday")
+
+
+def test_cli(session, capsys):
+    main(
+        [session[0], "--around", "1200", "--seconds", "0.05", "--fields", "time,speed"]
+    )
+    assert capsys.readouterr().out.splitlines() == [
+        "time,speed",
+        "1180.0,4.5",
+        "1200.0,5.0",
+        "1220.0,5.5",
+    ]
+    with pytest.raises(SystemExit):
+        main([session[0], "--fields", "nope"])
@@ -0,0 +1,138 @@
+import os
+
+import freezegun
+import pytest
+
+from data_transmitter import LocalTransmitter
+from session_log import SessionLogError, SessionLogWriter, iter_records
+from session_query import read_index
+from session_recovery import (
+    RecoveryReport,
+    recover_csv,
+    recover_last_session,
+    recover_session_log,
+)
+from telemetry_record import RecordSchema, TelemetryRecord
+
+FIELDS = ("speed", "distance_traveled", "time")
+SCHEMA = RecordSchema(FIELDS)
+# Frame and three float64 values
+RECORD_SIZE = 32
+
+
+def record(i):
+    return TelemetryRecord(SCHEMA, [i / 2, float(i), 1000.0 + i * 20])
+
+
+def write_log(data_dir, count, timestamp="2024-01-01 12:00:00"):
+    with freezegun.freeze_time(timestamp):
+        writer = SessionLogWriter(FIELDS, data_dir=str(data_dir))
+    for i in range(count):
+        writer.handle_record(record(i))
+    writer.close()
+    return writer.path
+
+
+def write_csv(data_dir, count, timestamp="2024-01-01 12:00:00"):
+    with freezegun.freeze_time(timestamp):
+        writer = LocalTransmitter(FIELDS, data_dir=str(data_dir), index_every=5)
+    for i in range(count):
+        writer.handle_record(record(i))
+    writer.close()
+    return writer.path
+
+
+def test_clean_log_is_untouched(tmp_path):
+    path = write_log(tmp_path, 10)
+    size = os.path.getsize(path)
+    assert recover_session_log(path) == RecoveryReport(path, 10, 0)
+    assert os.path.getsize(path) == size
+
+
+def test_torn_record_is_truncated(tmp_path):
+    path = write_log(tmp_path, 10)
+    size = os.path.getsize(path)
+    with open(path, "r+b") as file:
+        file.truncate(size - 7)
+
+    assert recover_session_log(path) == RecoveryReport(path, 9, RECORD_SIZE - 7)
+    assert os.path.getsize(path) == size - RECORD_SIZE
+
+
+def test_corrupt_record_ends_valid_data(tmp_path):
+    path = write_log(tmp_path, 10)
+    size = os.path.getsize(path)
+    with open(path, "r+b") as file:
+        # Garbage in the payload of the 8th record, then zeroed blocks
+        file.seek(size - 3 * RECORD_SIZE + 12)
+        file.write(b"\xff\xff")
+        file.seek(size)
+        file.write(bytes(4096))
+
+    report = recover_session_log(path)
+    assert report.records == 7
+    assert report.truncated_bytes == 3 * RECORD_SIZE + 4096
+    # The zeroed blocks fail their checksum like the corrupt record
+    assert report.dropped_records == 3 + 4096 // RECORD_SIZE
+    _, records = iter_records(path)
+    assert len(list(records)) == 7
+
+
+def test_unreadable_log(tmp_path):
+    path = tmp_path / "2024-01-01_12-00-00_car_data.smlog"
+    path.write_bytes(b"SMLOG")
+    with pytest.raises(SessionLogError):
+        recover_session_log(str(path))
+
+
+def test_csv_torn_line_and_index(tmp_path):
+    path = write_csv(tmp_path, 11)
+    assert len(read_index(path)) == 3
+    with open(path, "r+b") as file:
+        file.truncate(os.path.getsize(path) - 4)
+
+    report = recover_csv(path)
+    assert report.records == 10
+    with open(path, "rb") as file:
+        assert file.read().endswith(b"\r\n")
+    # The index entry of the torn row is dropped, the others still point at rows
+    assert [time for time, _ in read_index(path)] == [1000.0, 1100.0]
+
+
+def test_csv_corrupt_row_ends_valid_data(tmp_path):
+    path = write_csv(tmp_path, 10)
+    with open(path, "rb") as file:
+        rows = file.readlines()
+    size = sum(map(len, rows))
+    with open(path, "r+b") as file:
+        # A flipped digit in the 8th row, then garbage that happens to end in a newline
+        file.seek(size - sum(map(len, rows[-3:])))
+        file.write(b"9")
+        file.seek(size)
+        file.write(bytes(100) + b"\n")
+
+    report = recover_csv(path)
+    assert report == RecoveryReport(path, 7, sum(map(len, rows[-3:])) + 101, 4)
+    with open(path, "rb") as file:
+        assert file.readlines() == rows[:-3]
+
+
+def test_csv_without_checksum_column(tmp_path):
+    path = tmp_path / "2024-01-01_12-00-00_car_data.csv"
+    path.write_bytes(b"speed,time\r\n0.0,1000.0\r\n0.5,1020.0\r\n1.0,10")
+
+    assert recover_csv(str(path)) == RecoveryReport(str(path), 2, 6)
+    assert path.read_bytes().endswith(b"1020.0\r\n")
+
+
+def test_recover_last_session(tmp_path):
+    assert recover_last_session(str(tmp_path / "missing")) is None
+    assert recover_last_session(str(tmp_path)) is None
+
+    write_log(tmp_path, 5, "2024-01-01 12:00:00")
+    latest = write_csv(tmp_path, 5, "2024-01-02 12:00:00")
+    with open(latest, "ab") as file:
+        file.write(b"1.5,3")
+
+    report = recover_last_session(str(tmp_path))
+    assert report == RecoveryReport(latest, 5, 5)
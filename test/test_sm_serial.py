@@ -1,9 +1,13 @@
+import asyncio
+import os
 import struct
 from unittest.mock import MagicMock, patch
 
 import pytest
 import serial
 
+from serial_capture import CaptureWriter, read_capture
+from serial_framing import encode_frame
 from sm_serial import SmSerial, SmSerialError
 
 DEFAULT_PACKET = struct.pack(
@@ -73,6 +77,35 @@ class TestSmSerial:
         assert sm_serial_live.read_response(23) == DEFAULT_PACKET
         assert mock_serial.return_value.read.call_count == 3
 
+    def test_read_packets(self, sm_serial_live, mock_serial):
+        instance = mock_serial.return_value
+        instance.in_waiting = 2 * 23 + 5
+        instance.read.side_effect = [DEFAULT_PACKET * 2 + DEFAULT_PACKET[:5]]
+        packets = sm_serial_live.read_packets(23)
+        assert [bytes(packet) for packet in packets] == [DEFAULT_PACKET] * 2
+        assert all(isinstance(packet, memoryview) for packet in packets)
+        instance.read.assert_called_once_with(2 * 23 + 5)
+
+        # The partial packet is completed by the next read
+        instance.in_waiting = 18
+        instance.read.side_effect = [DEFAULT_PACKET[5:]]
+        assert [bytes(packet) for packet in sm_serial_live.read_packets(23)] == [
+            DEFAULT_PACKET
+        ]
+
+    def test_read_packets_nothing_waiting(self, sm_serial_live, mock_serial):
+        instance = mock_serial.return_value
+        instance.in_waiting = 0
+        instance.read.side_effect = [b""]
+        assert sm_serial_live.read_packets(23) == []
+        instance.read.assert_called_once_with(23)
+
+    def test_read_packets_testing_mode(self, monkeypatch):
+        monkeypatch.setenv("TESTING", "True")
+        sm_serial = SmSerial()
+        assert sm_serial.read_packets(23) == [DEFAULT_PACKET]
+        assert sm_serial.read_packets(23) == []
+
     def test_read_response_testing_mode(self, mock_serial, monkeypatch):
         monkeypatch.setenv("TESTING", "True")
         sm_serial = SmSerial()
@@ -82,15 +115,20 @@ class TestSmSerial:
 
     def test_crashloop_retry(self, monkeypatch):
         monkeypatch.setenv("TESTING", "False")
+        closed = MagicMock(is_open=False)
         with (
             patch("sm_serial.sleep") as mock_sleep,
             patch(
                 "serial.Serial",
-                side_effect=[serial.SerialException("Other error"), MagicMock()],
-            ),
+                side_effect=[serial.SerialException("Other error"), closed],
+            ) as mock_serial,
         ):
-            SmSerial(crashloop=True)
-            mock_sleep.assert_called_once_with(3)
+            sm_serial = SmSerial(port="/dev/ttyUSB0", crashloop=True)
+        # The port is left closed for the reconnect task instead of retried here
+        mock_sleep.assert_not_called()
+        assert mock_serial.call_args.args == ()
+        assert closed.port == "/dev/ttyUSB0"
+        assert not sm_serial.is_open()
 
     def test_read_response_failure(self, sm_serial_live, mock_serial):
         mock_serial.return_value.read.side_effect = serial.SerialException("Read error")
@@ -104,3 +142,173 @@ class TestSmSerial:
     def test_close(self, sm_serial_live, mock_serial):
         sm_serial_live.close()
         mock_serial.return_value.close.assert_called_once()
+
+    def test_read_response_framed(self, mock_serial, monkeypatch):
+        monkeypatch.setenv("TESTING", "False")
+        sm_serial = SmSerial(framed=True)
+        stream = b"\x00" + encode_frame(DEFAULT_PACKET) * 2
+        mock_serial.return_value.in_waiting = len(stream)
+        mock_serial.return_value.read.side_effect = [stream]
+        assert sm_serial.read_response(23) == DEFAULT_PACKET
+        mock_serial.return_value.read.assert_called_once_with(len(stream))
+        stats = sm_serial.stats()
+        assert stats["frames_decoded"] == 2
+        assert stats["resync_events"] == 1
+
+    def test_stats_unframed(self, sm_serial_live):
+        assert sm_serial_live.stats() == {}
+
+    @pytest.mark.asyncio
+    async def test_iter_packets_testing_mode(self, monkeypatch):
+        monkeypatch.setenv("TESTING", "True")
+        packets = SmSerial(timeout=0.001).iter_packets(23)
+        assert await packets.__anext__() == [DEFAULT_PACKET]
+        assert await packets.__anext__() == [DEFAULT_PACKET]
+        await packets.aclose()
+
+    @pytest.mark.asyncio
+    async def test_iter_packets_wakes_on_readable_fd(self, sm_serial_live, mock_serial):
+        read_fd, write_fd = os.pipe()
+        instance = mock_serial.return_value
+        instance.fileno.return_value = read_fd
+        instance.in_waiting = 23
+        instance.read.side_effect = [DEFAULT_PACKET]
+        try:
+            packets = sm_serial_live.iter_packets(23)
+            next_batch = asyncio.ensure_future(packets.__anext__())
+            await asyncio.sleep(0.01)
+            assert not next_batch.done()  # nothing readable yet, no busy polling
+
+            os.write(write_fd, b"x")
+            batch = await asyncio.wait_for(next_batch, 1)
+            assert [bytes(packet) for packet in batch] == [DEFAULT_PACKET]
+            await packets.aclose()
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
+
+    @pytest.mark.asyncio
+    async def test_iter_packets_reconnects_in_background(
+        self, sm_serial_live, mock_serial
+    ):
+        read_fd, write_fd = os.pipe()
+        instance = mock_serial.return_value
+        instance.is_open = False
+        instance.open.side_effect = lambda: setattr(instance, "is_open", True)
+        instance.fileno.return_value = read_fd
+        instance.in_waiting = 23
+        instance.read.side_effect = [DEFAULT_PACKET]
+        os.write(write_fd, b"x")
+        try:
+            packets = sm_serial_live.iter_packets(23)
+            batch = await asyncio.wait_for(packets.__anext__(), 1)
+            assert [bytes(packet) for packet in batch] == [DEFAULT_PACKET]
+            instance.open.assert_called_once()
+            await packets.aclose()
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
+
+    def test_read_packets_nonblocking_spurious_wakeup(
+        self, sm_serial_live, mock_serial
+    ):
+        read_fd, write_fd = os.pipe()
+        instance = mock_serial.return_value
+        instance.fileno.return_value = read_fd
+        instance.in_waiting = 0
+        try:
+            assert sm_serial_live.read_packets(23, block=False) == []
+            instance.read.assert_not_called()
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
+
+    def test_read_packets_nonblocking_disconnect(self, sm_serial_live, mock_serial):
+        read_fd, write_fd = os.pipe()
+        os.close(write_fd)  # the read end now reports a hangup
+        mock_serial.return_value.fileno.return_value = read_fd
+        mock_serial.return_value.in_waiting = 0
+        try:
+            with pytest.raises(SmSerialError, match="disconnect"):
+                sm_serial_live.read_packets(23, block=False)
+        finally:
+            os.close(read_fd)
+
+    @pytest.mark.asyncio
+    async def test_iter_packets_pty(self, monkeypatch):
+        monkeypatch.setenv("TESTING", "False")
+        master, slave = os.openpty()
+        sm_serial = SmSerial(port=os.ttyname(slave))
+        closes = []
+        monkeypatch.setattr(sm_serial._ser, "close", lambda: closes.append(True))
+
+        async def feed():
+            for _ in range(200):
+                os.write(master, DEFAULT_PACKET)
+                await asyncio.sleep(0.005)
+
+        writer = asyncio.ensure_future(feed())
+        received = 0
+        packets = sm_serial.iter_packets(23)
+        try:
+            while received < 200:
+                batch = await asyncio.wait_for(packets.__anext__(), 1)
+                assert all(bytes(packet) == DEFAULT_PACKET for packet in batch)
+                received += len(batch)
+            assert closes == []
+
+            # A real hangup still closes the port
+            os.close(master)
+            master = None
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(packets.__anext__(), 0.2)
+            assert closes
+        finally:
+            await writer
+            await packets.aclose()
+            if master is not None:
+                os.close(master)
+            monkeypatch.undo()
+            sm_serial._ser.close()
+            os.close(slave)
+
+    def test_capture_raw_reads(self, mock_serial, monkeypatch, tmp_path):
+        capture_path = str(tmp_path / "capture.smcap")
+        monkeypatch.setenv("TESTING", "False")
+        monkeypatch.setenv("SERIAL_CAPTURE_FILE", capture_path)
+        sm_serial = SmSerial()
+        mock_serial.return_value.in_waiting = 23
+        mock_serial.return_value.read.side_effect = [DEFAULT_PACKET]
+        sm_serial.read_packets(23)
+        sm_serial.close()
+        _, chunks = read_capture(capture_path)
+        assert [chunk for _, chunk in chunks] == [DEFAULT_PACKET]
+
+    @pytest.mark.asyncio
+    async def test_replay_capture(self, mock_serial, monkeypatch, tmp_path):
+        capture_path = str(tmp_path / "capture.smcap")
+        writer = CaptureWriter(capture_path)
+        writer.write(DEFAULT_PACKET * 2 + DEFAULT_PACKET[:3])
+        writer.write(DEFAULT_PACKET[3:])
+        writer.close()
+        monkeypatch.setenv("TESTING", "False")
+        monkeypatch.setenv("SERIAL_REPLAY_FILE", capture_path)
+        monkeypatch.setenv("SERIAL_REPLAY_SPEED", "0")
+
+        sm_serial = SmSerial()
+        assert sm_serial.is_open()
+        mock_serial.assert_not_called()
+        batches = [batch async for batch in sm_serial.iter_packets(23)]
+        assert [[bytes(p) for p in batch] for batch in batches] == [
+            [DEFAULT_PACKET] * 2,
+            [DEFAULT_PACKET],
+        ]
+
+    def test_synthetic_testing_mode(self, mock_serial, monkeypatch):
+        monkeypatch.setenv("TESTING", "True")
+        monkeypatch.setenv("SYNTHETIC_TELEMETRY", "rate=1000000,seed=1")
+        sm_serial = SmSerial(timeout=0.001)
+        packets = sm_serial.read_packets(23)
+        assert packets
+        assert all(len(packet) == 23 for packet in packets)
+        mock_serial.assert_not_called()
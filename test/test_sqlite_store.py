@@ -0,0 +1,148 @@
+import sqlite3
+from unittest.mock import MagicMock
+
+import freezegun
+import pytest
+
+from data_transmitter import TransmitterError
+from sqlite_store import SQLiteTransmitter, list_sessions, query_records
+from telemetry_record import RecordSchema, TelemetryRecord
+
+FIELDS = ("speed", "engine_temp", "time")
+SCHEMA = RecordSchema(FIELDS)
+
+
+def record(i):
+    return TelemetryRecord(SCHEMA, [i / 2, 100 + i, 1000.0 + i * 20])
+
+
+@pytest.fixture
+def database(tmp_path):
+    return str(tmp_path / "telemetry.db")
+
+
+@pytest.fixture
+def store(database):
+    store = SQLiteTransmitter(FIELDS, database=database, car="car1", config_hash="abc")
+    yield store
+    store.close()
+
+
+def count_records(database):
+    with sqlite3.connect(database) as connection:
+        return connection.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+
+def test_creates_session_in_wal_mode(store, database):
+    with sqlite3.connect(database) as connection:
+        assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    (session,) = list_sessions(database)
+    assert session["id"] == store.session
+    assert session["car"] == "car1"
+    assert session["config_hash"] == "abc"
+    assert session["fields"] == list(FIELDS)
+
+
+def test_batches_by_count_and_time(database):
+    with freezegun.freeze_time("2024-01-01 12:00:00") as frozen:
+        store = SQLiteTransmitter(
+            FIELDS, database=database, batch_size=3, flush_interval=1.0
+        )
+        store.handle_record(record(0))
+        store.handle_record(record(1))
+        assert count_records(database) == 0
+        store.handle_record(record(2))
+        assert count_records(database) == 3
+
+        store.handle_record(record(3))
+        store.flush_if_due()
+        assert count_records(database) == 3
+        frozen.tick(1.5)
+        store.flush_if_due()
+        assert count_records(database) == 4
+        store.close()
+
+
+def test_query_records(store, database):
+    for i in range(50):
+        store.handle_record(record(i))
+    store.flush()
+
+    columns = query_records(database, store.session, start=1190.0, end=1250.0)
+    assert columns == {
+        "speed": [5.0, 5.5, 6.0],
+        "engine_temp": [110, 111, 112],
+        "time": [1200.0, 1220.0, 1240.0],
+    }
+    assert query_records(database, store.session, fields=["time"])["time"][-1] == 1980.0
+    with pytest.raises(ValueError):
+        query_records(database, store.session, fields=["nope"])
+    with pytest.raises(ValueError):
+        query_records(database, store.session + 1)
+
+
+def test_sessions_with_different_fields(store, database):
+    store.handle_record(record(0))
+    store.close()
+    other = SQLiteTransmitter(("speed", "voltage", "time"), database=database)
+    other.handle_record(
+        TelemetryRecord(RecordSchema(("speed", "voltage", "time")), [1.0, 12.5, 5.0])
+    )
+    other.close()
+
+    assert [session["fields"][1] for session in list_sessions(database)] == [
+        "engine_temp",
+        "voltage",
+    ]
+    assert query_records(database, other.session) == {
+        "speed": [1.0],
+        "voltage": [12.5],
+        "time": [5.0],
+    }
+    assert query_records(database, store.session)["engine_temp"] == [100]
+
+
+def test_disk_full_keeps_newest_records(database):
+    with freezegun.freeze_time("2024-01-01 12:00:00") as frozen:
+        store = SQLiteTransmitter(
+            FIELDS,
+            database=database,
+            batch_size=2,
+            max_buffered=5,
+            retry_interval=1.0,
+        )
+        connection = store._connection
+        store._connection = MagicMock()
+        store._connection.executemany.side_effect = sqlite3.OperationalError(
+            "database or disk is full"
+        )
+        store.handle_record(record(0))
+        with pytest.raises(TransmitterError, match="2 records kept"):
+            store.handle_record(record(1))
+
+        # No retry on every record, and the oldest are dropped over the bound
+        for i in range(2, 8):
+            store.handle_record(record(i))
+        assert store._connection.executemany.call_count == 1
+        assert store.dropped == 3
+
+        store._connection = connection
+        frozen.tick(1.5)
+        store.flush_if_due()
+        records = query_records(database, store.session, fields=["time"])
+        assert records["time"] == [1000.0 + i * 20 for i in range(3, 8)]
+        store.close()
+
+
+def test_invalid_records(store):
+    with pytest.raises(TransmitterError):
+        store.handle_record(None)
+    with pytest.raises(TransmitterError):
+        store.handle_record({"speed": 1.0})
+    with pytest.raises(TransmitterError, match="reserved"):
+        SQLiteTransmitter(("session", "time"), database=":memory:")
+
+
+def test_unusable_database(tmp_path):
+    with pytest.raises(TransmitterError):
+        SQLiteTransmitter(FIELDS, database=str(tmp_path / "missing" / "telemetry.db"))
@@ -0,0 +1,92 @@
+import struct
+from unittest.mock import patch
+
+import pytest
+
+from configuration_generator import DEFAULT_PACKET_LAYOUT, PacketLayout
+from serial_framing import FrameDecoder
+from synthetic_telemetry import SyntheticTelemetry
+
+PACKET_FORMAT = DEFAULT_PACKET_LAYOUT.format
+PACKET_SIZE = DEFAULT_PACKET_LAYOUT.size
+
+
+def test_deterministic_from_seed():
+    first = SyntheticTelemetry(seed=3, corruption_rate=0.1, gap_rate=0.01)
+    second = SyntheticTelemetry(seed=3, corruption_rate=0.1, gap_rate=0.01)
+    other = SyntheticTelemetry(seed=4, corruption_rate=0.1, gap_rate=0.01)
+    stream = first.generate(500)
+    assert stream == second.generate(200) + second.generate(300)
+    assert stream != other.generate(500)
+
+
+def test_realistic_values():
+    source = SyntheticTelemetry(rate_hz=10)
+    stream = source.generate(600)  # one full burn/coast cycle
+    packets = list(struct.iter_unpack(PACKET_FORMAT, stream))
+    speeds = [packet[0] for packet in packets]
+    assert 13 < min(speeds) and max(speeds) < 27
+    assert {packet[4] for packet in packets} == {0, 1}  # engine burns and coasts
+    assert all(0 <= packet[9] <= 1023 for packet in packets)
+
+
+def test_custom_layout():
+    layout = PacketLayout.from_list(
+        [
+            {"name": "speed", "type": "d"},
+            {"channel": "channelA0", "type": "I"},
+            {"channel": "channel9", "type": "h"},
+        ]
+    )
+    stream = SyntheticTelemetry(layout=layout).generate(10)
+    packets = list(struct.iter_unpack(layout.format, stream))
+    assert len(packets) == 10
+    assert all(packet[2] == 0 for packet in packets)  # unknown channels are zero
+
+
+def test_gaps_drop_packets():
+    source = SyntheticTelemetry(gap_rate=0.05, gap_length=5)
+    stream = source.generate(1000)
+    assert len(stream) % PACKET_SIZE == 0
+    assert len(stream) < 1000 * PACKET_SIZE
+
+
+def test_bursts_keep_every_packet():
+    source = SyntheticTelemetry(burst_rate=0.1, burst_length=5)
+    sizes = [len(source.generate(1)) for _ in range(200)]
+    assert sum(sizes) == 200 * PACKET_SIZE
+    assert 0 in sizes and max(sizes) == 5 * PACKET_SIZE
+
+
+def test_framed_corruption_detected():
+    source = SyntheticTelemetry(framed=True, corruption_rate=0.2, seed=1)
+    decoder = FrameDecoder()
+    frames = decoder.feed(source.generate(500))
+    assert 300 < len(frames) < 500
+    assert all(len(frame) == PACKET_SIZE for frame in frames)
+    assert decoder.resync_events > 0
+
+
+def test_read_paced_by_rate():
+    with patch("synthetic_telemetry.time.monotonic_ns") as mock_clock:
+        mock_clock.return_value = 0
+        source = SyntheticTelemetry(rate_hz=1000)
+        assert len(source.read()) == PACKET_SIZE
+        assert source.time_until_next() == pytest.approx(0.001)
+
+        mock_clock.return_value = 10_000_000  # 10 ms later
+        assert len(source.read()) == 10 * PACKET_SIZE
+        assert source.read() == b""
+
+        mock_clock.return_value = 60_000_000_000  # stalled for a minute
+        assert len(source.read()) == 1000 * PACKET_SIZE
+
+
+def test_from_spec():
+    source = SyntheticTelemetry.from_spec("rate=500, seed=2,bursts=0.5")
+    assert source._rate_hz == 500
+    assert source._burst_rate == 0.5
+    with pytest.raises(ValueError, match="Unknown"):
+        SyntheticTelemetry.from_spec("speed=4")
+    with pytest.raises(ValueError):
+        SyntheticTelemetry(rate_hz=0)
@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+from telemetry_batch import (
+    BATCH_HEADER,
+    batch_sequence,
+    decode_batch,
+    dictionary_id,
+    encode_batch,
+    encode_dictionary,
+)
+
+FIELDS = ("speed", "engine_temp", "time")
+
+
+def test_round_trip():
+    dictionary = dictionary_id(FIELDS, "abc")
+    rows = [[10.0 + i, 90.5, 1000.0 + i * 20] for i in range(50)]
+    payload = encode_batch(dictionary, rows)
+
+    assert decode_batch(payload, {dictionary: FIELDS}) == (
+        dictionary,
+        {
+            "speed": [10.0 + i for i in range(50)],
+            "engine_temp": [90.5] * 50,
+            "time": [1000.0 + i * 20 for i in range(50)],
+        },
+    )
+    # Far smaller than the same records as text
+    assert len(payload) < len(str([dict(zip(FIELDS, row)) for row in rows])) / 4
+
+
+def test_sequence():
+    dictionary = dictionary_id(FIELDS)
+    rows = [[1.0, 2.0, 3.0]]
+    payload = encode_batch(dictionary, rows, sequence=2**40)
+    assert batch_sequence(payload) == 2**40
+    assert decode_batch(payload, {dictionary: FIELDS})[1]["time"] == [3.0]
+    # Batches sent without an outbox have no sequence number
+    assert batch_sequence(encode_batch(dictionary, rows)) is None
+    with pytest.raises(ValueError, match="too short"):
+        batch_sequence(payload[: BATCH_HEADER.size])
+
+
+def test_dictionary():
+    dictionary = dictionary_id(FIELDS, "abc")
+    assert json.loads(encode_dictionary(FIELDS, "abc")) == {
+        "dictionary": dictionary,
+        "config_hash": "abc",
+        "fields": list(FIELDS),
+    }
+    # The id changes with the fields or the configuration
+    assert dictionary_id(FIELDS[:2], "abc") != dictionary
+    assert dictionary_id(FIELDS, "def") != dictionary
+
+
+def test_invalid_records():
+    dictionary = dictionary_id(FIELDS)
+    with pytest.raises(ValueError, match="same fields"):
+        encode_batch(dictionary, [[1.0, 2.0, 3.0], [1.0, 2.0]])
+    with pytest.raises(ValueError, match="numeric"):
+        encode_batch(dictionary, [[1.0, None, 3.0]])
+
+
+def test_invalid_messages():
+    dictionary = dictionary_id(FIELDS)
+    payload = encode_batch(dictionary, [[1.0, 2.0, 3.0]])
+    with pytest.raises(ValueError, match="too short"):
+        decode_batch(payload[:4], {dictionary: FIELDS})
+    with pytest.raises(ValueError, match="Not a supported"):
+        decode_batch(b"XYZ" + payload[3:], {dictionary: FIELDS})
+    with pytest.raises(ValueError, match="Unknown field dictionary"):
+        decode_batch(payload, {dictionary_id(FIELDS, "other"): FIELDS})
+    with pytest.raises(ValueError, match="its dictionary has 2"):
+        decode_batch(payload, {dictionary: FIELDS[:2]})
+    with pytest.raises(ValueError, match="Corrupt"):
+        decode_batch(payload[: BATCH_HEADER.size] + b"garbage", {dictionary: FIELDS})
@@ -0,0 +1,116 @@
+from unittest.mock import patch
+
+import pytest
+
+from telemetry_clock import Odometer, TelemetryClock
+
+
+class FakeTime:
+    """Monotonic and wall clocks that tests can move independently"""
+
+    def __init__(self, mono=1_000_000_000, wall=1_700_000_000_000_000_000):
+        self.mono = mono
+        self.wall = wall
+
+    def advance(self, seconds, wall_drift=0.0):
+        self.mono += int(seconds * 1e9)
+        self.wall += int(seconds * (1 + wall_drift) * 1e9)
+
+    def monotonic_ns(self):
+        return self.mono
+
+    def time_ns(self):
+        return self.wall
+
+
+@pytest.fixture
+def fake_time():
+    fake = FakeTime()
+    with (
+        patch("telemetry_clock.time.monotonic_ns", fake.monotonic_ns),
+        patch("telemetry_clock.time.time_ns", fake.time_ns),
+    ):
+        yield fake
+
+
+def test_wall_time_is_anchored(fake_time):
+    clock = TelemetryClock()
+    stamp = clock.now_ns()
+    assert stamp == fake_time.mono
+    assert clock.to_wall_ns(stamp) == fake_time.wall
+    assert clock.to_wall_ms(stamp) == fake_time.wall / 1_000_000
+
+
+def test_wall_time_follows_monotonic_when_wall_clock_jumps_back(fake_time):
+    clock = TelemetryClock(resync_interval=60)
+    first = clock.to_wall_ns(clock.now_ns())
+    fake_time.advance(1)
+    fake_time.wall -= 3_600_000_000_000
+    second = clock.to_wall_ns(clock.now_ns())
+    assert second - first == 1_000_000_000
+
+
+def test_drift_is_slewed(fake_time):
+    clock = TelemetryClock(resync_interval=60, max_slew=0.0005)
+    previous = clock.to_wall_ns(clock.now_ns())
+    # The wall clock runs 100 ppm fast, well inside the slew limit
+    for _ in range(100):
+        fake_time.advance(10, wall_drift=0.0001)
+        stamp = clock.to_wall_ns(clock.now_ns())
+        assert stamp > previous
+        previous = stamp
+    assert abs(previous - fake_time.wall) < 10_000_000
+    assert clock.steps == 0
+
+
+def test_large_error_steps(fake_time):
+    clock = TelemetryClock(resync_interval=60, step_threshold=1)
+    clock.now_ns()
+    # NTP sets the clock an hour forward after boot
+    fake_time.advance(61)
+    fake_time.wall += 3_600_000_000_000
+    stamp = clock.now_ns()
+    assert clock.to_wall_ns(stamp) == fake_time.wall
+    assert clock.steps == 1
+
+
+def test_spread(fake_time):
+    clock = TelemetryClock()
+    start = clock.now_ns()
+    fake_time.advance(0.3)
+    stamps = clock.spread(3)
+    assert stamps == [start + 100_000_000, start + 200_000_000, start + 300_000_000]
+    assert clock.spread(0) == []
+
+
+def test_spread_after_idle(fake_time):
+    clock = TelemetryClock(max_spacing=0.05)
+    clock.now_ns()
+    # No packets for 2 s, then a batch: recent packets, not back-dated across the gap
+    fake_time.advance(2)
+    now = fake_time.mono
+    assert clock.spread(3) == [now - 100_000_000, now - 50_000_000, now]
+
+
+def test_odometer_trapezoid():
+    odometer = Odometer()
+    assert odometer.update(30.0, 0) == 0
+    assert odometer.update(30.0, 1_000_000_000) == pytest.approx(44.0)
+    assert odometer.update(0.0, 2_000_000_000) == pytest.approx(66.0)
+
+
+def test_odometer_rejects_bad_samples():
+    odometer = Odometer(max_speed=100, max_gap=2)
+    odometer.update(30.0, 0)
+    for speed in (float("nan"), float("inf"), -1.0, 101.0):
+        assert odometer.update(speed, 500_000_000) == 0
+    # Same timestamp and going backwards add nothing
+    assert odometer.update(30.0, 0) == 0
+    assert odometer.update(30.0, -1) == 0
+    # Gaps longer than max_gap are not integrated across
+    assert odometer.update(30.0, 5_000_000_000) == 0
+    assert odometer.update(30.0, 6_000_000_000) == pytest.approx(44.0)
+
+    odometer.reset()
+    assert odometer.distance == 0
+    assert odometer.update(30.0, 7_000_000_000) == 0
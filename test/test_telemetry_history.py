@@ -0,0 +1,70 @@
+import pytest
+
+from telemetry_history import TelemetryHistory
+from telemetry_record import RecordSchema, TelemetryRecord
+
+SCHEMA = RecordSchema(["speed", "distance_traveled", "time"])
+
+
+def record(time, speed=10.0):
+    return TelemetryRecord(SCHEMA, [speed, time / 10, time])
+
+
+def test_append_and_window():
+    history = TelemetryHistory(SCHEMA, 5)
+    assert len(history) == 0
+    assert history.oldest_time() is None
+    assert history.window()["time"].tolist() == []
+
+    history.extend(record(t) for t in (100, 200, 300))
+    assert len(history) == 3
+    window = history.window()
+    assert list(window) == ["speed", "distance_traveled", "time"]
+    assert window["time"].tolist() == [100, 200, 300]
+    assert history.window(start=150, end=300)["time"].tolist() == [200, 300]
+    assert history.window(end=250)["distance_traveled"].tolist() == [10, 20]
+
+
+def test_wraps_and_drops_oldest():
+    history = TelemetryHistory(SCHEMA, 4)
+    for t in range(1, 12):
+        history.append(record(t * 100, speed=t))
+        # The newest records are always one contiguous window
+        expected = list(range(max(1, t - 3), t + 1))
+        assert history.window()["speed"].tolist() == expected
+    assert len(history) == 4
+    assert history.oldest_time() == 800
+    assert history.newest_time() == 1100
+    assert history.window(start=850, end=1050)["time"].tolist() == [900, 1000]
+
+
+def test_window_is_zero_copy():
+    history = TelemetryHistory(SCHEMA, 3)
+    history.extend(record(t) for t in (100, 200))
+    view = history.window()["speed"]
+    assert isinstance(view, memoryview)
+    assert view.obj is history._columns[0]
+
+
+def test_last_seconds():
+    history = TelemetryHistory(SCHEMA, 100)
+    assert history.last(1)["time"].tolist() == []
+    history.extend(record(t) for t in range(0, 5000, 500))
+    assert history.last(1)["time"].tolist() == [3500, 4000, 4500]
+
+
+def test_clock_stepped_back_clears():
+    history = TelemetryHistory(SCHEMA, 10)
+    history.extend(record(t) for t in (100, 200))
+    history.append(record(50))
+    assert history.window()["time"].tolist() == [50]
+
+
+def test_invalid():
+    with pytest.raises(ValueError, match="capacity"):
+        TelemetryHistory(SCHEMA, 0)
+    with pytest.raises(ValueError, match="time"):
+        TelemetryHistory(RecordSchema(["speed"]), 10)
+    history = TelemetryHistory(SCHEMA, 10)
+    with pytest.raises(ValueError, match="schema"):
+        history.append(TelemetryRecord(RecordSchema(["time"]), [1.0]))
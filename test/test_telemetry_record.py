@@ -0,0 +1,48 @@
+import json
+import sys
+
+import pytest
+
+from telemetry_record import RecordSchema, TelemetryRecord
+
+
+@pytest.fixture
+def schema():
+    return RecordSchema(["speed", "voltage", "distance_traveled", "time"])
+
+
+def test_mapping_access(schema):
+    record = TelemetryRecord(schema, [25.5, 12.1, 10.0, 1000.5])
+    assert record["speed"] == 25.5
+    assert record.get("missing") is None
+    assert "voltage" in record and "missing" not in record
+    assert list(record) == ["speed", "voltage", "distance_traveled", "time"]
+    assert record.values() == [25.5, 12.1, 10.0, 1000.5]
+    assert len(record) == 4
+    with pytest.raises(KeyError):
+        record["missing"]
+
+
+def test_conversions(schema):
+    values = [25.5, 12.1, 10.0, 1000.5]
+    expected = dict(zip(schema.fields, values))
+    record = TelemetryRecord(schema, values)
+    assert record.to_dict() == expected
+    assert record == expected
+    assert json.loads(record.to_json()) == expected
+    assert str(record) == str(expected)
+
+
+def test_invalid_records(schema):
+    with pytest.raises(ValueError, match="Expected 4 values"):
+        TelemetryRecord(schema, [1.0])
+    with pytest.raises(ValueError, match="Duplicate"):
+        RecordSchema(["speed", "speed"])
+
+
+def test_record_is_smaller_than_dict(schema):
+    values = [25.5, 12.1, 10.0, 1000.5]
+    record = TelemetryRecord(schema, values)
+    assert not hasattr(record, "__dict__")
+    record_size = sys.getsizeof(record) + sys.getsizeof(values)
+    assert record_size < sys.getsizeof(record.to_dict())
@@ -0,0 +1,105 @@
+import freezegun
+import pytest
+
+from uplink_controller import UplinkController
+
+
+@pytest.fixture
+def frozen():
+    with freezegun.freeze_time("2024-01-01 12:00:00") as frozen:
+        yield frozen
+
+
+def admitted(controller, frozen, count, interval):
+    """Offer count records, interval seconds apart, and count the admitted ones"""
+    total = 0
+    for _ in range(count):
+        frozen.tick(interval)
+        total += controller.admit()
+    return total
+
+
+def test_rate_limits_records(frozen):
+    controller = UplinkController(initial_rate=5.0, update_interval=1000)
+    # 50 Hz for 2 seconds, at 5 records per second after the first
+    assert admitted(controller, frozen, 100, 0.02) == 11
+    assert controller.stats()["dropped"] == 89
+
+
+def test_additive_increase(frozen):
+    controller = UplinkController(initial_rate=5.0, increase=2.0, max_rate=8.0)
+    frozen.tick(1)
+    controller.admit()
+    assert controller.rate == 7.0
+    assert controller.batch_size == 7
+    frozen.tick(1)
+    controller.update()
+    assert controller.rate == 8.0
+
+
+def test_latency_decrease(frozen):
+    controller = UplinkController(initial_rate=40.0, target_latency=1.0)
+    controller.sent(1)
+    frozen.tick(2)
+    controller.acknowledged(1)
+    controller.update()
+    assert controller.rate == 20.0
+    assert controller.batch_interval == 2.0
+    assert controller.batch_size == 40
+    assert controller.stats()["latency_ms"] == 2000.0
+
+    # Back to normal once messages complete in time again
+    controller.sent(2)
+    frozen.tick(0.1)
+    controller.acknowledged(2)
+    controller.update()
+    assert controller.rate == 22.0
+    assert controller.batch_interval == 1.0
+
+
+def test_in_flight_decrease(frozen):
+    controller = UplinkController(initial_rate=40.0, max_in_flight=2, min_rate=15.0)
+    for mid in range(3):
+        controller.sent(mid)
+    controller.update()
+    assert controller.rate == 20.0
+    assert controller.stats()["in_flight"] == 3
+
+    # A message stuck past the target counts as congestion too
+    controller.acknowledged(0)
+    controller.acknowledged(1)
+    frozen.tick(1.5)
+    controller.update()
+    assert controller.rate == 15.0
+    assert controller.stats()["congested_updates"] == 2
+
+
+def test_lost_messages_time_out(frozen):
+    controller = UplinkController(target_latency=1.0)
+    controller.sent(1)
+    frozen.tick(11)
+    controller.update()
+    stats = controller.stats()
+    assert stats["in_flight"] == 0
+    assert stats["timeouts"] == 1
+
+
+def test_completion_before_sent(frozen):
+    controller = UplinkController()
+    controller.acknowledged(7)
+    controller.sent(7)
+    assert controller.stats()["in_flight"] == 0
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"target_latency": 0},
+        {"min_rate": 0},
+        {"initial_rate": 200.0},
+        {"decrease": 1.0},
+    ],
+)
+def test_invalid(kwargs):
+    with pytest.raises(ValueError):
+        UplinkController(**kwargs)
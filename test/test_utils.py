@@ -8,3 +8,5 @@ def test_get_env_flags(default_env):
     assert flags["DISABLE_LOCAL"] is False
     assert flags["DISABLE_DISPLAY"] is False
     assert flags["TESTING"] is True
+    assert flags["LOCAL_BACKGROUND"] is False
+    assert flags["REMOTE_ADAPTIVE"] is False